@@ -0,0 +1,170 @@
+"""
+Бенчмарк пайплайна консенсусного перевода без GPU.
+
+Поднимает mock_kobold (или использует уже работающий сервер через --base-url),
+прогоняет корпус в нескольких режимах и печатает предложения/с, p50/p95 задержки
+перевода и число вызовов модели на предложение.
+
+Режимы:
+  serial      — по одному предложению, варианты этапа 1 последовательно
+  concurrent  — по одному предложению, варианты этапа 1 параллельно
+  batched     — consensus_translate_batch, несколько абзацев одновременно
+  packed      — consensus_translate_batch(pack=True)
+  cached      — batched повторно по прогретому дисковому кэшу
+
+Корпус: текстовый файл (абзацы — строки, как input.txt) или JSON-экспорт истории
+(список строк или объектов с original_text, например ответ /api/stories/<id>/paragraphs/).
+
+Запуск:  python bench.py --corpus input.txt --limit 20 --latency 0.1 --slots 3
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import kobold_cpp_implimitation as kt
+from mock_kobold import start_mock_server
+
+MODES = ["serial", "concurrent", "batched", "packed", "cached"]
+
+
+def load_corpus(path: str, limit: Optional[int] = None) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            data = json.load(f)
+            if isinstance(data, dict):
+                data = data.get("paragraphs") or data.get("results") or []
+            items = [d["original_text"] if isinstance(d, dict) else d for d in data]
+        else:
+            items = f.read().splitlines()
+    paragraphs = [p.strip() for p in items if p and p.strip()]
+    return paragraphs[:limit] if limit else paragraphs
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def run_mode(mode: str, paragraphs: List[str], base_url: str, args, cache_path: str) -> Dict[str, Any]:
+    metrics = kt.TranslationMetrics()
+    cache = kt.TranslationCache(path=cache_path) if mode == "cached" else None
+    client = kt.KoboldClient(base_url=base_url, api_key=kt.DUMMY_API_KEY, cache=cache, metrics=metrics)
+    options = {"n_candidates": args.candidates, "agreement_threshold": args.agreement_threshold}
+
+    def sentence_by_sentence(concurrency: int) -> List[Dict[str, Any]]:
+        return [
+            kt.consensus_translate(p, args.target_lang, kobold_client=client, concurrency=concurrency,
+                                   min_candidates=args.candidates, **options)
+            for p in paragraphs
+        ]
+
+    def batch(pack: bool) -> List[Dict[str, Any]]:
+        return [r for _, r in kt.consensus_translate_batch(
+            paragraphs, args.target_lang, in_flight=args.in_flight, kobold_client=client,
+            pack=pack, concurrency=args.candidates, min_candidates=args.min_candidates, **options,
+        )]
+
+    if mode == "cached":
+        # Прогрев: первый проход наполняет кэш, измеряется второй
+        batch(pack=False)
+        metrics.reset()
+
+    started = time.monotonic()
+    if mode == "serial":
+        results = sentence_by_sentence(concurrency=1)
+    elif mode == "concurrent":
+        results = sentence_by_sentence(concurrency=args.candidates)
+    else:
+        results = batch(pack=(mode == "packed"))
+    elapsed = time.monotonic() - started
+
+    if cache is not None:
+        cache.close()
+    summary = metrics.summary()
+    latencies = [r["latency_s"] for r in results if "latency_s" in r]
+    n = len(paragraphs)
+    return {
+        "mode": mode,
+        "sentences": n,
+        "seconds": elapsed,
+        "sentences_per_s": n / elapsed if elapsed else 0.0,
+        "p50_ms": None if not latencies else percentile(latencies, 0.5) * 1000,
+        "p95_ms": None if not latencies else percentile(latencies, 0.95) * 1000,
+        "calls_per_sentence": summary["calls"] / n if n else 0.0,
+        "cache_hits": summary["cache_hits"],
+        "synthesis_skipped": sum(1 for r in results if r.get("synthesis_skipped")),
+    }
+
+
+def format_table(rows: List[Dict[str, Any]]) -> str:
+    def ms(v):
+        return "-" if v is None else f"{v:.0f}"
+    lines = [f"{'mode':<11} {'sent/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'calls/sent':>10} {'skipped':>8} {'cache':>6}"]
+    for r in rows:
+        lines.append(
+            f"{r['mode']:<11} {r['sentences_per_s']:>8.2f} {ms(r['p50_ms']):>8} {ms(r['p95_ms']):>8} "
+            f"{r['calls_per_sentence']:>10.2f} {r['synthesis_skipped']:>8} {r['cache_hits']:>6}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Бенчмарк consensus_translate на имитации KoboldCPP")
+    parser.add_argument("--corpus", default=os.path.join(here, "input.txt"))
+    parser.add_argument("--limit", type=int, default=20, help="Сколько абзацев корпуса брать (0 — все)")
+    parser.add_argument("--modes", default=",".join(MODES), help="Режимы через запятую")
+    parser.add_argument("--target-lang", default="Russian")
+    parser.add_argument("--candidates", type=int, default=kt.Config.CANDIDATES)
+    parser.add_argument("--min-candidates", type=int, default=kt.Config.MIN_CANDIDATES)
+    parser.add_argument("--agreement-threshold", type=float, default=kt.Config.AGREEMENT_THRESHOLD)
+    parser.add_argument("--in-flight", type=int, default=kt.Config.PARAGRAPHS_IN_FLIGHT)
+    parser.add_argument("--base-url", default=None, help="Уже работающий сервер вместо имитации")
+    parser.add_argument("--port", type=int, default=5055, help="Порт имитации")
+    parser.add_argument("--latency", type=float, default=0.1, help="Имитация: задержка до первого токена, с")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Имитация: токенов/с")
+    parser.add_argument("--slots", type=int, default=3, help="Имитация: одновременных запросов")
+    parser.add_argument("--disagree", type=float, default=0.3, help="Имитация: доля расходящихся вариантов")
+    parser.add_argument("--json", dest="json_path", default=None, help="Сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"неизвестные режимы: {', '.join(sorted(unknown))}")
+
+    paragraphs = load_corpus(args.corpus, args.limit or None)
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = start_mock_server(
+            port=args.port, latency=args.latency, token_rate=args.token_rate,
+            slots=args.slots, disagree=args.disagree,
+        )
+        base_url = f"http://127.0.0.1:{args.port}/v1"
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            for mode in modes:
+                rows.append(run_mode(mode, paragraphs, base_url, args, os.path.join(tmp, "cache.sqlite3")))
+        finally:
+            if server is not None:
+                server.shutdown()
+
+    print(f"Корпус: {args.corpus}, абзацев: {len(paragraphs)}")
+    print(format_table(rows))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
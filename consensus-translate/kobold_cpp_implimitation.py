@@ -1,10 +1,22 @@
 import openai
+import atexit
+import hashlib
+import json
+import logging
 import os
+import re
+import sqlite3
 import subprocess
+import threading
 import time
 import requests
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from contextlib import contextmanager
-from typing import Dict, Any
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("consensus_translate")
 
 # ==============================================================================
 # КОНФИГУРАЦИЯ
@@ -20,74 +32,251 @@ class Config:
     HOST = "127.0.0.1"
     PORT = 5001
 
+    # Пул серверов: по одному config.json (со своим портом) на экземпляр KoboldCPP.
+    SERVER_CONFIGS = [CONFIG_FILE_PATH]
+    SERVER_READY_TIMEOUT = 300
+    HEALTH_CHECK_INTERVAL = 5.0
+    MAX_RESTARTS = 5
+    # Не останавливать запущенные нами серверы по завершении работы,
+    # чтобы следующий запуск подключился к ним без повторной загрузки модели.
+    KEEP_SERVERS_RUNNING = False
+    # Куда такие серверы пишут вывод (koboldcpp-<порт>.log): читать его через pipe после
+    # нашего выхода некому, и сервер получил бы SIGPIPE на следующей записи в лог.
+    SERVER_LOG_DIR = "."
+
+    # Сколько вариантов перевода генерировать на этапе 1 и сколько из них
+    # отправлять одновременно (1 = последовательно, как раньше).
+    # Параллельные запросы имеют смысл, только если KoboldCPP обслуживает несколько слотов.
+    CANDIDATES = 3
+    CONCURRENCY = 3
+
+    # Сколько абзацев одновременно находится в работе при пакетном переводе.
+    PARAGRAPHS_IN_FLIGHT = 4
+
+    # Упаковка нескольких абзацев в один запрос.
+    # CONTEXT_SIZE должен совпадать с contextsize в config.json.
+    CONTEXT_SIZE = 4096
+    # Запас под системный промпт и служебную разметку (в токенах).
+    PACK_PROMPT_RESERVE = 512
+
+    # Если все варианты этапа 1 похожи друг на друга не меньше чем на этот порог
+    # (0..1, сходство по символьным триграммам), синтез пропускается. None — всегда синтезировать.
+    AGREEMENT_THRESHOLD = 0.92
+
+    # Адаптивный этап 1: сначала MIN_CANDIDATES вариантов, следующие — только если они расходятся
+    # (до CANDIDATES). Варианты, не успевшие за CANDIDATE_LATENCY_BUDGET секунд, отбрасываются.
+    MIN_CANDIDATES = 2
+    CANDIDATE_LATENCY_BUDGET = 60.0
+
+    # Таймаут одного HTTP-запроса к модели и повторы при временных ошибках соединения.
+    REQUEST_TIMEOUT = 120.0
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 1.0  # секунды; растёт вдвое с каждой попыткой
+
+    # Логирование и метрики. Тексты промптов и ответов пишутся в лог (уровень DEBUG)
+    # только при LOG_TEXTS = True — на длинных пакетах это заметно тормозит и раздувает логи.
+    LOG_LEVEL = "INFO"
+    LOG_TEXTS = False
+    METRICS_PORT = 9464
+
+    # Дисковый кэш ответов модели (SQLite). Ключ — хэш промптов, температуры и модели.
+    CACHE_ENABLED = True
+    CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "translation_cache.sqlite3")
+    CACHE_MAX_ENTRIES = 200_000
+    # Кэшировать ли вызовы с temperature > 0. Варианты этапа 1 кэшируются
+    # по номеру варианта, поэтому разнообразие внутри одного прогона сохраняется.
+    CACHE_SAMPLING = True
+
 # ==============================================================================
-# ФИНАЛЬНАЯ ВЕРСИЯ КОНТЕКСТНОГО МЕНЕДЖЕРА
+# ПУЛ СЕРВЕРОВ KOBOLDCPP
 # ==============================================================================
-@contextmanager
-def kobold_cpp_server():
+class KoboldServer:
     """
-    Контекстный менеджер для запуска сервера KoboldCPP с использованием файла конфигурации.
-    Это самый надежный метод.
+    Один экземпляр KoboldCPP со своим config.json (хост и порт берутся из него).
+    Если порт уже отвечает, подключаемся к работающему серверу вместо запуска нового.
+    detached=True — сервер переживёт наш процесс: вывод идёт в файл в log_dir, а не в pipe.
     """
-    server_process = None
-    try:
-        if not os.path.exists(Config.KOBOLDCPP_EXECUTABLE_PATH):
-            raise FileNotFoundError(f"Исполняемый файл KoboldCPP не найден: {Config.KOBOLDCPP_EXECUTABLE_PATH}")
-        if not os.path.exists(Config.CONFIG_FILE_PATH):
-            raise FileNotFoundError(f"Файл конфигурации не найден: {Config.CONFIG_FILE_PATH}")
-
-        # Формируем простую и надежную команду
-        command = [
-            Config.KOBOLDCPP_EXECUTABLE_PATH,
-            "--config", Config.CONFIG_FILE_PATH,
-        ]
+    def __init__(self, config_path: str, executable: str = Config.KOBOLDCPP_EXECUTABLE_PATH,
+                 detached: bool = False, log_dir: str = Config.SERVER_LOG_DIR):
+        self.config_path = config_path
+        self.executable = executable
+        self.detached = detached
+        self.log_dir = log_dir
+        with open(config_path, encoding="utf-8") as f:
+            cfg = json.load(f)
+        self.host = cfg.get("host") or Config.HOST
+        self.port = int(cfg.get("port") or Config.PORT)
+        self.process: Optional[subprocess.Popen] = None
+        self.attached = False
+        self.healthy = False
+        self.restarts = 0
 
-        print("="*50)
-        print("Запускаю сервер KoboldCPP с файлом конфигурации...")
-        print(f"Команда: {' '.join(command)}")
+    @property
+    def root_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
 
-        server_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='replace')
-        
-        print("Ожидание готовности API сервера...")
+    @property
+    def base_url(self) -> str:
+        return f"{self.root_url}/v1"
+
+    def is_healthy(self, timeout: float = 2) -> bool:
+        try:
+            return requests.get(f"{self.root_url}/api/v1/model", timeout=timeout).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def start(self) -> None:
+        if self.is_healthy():
+            logger.info("Сервер KoboldCPP на порту %d уже запущен, подключаюсь к нему.", self.port)
+            self.attached = True
+            self.healthy = True
+            return
+        if not os.path.exists(self.executable):
+            raise FileNotFoundError(f"Исполняемый файл KoboldCPP не найден: {self.executable}")
+
+        command = [self.executable, "--config", self.config_path]
+        logger.info("Запускаю сервер KoboldCPP: %s", " ".join(command))
+        self.attached = False
+        if self.detached:
+            log_path = os.path.join(self.log_dir, f"koboldcpp-{self.port}.log")
+            logger.info("Вывод KoboldCPP на порту %d пишется в %s", self.port, log_path)
+            with open(log_path, "ab") as log:
+                # Своя сессия: Ctrl+C в нашем терминале не должен останавливать оставляемый сервер
+                self.process = subprocess.Popen(
+                    command, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                    start_new_session=True,
+                )
+            return
+        self.process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, encoding='utf-8', errors='replace',
+        )
+        # Вывод читаем в отдельном потоке, чтобы readline() не блокировал проверку готовности
+        threading.Thread(target=self._drain_output, args=(self.process,), daemon=True).start()
+
+    def _drain_output(self, process: subprocess.Popen) -> None:
+        for line in process.stdout:
+            logger.debug("[KoboldCPP:%d]: %s", self.port, line.rstrip())
+
+    def wait_ready(self, timeout: float) -> None:
         start_time = time.time()
-        server_ready = False
-        while time.time() - start_time < 300:
-            if server_process.poll() is not None:
-                print("\n[ОШИБКА]: Процесс KoboldCPP неожиданно завершился. Вывод:")
-                print(server_process.stdout.read())
-                raise RuntimeError("Не удалось запустить сервер KoboldCPP.")
-            
-            try:
-                line = server_process.stdout.readline()
-                if line:
-                    print(f"[KoboldCPP]: {line.strip()}")
-                
-                response = requests.get(f"http://{Config.HOST}:{Config.PORT}/api/v1/model", timeout=2)
-                if response.status_code == 200:
-                    print("\nСервер KoboldCPP готов и отвечает.")
-                    server_ready = True
-                    break
-            except requests.ConnectionError:
-                time.sleep(1)
-            except Exception:
-                pass
+        while time.time() - start_time < timeout:
+            if self.process is not None and self.process.poll() is not None:
+                raise RuntimeError(f"Процесс KoboldCPP на порту {self.port} неожиданно завершился.")
+            if self.is_healthy():
+                logger.info("Сервер KoboldCPP на порту %d готов и отвечает.", self.port)
+                self.healthy = True
+                return
+            time.sleep(1)
+        raise RuntimeError(f"Сервер KoboldCPP на порту {self.port} не запустился за {timeout:.0f} секунд.")
 
-        if not server_ready:
-            raise RuntimeError("Сервер KoboldCPP не запустился в течение 120 секунд.")
+    def crashed(self) -> bool:
+        return self.process is not None and self.process.poll() is not None
 
-        yield
-        
+    def stop(self) -> None:
+        self.healthy = False
+        if self.process is None or self.process.poll() is not None:
+            return
+        logger.info("Останавливаю сервер KoboldCPP на порту %d...", self.port)
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            logger.warning("Сервер не остановился, принудительное завершение.")
+            self.process.kill()
+
+
+class KoboldServerPool:
+    """
+    Долгоживущий менеджер одного или нескольких серверов KoboldCPP.
+
+    Подключается к уже работающим экземплярам, запускает недостающие,
+    в фоне следит за их здоровьем и перезапускает упавшие процессы.
+    next_base_url() раздаёт адреса здоровых серверов по кругу.
+    С keep_running=True свои процессы не останавливаются при закрытии —
+    следующий запуск просто подключится к ним и не будет заново грузить модель.
+    """
+    def __init__(self, config_paths: List[str], ready_timeout: float = Config.SERVER_READY_TIMEOUT,
+                 health_interval: float = Config.HEALTH_CHECK_INTERVAL, max_restarts: int = Config.MAX_RESTARTS,
+                 keep_running: bool = Config.KEEP_SERVERS_RUNNING, executable: str = Config.KOBOLDCPP_EXECUTABLE_PATH):
+        for path in config_paths:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Файл конфигурации не найден: {path}")
+        self.servers = [KoboldServer(path, executable=executable, detached=keep_running) for path in config_paths]
+        self.ready_timeout = ready_timeout
+        self.health_interval = health_interval
+        self.max_restarts = max_restarts
+        self.keep_running = keep_running
+        self._rr = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._supervisor: Optional[threading.Thread] = None
+
+    def start(self) -> "KoboldServerPool":
+        for server in self.servers:
+            server.start()
+        for server in self.servers:
+            server.wait_ready(self.ready_timeout)
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+        return self
+
+    def _supervise(self) -> None:
+        while not self._stop.wait(self.health_interval):
+            for server in self.servers:
+                if server.crashed() or (server.attached and not server.is_healthy()):
+                    server.healthy = False
+                    if server.restarts >= self.max_restarts:
+                        continue
+                    server.restarts += 1
+                    logger.warning("Сервер KoboldCPP на порту %d недоступен, перезапуск #%d...", server.port, server.restarts)
+                    try:
+                        server.start()
+                        server.wait_ready(self.ready_timeout)
+                    except Exception as e:
+                        logger.error("Не удалось перезапустить сервер на порту %d: %s", server.port, e)
+                else:
+                    server.healthy = server.is_healthy()
+
+    def healthy_servers(self) -> List[KoboldServer]:
+        return [s for s in self.servers if s.healthy]
+
+    def next_base_url(self) -> str:
+        healthy = self.healthy_servers()
+        if not healthy:
+            raise RuntimeError("Нет доступных серверов KoboldCPP.")
+        with self._lock:
+            server = healthy[self._rr % len(healthy)]
+            self._rr += 1
+        return server.base_url
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._supervisor is not None:
+            self._supervisor.join(timeout=self.health_interval + 1)
+        if not self.keep_running:
+            for server in self.servers:
+                server.stop()
+
+    def __enter__(self) -> "KoboldServerPool":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+@contextmanager
+def kobold_cpp_server(config_paths: Optional[List[str]] = None):
+    """
+    Контекстный менеджер для запуска (или подключения к уже запущенным) серверам KoboldCPP.
+    Возвращает KoboldServerPool.
+    """
+    pool = KoboldServerPool(config_paths or Config.SERVER_CONFIGS)
+    try:
+        pool.start()
+        yield pool
     finally:
-        if server_process:
-            print("\nОстанавливаю сервер KoboldCPP...")
-            server_process.terminate()
-            try:
-                server_process.wait(timeout=10)
-            except subprocess.TimeoutExpired:
-                print("Сервер не остановился, принудительное завершение.")
-                server_process.kill()
-            print("Сервер KoboldCPP остановлен.")
-        print("="*50)
+        pool.close()
 
 # ==============================================================================
 # Основная логика перевода (ОСТАЕТСЯ БЕЗ ИЗМЕНЕНИЙ)
@@ -100,34 +289,734 @@ KOBOLD_CPP_BASE_URL = f"http://{Config.HOST}:{Config.PORT}/v1"
 DUMMY_MODEL_NAME = "local-model" 
 DUMMY_API_KEY = "unused"
 
+class TranslationCache:
+    """
+    Кэш ответов модели в SQLite с ограничением по числу записей (LRU-вытеснение).
+    Безопасен для использования из нескольких потоков.
+    """
+    def __init__(self, path: str = Config.CACHE_PATH, max_entries: int = Config.CACHE_MAX_ENTRIES,
+                 cache_sampling: bool = Config.CACHE_SAMPLING):
+        self.path = path
+        self.max_entries = max_entries
+        self.cache_sampling = cache_sampling
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions(last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, user_prompt: str, temperature: float, variant: int = 0) -> str:
+        raw = json.dumps([model, system_prompt, user_prompt, round(temperature, 4), variant], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def should_cache(self, temperature: float) -> bool:
+        return temperature <= 0 or self.cache_sampling
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM completions WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, response, last_used) VALUES (?, ?, ?)",
+                (key, response, time.time()),
+            )
+            if not exists:
+                self._size += 1
+            if self._size > self.max_entries:
+                # Вытесняем давно не использованные записи
+                excess = self._size - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM completions WHERE key IN ("
+                    " SELECT key FROM completions ORDER BY last_used ASC LIMIT ?)",
+                    (excess,),
+                )
+                self._size -= excess
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": self._size}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+# ==============================================================================
+# МЕТРИКИ
+# ==============================================================================
+class TranslationMetrics:
+    """
+    Потокобезопасный сбор метрик пайплайна: вызовы модели (задержка, токены из usage),
+    попадания в кэш, длительность этапов и переводов целиком.
+    Отдаётся как JSON (summary) или в текстовом формате Prometheus (to_prometheus).
+    """
+    def __init__(self, window: int = 10_000):
+        self._lock = threading.Lock()
+        self._call_latencies: deque = deque(maxlen=window)
+        self._sentence_latencies: deque = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Откуда взяты токены вызова: usage сервера или оценка (estimate_tokens / число фрагментов)
+        self.usage_reported = 0
+        self.usage_estimated = 0
+        self.call_seconds = 0.0
+        self.sentences = 0
+        self.synthesis_skipped = 0
+        self.stage_seconds: Dict[str, float] = {}
+        self.stage_counts: Dict[str, int] = {}
+
+    def record_call(self, latency_s: float, prompt_tokens: int, completion_tokens: int,
+                    estimated: bool = False) -> None:
+        with self._lock:
+            self.calls += 1
+            if estimated:
+                self.usage_estimated += 1
+            else:
+                self.usage_reported += 1
+            self.call_seconds += latency_s
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self._call_latencies.append(latency_s)
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def record_cache(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+            self.stage_counts[stage] = self.stage_counts.get(stage, 0) + 1
+
+    def record_sentence(self, seconds: float, synthesis_skipped: bool) -> None:
+        with self._lock:
+            self.sentences += 1
+            self.synthesis_skipped += int(synthesis_skipped)
+            self._sentence_latencies.append(seconds)
+
+    @staticmethod
+    def _percentile(values: List[float], q: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = list(self._call_latencies)
+            sentences = list(self._sentence_latencies)
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "usage_reported": self.usage_reported,
+                "usage_estimated": self.usage_estimated,
+                "tokens_per_s": self.completion_tokens / self.call_seconds if self.call_seconds else 0.0,
+                "call_latency_p50_ms": self._percentile(calls, 0.5) * 1000,
+                "call_latency_p95_ms": self._percentile(calls, 0.95) * 1000,
+                "sentences": self.sentences,
+                "synthesis_skipped": self.synthesis_skipped,
+                "sentence_latency_p50_ms": self._percentile(sentences, 0.5) * 1000,
+                "sentence_latency_p95_ms": self._percentile(sentences, 0.95) * 1000,
+                "stage_seconds": dict(self.stage_seconds),
+                "stage_counts": dict(self.stage_counts),
+            }
+
+    def to_prometheus(self, prefix: str = "consensus_translate") -> str:
+        s = self.summary()
+        lines = []
+        for name in ("calls", "errors", "cache_hits", "cache_misses", "prompt_tokens",
+                     "completion_tokens", "usage_reported", "usage_estimated", "sentences", "synthesis_skipped"):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {s[name]}")
+        for name in ("tokens_per_s", "call_latency_p50_ms", "call_latency_p95_ms",
+                     "sentence_latency_p50_ms", "sentence_latency_p95_ms"):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {s[name]:.3f}")
+        lines.append(f"# TYPE {prefix}_stage_seconds_total counter")
+        for stage, seconds in sorted(s["stage_seconds"].items()):
+            lines.append(f'{prefix}_stage_seconds_total{{stage="{stage}"}} {seconds:.3f}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        self.__init__(self._call_latencies.maxlen)
+
+
+# Метрики по умолчанию для всех клиентов процесса
+METRICS = TranslationMetrics()
+
+def serve_metrics(port: int = Config.METRICS_PORT, metrics: TranslationMetrics = METRICS,
+                  host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Поднимает в фоне HTTP-эндпоинт: /metrics — формат Prometheus, /metrics.json — JSON.
+    Остановить: server.shutdown().
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(metrics.summary()), "application/json"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logger.debug("metrics: " + format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Метрики доступны на http://%s:%d/metrics", host, port)
+    return server
+
+# Ошибки, после которых запрос имеет смысл повторить
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,  # включает APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
 class KoboldClient:
-    def __init__(self, base_url: str, api_key: str):
-        self.client = openai.OpenAI(base_url=base_url, api_key=api_key)
-    def complete(self, system_prompt: str, user_prompt: str, temperature: float = 0.7) -> str:
-        # ... (код без изменений)
-        print(f"\n--- Запрос к KoboldCPP ---\nSYSTEM: {system_prompt}\nUSER: {user_prompt}\n--------------------------\n")
-        chat_completion = self.client.chat.completions.create(
-            model=DUMMY_MODEL_NAME,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=temperature,
+    """
+    Клиент OpenAI-совместимого API KoboldCPP.
+    С pool запросы распределяются по кругу между здоровыми серверами пула.
+    """
+    def __init__(self, base_url: str, api_key: str, cache: Optional[TranslationCache] = None,
+                 pool: Optional[KoboldServerPool] = None, timeout: float = Config.REQUEST_TIMEOUT,
+                 max_retries: int = Config.MAX_RETRIES, retry_backoff: float = Config.RETRY_BACKOFF,
+                 metrics: Optional[TranslationMetrics] = None):
+        self.api_key = api_key
+        self.metrics = metrics if metrics is not None else METRICS
+        self.base_url = base_url
+        self.cache = cache
+        self.pool = pool
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._clients: Dict[str, openai.OpenAI] = {}
+        self._clients_lock = threading.Lock()
+        self._model_identity = None
+        self.client = self._client_for(base_url)
+
+    def _client_for(self, base_url: str) -> openai.OpenAI:
+        with self._clients_lock:
+            if base_url not in self._clients:
+                # Повторы делаем сами (_create), чтобы считать их и переключаться между серверами пула
+                self._clients[base_url] = openai.OpenAI(
+                    base_url=base_url, api_key=self.api_key, timeout=self.timeout, max_retries=0,
+                )
+            return self._clients[base_url]
+
+    def _next_client(self) -> openai.OpenAI:
+        if self.pool is None:
+            return self.client
+        return self._client_for(self.pool.next_base_url())
+
+    def model_identity(self) -> Optional[str]:
+        """
+        Имя загруженной модели из /api/v1/model (входит в ключ кэша).
+        None — имя узнать не удалось: общий заглушечный ключ смешал бы ответы разных моделей.
+        """
+        if self._model_identity is None:
+            root = self.base_url.rstrip("/")
+            if root.endswith("/v1"):
+                root = root[:-3]
+            try:
+                response = requests.get(f"{root}/api/v1/model", timeout=5)
+                response.raise_for_status()
+                self._model_identity = response.json().get("result") or None
+            except (requests.RequestException, ValueError):
+                # Не запоминаем неудачу: спросим ещё раз при следующем вызове
+                return None
+        return self._model_identity
+
+    def _cache_key(self, system_prompt: str, user_prompt: str, temperature: float,
+                   variant: int, use_cache: Optional[bool]) -> Optional[str]:
+        if self.cache is None:
+            return None
+        if not (use_cache if use_cache is not None else self.cache.should_cache(temperature)):
+            return None
+        model = self.model_identity()
+        if model is None:
+            logger.debug("Модель сервера неизвестна, кэш для запроса не используется")
+            return None
+        return TranslationCache.make_key(model, system_prompt, user_prompt, temperature, variant)
+
+    def _create(self, call_info: Optional[Dict[str, Any]], **params):
+        """chat.completions.create с повторами и экспоненциальной задержкой при временных ошибках."""
+        attempt = 0
+        while True:
+            try:
+                return self._next_client().chat.completions.create(model=DUMMY_MODEL_NAME, **params)
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                attempt += 1
+                if call_info is not None:
+                    call_info["retries"] = attempt
+                logger.warning("KoboldCPP: %s, повтор #%d через %.1f с", type(e).__name__, attempt, delay)
+                time.sleep(delay)
+
+    @staticmethod
+    def _messages(system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+
+    def _cache_get(self, cache_key: str) -> Optional[str]:
+        cached = self.cache.get(cache_key)
+        self.metrics.record_cache(cached is not None)
+        if cached is not None:
+            logger.debug("Ответ из кэша (%s)", cache_key[:12])
+        return cached
+
+    @staticmethod
+    def _log_request(system_prompt: str, user_prompt: str) -> None:
+        if Config.LOG_TEXTS and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Запрос к KoboldCPP\nSYSTEM: %s\nUSER: %s", system_prompt, user_prompt)
+
+    def _record_call(self, latency: float, prompt_tokens: int, completion_tokens: int, response_text: str,
+                     estimated: bool = False) -> None:
+        self.metrics.record_call(latency, prompt_tokens, completion_tokens, estimated=estimated)
+        logger.debug(
+            "KoboldCPP: %.0f ms, prompt=%d, completion=%d (%s), %.1f tok/s",
+            latency * 1000, prompt_tokens, completion_tokens, "оценка" if estimated else "usage",
+            completion_tokens / latency if latency else 0.0,
         )
+        if Config.LOG_TEXTS and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Ответ от KoboldCPP\n%s", response_text)
+
+    def complete(self, system_prompt: str, user_prompt: str, temperature: float = 0.7,
+                 variant: int = 0, use_cache: Optional[bool] = None,
+                 call_info: Optional[Dict[str, Any]] = None) -> str:
+        """
+        variant различает варианты одного и того же запроса в кэше (например, кандидатов этапа 1).
+        use_cache=False принудительно обходит кэш, None — решает TranslationCache.should_cache.
+        В call_info (если передан) записывается число повторов ("retries").
+        """
+        cache_key = self._cache_key(system_prompt, user_prompt, temperature, variant, use_cache)
+        if cache_key is not None:
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return cached
+
+        self._log_request(system_prompt, user_prompt)
+        started = time.monotonic()
+        try:
+            chat_completion = self._create(
+                call_info,
+                messages=self._messages(system_prompt, user_prompt),
+                temperature=temperature,
+            )
+        except Exception:
+            self.metrics.record_error()
+            raise
+        latency = time.monotonic() - started
         response_text = chat_completion.choices[0].message.content
-        print(f"--- Ответ от KoboldCPP ---\n{response_text}\n--------------------------\n")
+        usage = chat_completion.usage
+        self._record_call(
+            latency,
+            usage.prompt_tokens if usage else estimate_tokens(system_prompt + user_prompt),
+            usage.completion_tokens if usage else estimate_tokens(response_text),
+            response_text,
+            estimated=usage is None,
+        )
+        if cache_key is not None:
+            self.cache.put(cache_key, response_text)
         return response_text
 
+    def stream(self, system_prompt: str, user_prompt: str, temperature: float = 0.7,
+               stop: Optional[Callable[[str], bool]] = None,
+               variant: int = 0, use_cache: Optional[bool] = None,
+               call_info: Optional[Dict[str, Any]] = None,
+               cancel: Optional[threading.Event] = None) -> Iterator[str]:
+        """
+        Потоковый вариант complete: отдаёт фрагменты ответа по мере генерации (stream=True).
+        stop получает накопленный текст; как только он вернёт True, соединение закрывается
+        и сервер прекращает генерацию. В кэш попадает текст до точки остановки.
+
+        cancel — отмена извне: поток закрывается, ничего не кэшируется и не учитывается в метриках.
+        Открытый ответ кладётся в call_info["response"], чтобы другой поток мог закрыть его,
+        не дожидаясь первого фрагмента (пока сервер обрабатывает промпт).
+        """
+        cache_key = self._cache_key(system_prompt, user_prompt, temperature, variant, use_cache)
+        if cache_key is not None:
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        self._log_request(system_prompt, user_prompt)
+        started = time.monotonic()
+        try:
+            response = self._create(
+                call_info,
+                messages=self._messages(system_prompt, user_prompt),
+                temperature=temperature,
+                stream=True,
+                # Последним фрагментом сервер присылает usage (без choices)
+                stream_options={"include_usage": True},
+            )
+        except Exception:
+            self.metrics.record_error()
+            raise
+        if call_info is not None:
+            call_info["response"] = response
+        if cancel is not None and cancel.is_set():
+            response.close()
+            return
+        parts = []
+        usage = None
+        try:
+            for chunk in response:
+                if cancel is not None and cancel.is_set():
+                    break
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                parts.append(delta)
+                yield delta
+                if stop is not None and stop("".join(parts)):
+                    break
+        finally:
+            response.close()
+        if cancel is not None and cancel.is_set():
+            return
+
+        latency = time.monotonic() - started
+        response_text = "".join(parts)
+        # usage не пришёл (сервер его не шлёт или поток остановлен по stop до последнего фрагмента):
+        # считаем фрагменты — KoboldCPP отдаёт примерно по токену на фрагмент
+        self._record_call(
+            latency,
+            usage.prompt_tokens if usage else estimate_tokens(system_prompt + user_prompt),
+            usage.completion_tokens if usage else len(parts),
+            response_text,
+            estimated=usage is None,
+        )
+        if cache_key is not None:
+            self.cache.put(cache_key, response_text)
+
+def make_client(base_url: str = KOBOLD_CPP_BASE_URL, pool: Optional[KoboldServerPool] = None) -> KoboldClient:
+    """KoboldClient с настройками по умолчанию (включая дисковый кэш, если он включён в Config)."""
+    cache = TranslationCache() if Config.CACHE_ENABLED else None
+    if pool is not None:
+        base_url = pool.servers[0].base_url
+    return KoboldClient(base_url=base_url, api_key=DUMMY_API_KEY, cache=cache, pool=pool)
+
+_default_client: Optional[KoboldClient] = None
+_default_client_lock = threading.Lock()
+
+def default_client() -> KoboldClient:
+    """
+    Общий KoboldClient для вызовов consensus_translate* без kobold_client: один на процесс,
+    чтобы не открывать новое соединение с кэшем на каждый вызов. Кэш закрывается при выходе.
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = make_client()
+            if _default_client.cache is not None:
+                atexit.register(_default_client.cache.close)
+        return _default_client
+
 def strip_outer_brackets(s: str) -> str:
     return s.strip().strip('[]')
 
-def consensus_translate(sentence: str, target_lang: str, source_lang: str = "English") -> Dict[str, Any]:
-    # ... (код без изменений)
-    kobold_client = KoboldClient(base_url=KOBOLD_CPP_BASE_URL, api_key=DUMMY_API_KEY)
+def code_block_closed(text: str) -> bool:
+    """True, когда в тексте есть и открывающий, и закрывающий ``` блока кода."""
+    start = text.find("```")
+    return start != -1 and text.find("```", start + 3) != -1
+
+def extract_code_block(text: str) -> str:
+    """Содержимое первого Markdown-блока кода; если блока нет — весь текст."""
+    start = text.find("```")
+    if start == -1:
+        return text
+    end = text.find("```", start + 3)
+    if end == -1:
+        return text
+    return text[start + 3:end].strip()
+
+def _normalize_for_compare(text: str) -> str:
+    # Регистр, пунктуация, кавычки и ё/е на решение «совпали ли варианты» не влияют
+    text = re.sub(r"[^\w\s]", " ", text.lower().replace("ё", "е"))
+    return " ".join(text.split())
+
+def _char_ngrams(text: str, n: int = 3) -> Dict[str, int]:
+    grams: Dict[str, int] = {}
+    padded = f" {text} "
+    for i in range(max(1, len(padded) - n + 1)):
+        gram = padded[i:i + n]
+        grams[gram] = grams.get(gram, 0) + 1
+    return grams
+
+def candidate_similarity(a: str, b: str) -> float:
+    """Сходство двух переводов 0..1: коэффициент Дайса по символьным триграммам после нормализации."""
+    a, b = _normalize_for_compare(a), _normalize_for_compare(b)
+    if a == b:
+        return 1.0
+    ga, gb = _char_ngrams(a), _char_ngrams(b)
+    overlap = sum(min(count, gb.get(gram, 0)) for gram, count in ga.items())
+    total = sum(ga.values()) + sum(gb.values())
+    return 2 * overlap / total if total else 0.0
+
+def agreed_candidate(translations: List[str], threshold: Optional[float] = Config.AGREEMENT_THRESHOLD) -> Optional[str]:
+    """
+    Если все варианты попарно сходятся не хуже threshold, возвращает «средний» из них
+    (с максимальным суммарным сходством с остальными), иначе None.
+    """
+    if threshold is None or len(translations) < 2:
+        return None
+    n = len(translations)
+    scores = [0.0] * n
+    for i in range(n):
+        for j in range(i + 1, n):
+            sim = candidate_similarity(translations[i], translations[j])
+            if sim < threshold:
+                return None
+            scores[i] += sim
+            scores[j] += sim
+    return translations[max(range(n), key=lambda i: scores[i])]
+
+def stream_synthesis(
+    kobold_client: KoboldClient,
+    system_prompt: str,
+    user_prompt: str,
+    on_token: Optional[Callable[[str], None]] = None,
+    call_info: Optional[Dict[str, Any]] = None,
+) -> str:
+    # Ответ нужен только до закрывающего ``` — дальше модель обычно рассуждает,
+    # поэтому останавливаем генерацию сразу после конца блока кода.
+    parts = []
+    for token in kobold_client.stream(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        temperature=0.5,
+        stop=code_block_closed,
+        call_info=call_info,
+    ):
+        parts.append(token)
+        if on_token is not None:
+            on_token(token)
+    return "".join(parts)
+
+def synthesize(
+    kobold_client: KoboldClient,
+    sentence: str,
+    translations: List[str],
+    target_lang: str,
+    source_lang: str = "English",
+    on_token: Optional[Callable[[str], None]] = None,
+    call_info: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Этап 2: синтез итогового перевода из вариантов."""
+    eval_system_prompt = (
+        f"You are an expert editor. Synthesize a new translation from {source_lang} to {target_lang} "
+        f"by combining the strengths of the provided translations. Focus on idiomatic and natural phrasing. "
+        f"First, provide a brief reasoning (1-2 sentences). Then, provide the final translation inside a Markdown code block."
+    )
+    translations_formatted = "\n".join(f"- \"{t}\"" for t in translations)
+    eval_user_prompt = (
+        f"Original text: \"{sentence}\"\n\n"
+        f"Translations to synthesize:\n{translations_formatted}"
+    )
+    eval_response = stream_synthesis(kobold_client, eval_system_prompt, eval_user_prompt, on_token, call_info)
+    return strip_outer_brackets(extract_code_block(eval_response))
+
+def generate_candidates(
+    kobold_client: KoboldClient,
+    system_prompt: str,
+    user_prompt: str,
+    n: int = Config.CANDIDATES,
+    concurrency: int = Config.CONCURRENCY,
+    temperature: float = 0.8,
+    raw: bool = False,
+) -> List[str]:
+    """
+    Запрашивает у модели n вариантов перевода.
+    При concurrency > 1 запросы уходят параллельно через ограниченный пул потоков,
+    порядок результатов совпадает с порядком запросов.
+    raw=True возвращает ответы как есть, без strip_outer_brackets.
+    """
+    post = (lambda t: t) if raw else strip_outer_brackets
+    if concurrency <= 1 or n <= 1:
+        results = []
+        for i in range(n):
+            results.append(kobold_client.complete(system_prompt, user_prompt, temperature, variant=i))
+        return [post(t) for t in results]
+
+    logger.debug("%d запросов на перевод (параллельно, не более %d одновременно)", n, concurrency)
+    with ThreadPoolExecutor(max_workers=min(n, concurrency)) as pool:
+        futures = [
+            pool.submit(kobold_client.complete, system_prompt, user_prompt, temperature, variant=i)
+            for i in range(n)
+        ]
+        return [post(f.result()) for f in futures]
+
+def generate_candidates_adaptive(
+    kobold_client: KoboldClient,
+    system_prompt: str,
+    user_prompt: str,
+    n_max: int = Config.CANDIDATES,
+    n_start: int = Config.MIN_CANDIDATES,
+    concurrency: int = Config.CONCURRENCY,
+    latency_budget: Optional[float] = Config.CANDIDATE_LATENCY_BUDGET,
+    agreement_threshold: Optional[float] = Config.AGREEMENT_THRESHOLD,
+    temperature: float = 0.8,
+) -> Tuple[List[str], Dict[str, int]]:
+    """
+    Адаптивный этап 1: сначала n_start вариантов, затем по одному дополнительному
+    (до n_max), пока имеющиеся варианты расходятся.
+
+    Варианты, не готовые к концу latency_budget, отбрасываются (если есть хотя бы один готовый):
+    запросы идут потоком, и у отставших соединение закрывается — сервер перестаёт генерировать,
+    а не держит слот до REQUEST_TIMEOUT; ещё не начатые запросы отменяются. Упавший после всех
+    повторов запрос тоже отбрасывается, пока есть другие варианты. Возвращает варианты в порядке номеров и статистику
+    {"requested", "retries", "stragglers", "failed"}.
+    """
+    if agreement_threshold is None:
+        # Сравнивать не с чем — сразу просим все варианты
+        n_start = n_max
+    n_start = max(1, min(n_start, n_max))
+    stats = {"requested": 0, "retries": 0, "stragglers": 0, "failed": 0}
+    results: Dict[int, str] = {}
+    deadline = time.monotonic() + latency_budget if latency_budget else None
+
+    cancel = threading.Event()
+    infos: Dict[int, Dict[str, Any]] = {}
+
+    def run(variant: int) -> Tuple[Optional[str], Dict[str, Any], Optional[Exception]]:
+        info = infos[variant]
+        try:
+            text = "".join(kobold_client.stream(
+                system_prompt, user_prompt, temperature, variant=variant, call_info=info, cancel=cancel,
+            ))
+        except Exception as e:
+            return None, info, e
+        return strip_outer_brackets(text), info, None
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(concurrency, n_max)))
+    futures: Dict[Any, int] = {}
+
+    def submit(variant: int) -> None:
+        infos[variant] = {}
+        futures[pool.submit(run, variant)] = variant
+        stats["requested"] += 1
+
+    try:
+        for variant in range(n_start):
+            submit(variant)
+        next_variant = n_start
+        while futures:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if results:
+                    break
+                # Бюджет исчерпан, но вариантов нет совсем — ждём первый (его ограничивает REQUEST_TIMEOUT)
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                variant = futures.pop(future)
+                text, info, error = future.result()
+                stats["retries"] += info.get("retries", 0)
+                if error is not None:
+                    stats["failed"] += 1
+                    if not futures and not results and next_variant >= n_max:
+                        raise error
+                    logger.warning("Вариант #%d не получен: %s", variant + 1, error)
+                    continue
+                results[variant] = text
+            if not futures and next_variant < n_max:
+                current = [results[v] for v in sorted(results)]
+                if len(current) < 2 or agreed_candidate(current, agreement_threshold) is None:
+                    submit(next_variant)
+                    next_variant += 1
+        stats["stragglers"] = len(futures)
+    finally:
+        # Отставшие сами выйдут из цикла по cancel; закрытие ответа обрывает и ожидание первого фрагмента.
+        # Ответ, открытый уже после этого, stream закроет сразу, увидев cancel
+        cancel.set()
+        for future, variant in futures.items():
+            future.cancel()
+            response = infos[variant].get("response")
+            if response is not None:
+                try:
+                    response.close()
+                except Exception:
+                    pass
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return [results[v] for v in sorted(results)], stats
+
+def consensus_translate(
+    sentence: str,
+    target_lang: str,
+    source_lang: str = "English",
+    n_candidates: int = Config.CANDIDATES,
+    concurrency: int = Config.CONCURRENCY,
+    kobold_client: Optional[KoboldClient] = None,
+    on_token: Optional[Callable[[str], None]] = None,
+    agreement_threshold: Optional[float] = Config.AGREEMENT_THRESHOLD,
+    min_candidates: int = Config.MIN_CANDIDATES,
+    latency_budget: Optional[float] = Config.CANDIDATE_LATENCY_BUDGET,
+) -> Dict[str, Any]:
+    """
+    on_token вызывается для каждого фрагмента синтезированного ответа (этап 2),
+    например, чтобы показывать частичный перевод в интерфейсе.
+    Если варианты этапа 1 совпадают (см. agreed_candidate), этап 2 пропускается
+    и в результате "synthesis_skipped" = True.
+
+    Этап 1 адаптивный (generate_candidates_adaptive): от min_candidates до n_candidates вариантов
+    с бюджетом latency_budget секунд. В результате также "candidates" (сколько вариантов получено),
+    "retries" (повторы запросов), "stragglers" (отброшенные по таймауту) и "latency_s".
+    """
+    started = time.monotonic()
+    if kobold_client is None:
+        kobold_client = default_client()
     
-    print("\n=============================================")
-    print("=== ЭТАП 1: Генерация вариантов перевода ===")
-    print("=============================================\n")
     
     translate_system_prompt = (
         f"Translate naturally idiomatically and accurately; "
@@ -137,68 +1026,289 @@ def consensus_translate(sentence: str, target_lang: str, source_lang: str = "Eng
     )
     translate_user_prompt = f"[[[{sentence}]]]"
 
-    translations = []
-    for i in range(3):
-        print(f"--- Запрос на перевод #{i+1} ---")
-        translation_text = kobold_client.complete(
-            system_prompt=translate_system_prompt,
-            user_prompt=translate_user_prompt,
-            temperature=0.8
-        )
-        translations.append(strip_outer_brackets(translation_text))
+    translations, stats = generate_candidates_adaptive(
+        kobold_client,
+        translate_system_prompt,
+        translate_user_prompt,
+        n_max=n_candidates,
+        n_start=min_candidates,
+        concurrency=concurrency,
+        latency_budget=latency_budget,
+        agreement_threshold=agreement_threshold,
+    )
+    result = {
+        "initial_translations": translations,
+        "candidates": len(translations),
+        "retries": stats["retries"],
+        "stragglers": stats["stragglers"],
+    }
 
     if not translations:
         raise ValueError("Не удалось получить ни одного перевода от модели.")
         
-    print("\nПолученные варианты перевода:")
-    for i, t in enumerate(translations):
-        print(f"{i+1}. {t}")
+    stage1_s = time.monotonic() - started
+    kobold_client.metrics.record_stage("stage1", stage1_s)
+    if Config.LOG_TEXTS and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Полученные варианты перевода:\n%s", "\n".join(f"{i+1}. {t}" for i, t in enumerate(translations)))
 
-    print("\n=============================================")
-    print("=== ЭТАП 2: Синтез и оценка переводов    ===")
-    print("=============================================\n")
+    # Единственный вариант (остальные отброшены по бюджету) синтезировать не из чего
+    agreed = translations[0] if len(translations) == 1 else agreed_candidate(translations, agreement_threshold)
+    if agreed is not None:
+        if on_token is not None:
+            on_token(agreed)
+        result.update(final_translation=agreed, synthesis_skipped=True)
+    else:
+        info: Dict[str, Any] = {}
+        stage2_started = time.monotonic()
+        final = synthesize(kobold_client, sentence, translations, target_lang, source_lang, on_token, call_info=info)
+        kobold_client.metrics.record_stage("stage2", time.monotonic() - stage2_started)
+        result.update(final_translation=final, synthesis_skipped=False)
+        result["retries"] += info.get("retries", 0)
 
-    eval_system_prompt = (
-        f"You are an expert editor. Synthesize a new translation from {source_lang} to {target_lang} "
-        f"by combining the strengths of the provided translations. Focus on idiomatic and natural phrasing. "
-        f"First, provide a brief reasoning (1-2 sentences). Then, provide the final translation inside a Markdown code block."
+    result["latency_s"] = time.monotonic() - started
+    result["duration_ms"] = int(result["latency_s"] * 1000)
+    kobold_client.metrics.record_sentence(result["latency_s"], result["synthesis_skipped"])
+    logger.info(
+        "Перевод: %d ms, вариантов %d, синтез %s, повторов %d, отброшено %d",
+        result["duration_ms"], result["candidates"],
+        "пропущен" if result["synthesis_skipped"] else "выполнен",
+        result["retries"], result["stragglers"],
     )
-    translations_formatted = "\n".join(f"- \"{t}\"" for t in translations)
-    eval_user_prompt = (
-        f"Original text: \"{sentence}\"\n\n"
-        f"Translations to synthesize:\n{translations_formatted}"
+    return result
+
+# ==============================================================================
+# УПАКОВКА НЕСКОЛЬКИХ АБЗАЦЕВ В ОДИН ЗАПРОС
+# ==============================================================================
+SEGMENT_MARKER = "<<<{n}>>>"
+SEGMENT_MARKER_RE = re.compile(r"<<<(\d+)>>>")
+
+def estimate_tokens(text: str) -> int:
+    # Грубая оценка с запасом: ~3 символа на токен (для кириллицы токены короче, чем для латиницы)
+    return len(text) // 3 + 1
+
+def pack_token_budget(n_candidates: int = Config.CANDIDATES, context_size: int = Config.CONTEXT_SIZE) -> int:
+    """
+    Сколько токенов исходного текста помещается в один упакованный запрос.
+    Самый длинный промпт — синтез: оригинал, n вариантов и ответ примерно того же размера.
+    """
+    return max(1, (context_size - Config.PACK_PROMPT_RESERVE) // (n_candidates + 2))
+
+def pack_paragraphs(paragraphs: Iterable[str], max_tokens: int) -> Iterator[Tuple[int, List[str]]]:
+    """
+    Группирует подряд идущие абзацы так, чтобы каждая группа укладывалась в max_tokens.
+    Отдаёт (номер первого абзаца группы, тексты группы); входная последовательность читается лениво.
+    """
+    start, current, used = 0, [], 0
+    for i, text in enumerate(paragraphs):
+        cost = estimate_tokens(text) + 4  # + маркер сегмента
+        if current and used + cost > max_tokens:
+            yield start, current
+            start, current, used = i, [], 0
+        current.append(text)
+        used += cost
+    if current:
+        yield start, current
+
+def join_segments(texts: List[str]) -> str:
+    return "\n".join(f"{SEGMENT_MARKER.format(n=i + 1)}\n{t}" for i, t in enumerate(texts))
+
+def split_segments(text: str, expected: int) -> Optional[List[str]]:
+    """
+    Разбирает ответ модели по маркерам <<<n>>>.
+    Возвращает None, если маркеры не совпадают с ожидаемыми 1..expected.
+    """
+    parts = SEGMENT_MARKER_RE.split(text)
+    # parts: [преамбула, "1", текст1, "2", текст2, ...]
+    numbers = [int(n) for n in parts[1::2]]
+    if numbers != list(range(1, expected + 1)):
+        return None
+    return [strip_outer_brackets(t) for t in parts[2::2]]
+
+def consensus_translate_packed(
+    paragraphs: List[str],
+    target_lang: str,
+    source_lang: str = "English",
+    n_candidates: int = Config.CANDIDATES,
+    concurrency: int = Config.CONCURRENCY,
+    kobold_client: Optional[KoboldClient] = None,
+    on_token: Optional[Callable[[str], None]] = None,
+    agreement_threshold: Optional[float] = Config.AGREEMENT_THRESHOLD,
+    min_candidates: int = Config.MIN_CANDIDATES,
+    latency_budget: Optional[float] = Config.CANDIDATE_LATENCY_BUDGET,
+) -> List[Dict[str, Any]]:
+    """
+    consensus_translate для группы абзацев одним запросом на каждом этапе.
+    Абзацы помечаются маркерами <<<n>>>; если модель вернула не то число сегментов,
+    группа переводится по одному абзацу. Результаты — в порядке входных абзацев,
+    в каждом поле "packed" показывает, удалась ли упаковка.
+
+    Параметры те же, что у consensus_translate; этап 1 так же адаптивный. on_token при
+    упакованном синтезе получает ответ всей группы вместе с маркерами <<<n>>>.
+    """
+    if kobold_client is None:
+        kobold_client = default_client()
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(paragraphs)
+    texts = []
+    positions = []
+    for i, text in enumerate(paragraphs):
+        if text.strip():
+            texts.append(text)
+            positions.append(i)
+        else:
+            results[i] = {"initial_translations": [], "final_translation": "", "synthesis_skipped": True, "packed": False}
+
+    def fallback() -> List[Dict[str, Any]]:
+        logger.info("Упаковка не удалась, перевожу %d абзацев по одному", len(texts))
+        for pos, text in zip(positions, texts):
+            result = consensus_translate(
+                text, target_lang, source_lang, n_candidates=n_candidates,
+                concurrency=concurrency, kobold_client=kobold_client, on_token=on_token,
+                agreement_threshold=agreement_threshold, min_candidates=min_candidates,
+                latency_budget=latency_budget,
+            )
+            result["packed"] = False
+            results[pos] = result
+        return results
+
+    if len(texts) <= 1:
+        return fallback()
+
+    n = len(texts)
+    translate_system_prompt = (
+        f"Translate naturally idiomatically and accurately; "
+        f"the text consists of {n} numbered segments, each starting with a marker like <<<1>>>; "
+        f"translate every segment separately and keep every marker exactly as is, on its own line; "
+        f"ONLY return the markers and translations, NOTHING ELSE; "
+        f"target {target_lang}\n"
+        f"Source language: {source_lang};"
     )
-    eval_response = kobold_client.complete(
-        system_prompt=eval_system_prompt,
-        user_prompt=eval_user_prompt,
-        temperature=0.5
+    raw_candidates, _ = generate_candidates_adaptive(
+        kobold_client,
+        translate_system_prompt,
+        join_segments(texts),
+        n_max=n_candidates,
+        n_start=min_candidates,
+        concurrency=concurrency,
+        latency_budget=latency_budget,
+        agreement_threshold=agreement_threshold,
     )
-    
-    synthesized_translation = ""
-    try:
-        start = eval_response.find("```") + 3
-        end = eval_response.rfind("```")
-        if start != 2 and end != -1:
-            synthesized_translation = eval_response[start:end].strip()
-        else:
-            synthesized_translation = eval_response
-    except Exception:
-        synthesized_translation = eval_response
+    candidates = [c for c in (split_segments(r, n) for r in raw_candidates) if c is not None]
+    if not candidates:
+        return fallback()
+    per_paragraph = [[c[j] for c in candidates] for j in range(n)]
 
-    return {
-        "initial_translations": translations,
-        "final_translation": strip_outer_brackets(synthesized_translation)
-    }
+    # Абзацы, где варианты совпали, в синтез не отправляем
+    finals: List[Optional[str]] = [agreed_candidate(variants, agreement_threshold) for variants in per_paragraph]
+    skipped = [f is not None for f in finals]
+    if on_token is not None:
+        for f in finals:
+            if f is not None:
+                on_token(f)
+    to_synth = [j for j in range(n) if finals[j] is None]
+    packed_ok = True
+
+    if len(to_synth) == 1:
+        j = to_synth[0]
+        finals[j] = synthesize(kobold_client, texts[j], per_paragraph[j], target_lang, source_lang, on_token)
+    elif to_synth:
+        m = len(to_synth)
+        eval_system_prompt = (
+            f"You are an expert editor. Synthesize a new translation from {source_lang} to {target_lang} "
+            f"for each of the {m} numbered segments by combining the strengths of the provided translations. "
+            f"Focus on idiomatic and natural phrasing and consistent terminology across segments. "
+            f"First, provide a brief reasoning (1-2 sentences). Then, provide the final translations of all segments "
+            f"inside a single Markdown code block, each preceded by its marker like <<<1>>> on its own line."
+        )
+        blocks = []
+        for k, j in enumerate(to_synth):
+            variants = "\n".join(f"- \"{t}\"" for t in per_paragraph[j])
+            blocks.append(f"{SEGMENT_MARKER.format(n=k + 1)}\nOriginal text: \"{texts[j]}\"\nTranslations to synthesize:\n{variants}")
+        eval_response = stream_synthesis(kobold_client, eval_system_prompt, "\n\n".join(blocks), on_token)
+        synthesized = split_segments(extract_code_block(eval_response), m)
+        packed_ok = synthesized is not None
+        for k, j in enumerate(to_synth):
+            if synthesized is not None:
+                finals[j] = synthesized[k]
+            else:
+                # Варианты уже есть — синтезируем только этот абзац отдельно
+                finals[j] = synthesize(kobold_client, texts[j], per_paragraph[j], target_lang, source_lang)
+
+    for j, pos in enumerate(positions):
+        results[pos] = {
+            "initial_translations": per_paragraph[j],
+            "final_translation": finals[j],
+            "synthesis_skipped": skipped[j],
+            "packed": packed_ok,
+        }
+    return results
+
+def consensus_translate_batch(
+    paragraphs: Iterable[str],
+    target_lang: str,
+    source_lang: str = "English",
+    in_flight: int = Config.PARAGRAPHS_IN_FLIGHT,
+    kobold_client: Optional[KoboldClient] = None,
+    pack: bool = False,
+    **kwargs,
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Переводит последовательность абзацев, отдавая результаты по мере готовности
+    в виде пар (номер абзаца, результат consensus_translate) в исходном порядке.
+
+    Все запросы идут через один KoboldClient (и один пул соединений),
+    одновременно в работе не больше in_flight абзацев.
+    Пустые абзацы к модели не отправляются.
+    С pack=True подряд идущие абзацы упаковываются в запросы по размеру контекста
+    (consensus_translate_packed), и in_flight ограничивает число таких групп.
+    """
+    if kobold_client is None:
+        kobold_client = default_client()
+
+    def translate_group(texts: List[str]) -> List[Dict[str, Any]]:
+        if pack:
+            return consensus_translate_packed(texts, target_lang, source_lang, kobold_client=kobold_client, **kwargs)
+        text = texts[0]
+        if not text.strip():
+            return [{"initial_translations": [], "final_translation": "", "synthesis_skipped": True}]
+        return [consensus_translate(text, target_lang, source_lang, kobold_client=kobold_client, **kwargs)]
+
+    def groups() -> Iterator[Tuple[int, List[str]]]:
+        if not pack:
+            for i, text in enumerate(paragraphs):
+                yield i, [text]
+            return
+        budget = pack_token_budget(kwargs.get("n_candidates", Config.CANDIDATES))
+        yield from pack_paragraphs(paragraphs, budget)
+
+    pending = deque()
+    pool = ThreadPoolExecutor(max_workers=max(1, in_flight))
+    try:
+        for start, texts in groups():
+            pending.append((start, pool.submit(translate_group, texts)))
+            if len(pending) >= in_flight:
+                first, future = pending.popleft()
+                for offset, result in enumerate(future.result()):
+                    yield first + offset, result
+        while pending:
+            first, future = pending.popleft()
+            for offset, result in enumerate(future.result()):
+                yield first + offset, result
+    finally:
+        # Если потребитель прервал итерацию, не запускаем оставшиеся абзацы.
+        pool.shutdown(wait=True, cancel_futures=True)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=Config.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     text_to_translate = "The field of artificial intelligence is moving at a breakneck pace, with new breakthroughs announced almost weekly."
     target_language = "Russian"
     
     try:
-        with kobold_cpp_server():
+        with kobold_cpp_server() as pool:
             final_result = consensus_translate(
                 sentence=text_to_translate,
                 target_lang=target_language,
+                kobold_client=make_client(pool=pool),
             )
             
             print("\n\n================= ИТОГОВЫЙ РЕЗУЛЬТАТ =================")
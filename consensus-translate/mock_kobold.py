@@ -0,0 +1,180 @@
+"""
+Локальная замена KoboldCPP для бенчмарков и отладки без GPU.
+
+Отвечает на /api/v1/model и /v1/chat/completions (обычный и потоковый режимы)
+в формате OpenAI. Задержка ответа = LATENCY + число токенов / TOKEN_RATE,
+одновременно обрабатывается не более SLOTS запросов (как --multiuser у KoboldCPP).
+
+Запуск:  python mock_kobold.py --port 5001 --latency 0.2 --token-rate 40 --slots 3
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+MODEL_NAME = "koboldcpp/mock"
+
+SEGMENT_RE = re.compile(r"^<<<(\d+)>>>$", re.M)
+
+
+class MockSettings:
+    def __init__(self, latency: float = 0.2, token_rate: float = 40.0, slots: int = 1,
+                 disagree: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.slots = slots
+        # Доля вариантов этапа 1, которые отличаются от остальных (чтобы синтез не пропускался)
+        self.disagree = disagree
+        self.random = random.Random(seed)
+        self.semaphore = threading.BoundedSemaphore(max(1, slots))
+        self.lock = threading.Lock()
+        self.calls = 0
+
+
+def count_tokens(text: str) -> int:
+    # То же грубое приближение, что и estimate_tokens в пайплайне
+    return len(text) // 3 + 1
+
+
+def fake_translation(text: str) -> str:
+    return "".join(reversed(text.strip()))
+
+
+def candidate_reply(text: str, settings: MockSettings) -> str:
+    reply = fake_translation(text)
+    with settings.lock:
+        differ = settings.random.random() < settings.disagree
+        salt = settings.random.randint(0, 10**6)
+    if differ:
+        # Заметно другой вариант: сходство ниже порога AGREEMENT_THRESHOLD
+        reply = f"вариант {salt}: {reply[: len(reply) // 2]}"
+    return reply
+
+
+def build_reply(user: str, settings: MockSettings) -> str:
+    """Ответ той же формы, что ждёт пайплайн для каждого вида промпта."""
+    if "Translations to synthesize" in user:
+        markers = SEGMENT_RE.findall(user)
+        if markers:
+            body = "\n".join(f"<<<{m}>>>\nsynthesized {m}" for m in markers)
+        else:
+            body = fake_translation(user.split('"')[1] if '"' in user else user)
+        return f"The candidates differ slightly; merging them.\n```\n{body}\n```\n"
+
+    segments = SEGMENT_RE.split(user)
+    if len(segments) > 1:
+        # segments = [префикс, n1, текст1, n2, текст2, ...]
+        pairs = zip(segments[1::2], segments[2::2])
+        return "\n".join(f"<<<{n}>>>\n{candidate_reply(t, settings)}" for n, t in pairs)
+    return candidate_reply(user.strip("[]"), settings)
+
+
+def make_handler(settings: MockSettings):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, payload: Dict[str, Any], status: int = 200) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/api/v1/model":
+                self._json({"result": MODEL_NAME})
+            else:
+                self._json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            if self.path != "/v1/chat/completions":
+                self._json({"error": "not found"}, 404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            messages: List[Dict[str, str]] = body.get("messages", [])
+            prompt = "\n".join(m.get("content", "") for m in messages)
+            user = messages[-1].get("content", "") if messages else ""
+            with settings.lock:
+                settings.calls += 1
+
+            with settings.semaphore:
+                reply = build_reply(user, settings)
+                usage = {"prompt_tokens": count_tokens(prompt), "completion_tokens": count_tokens(reply)}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                if body.get("stream"):
+                    include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+                    self._stream(reply, usage if include_usage else None)
+                    return
+                time.sleep(settings.latency + count_tokens(reply) / settings.token_rate)
+            self._json({
+                "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": MODEL_NAME,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        def _stream(self, reply: str, usage: Optional[Dict[str, int]] = None) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            time.sleep(settings.latency)
+            # Фрагменты по ~3 символа — примерно токен
+            try:
+                for i in range(0, len(reply), 3):
+                    time.sleep(1 / settings.token_rate)
+                    chunk = {
+                        "id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": MODEL_NAME,
+                        "choices": [{"index": 0, "delta": {"content": reply[i:i + 3]}, "finish_reason": None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                if usage is not None:
+                    # Как stream_options.include_usage в OpenAI: последний фрагмент без choices, с usage
+                    chunk = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": MODEL_NAME, "choices": [], "usage": usage}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # Клиент закрыл поток после закрывающего ``` — это нормально
+                pass
+            self.close_connection = True
+
+    return Handler
+
+
+def start_mock_server(port: int = 5001, host: str = "127.0.0.1", **kwargs) -> ThreadingHTTPServer:
+    """Запускает сервер в фоновом потоке; settings доступны как server.settings."""
+    settings = MockSettings(**kwargs)
+    server = ThreadingHTTPServer((host, port), make_handler(settings))
+    server.daemon_threads = True
+    server.settings = settings
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Имитация KoboldCPP (OpenAI-совместимый API)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--latency", type=float, default=0.2, help="Задержка до первого токена, с")
+    parser.add_argument("--token-rate", type=float, default=40.0, help="Скорость генерации, токенов/с")
+    parser.add_argument("--slots", type=int, default=1, help="Сколько запросов обрабатывается одновременно")
+    parser.add_argument("--disagree", type=float, default=0.0, help="Доля расходящихся вариантов этапа 1 (0..1)")
+    args = parser.parse_args()
+
+    settings = MockSettings(args.latency, args.token_rate, args.slots, args.disagree)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(settings))
+    print(f"Mock KoboldCPP на http://{args.host}:{args.port} (slots={args.slots})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,12 +1,41 @@
+"""
+Импорт историй через API.
+
+Массовая загрузка каталога или JSONL:
+    python scripts/api_import_story.py bulk stories/ --user admin --password ... --workers 8
+    python scripts/api_import_story.py bulk backlog.jsonl --original-language 1 --target-language 2
+
+Каждая история — JSON в формате /api/stories/import/ (title, original_language, target_language,
+original_text/machine_text или chapters) либо .txt (название — имя файла, текст — original_text).
+Успешно загруженные истории пишутся в файл контрольных точек; повторный запуск их пропускает,
+а прерванную поглавную загрузку продолжает в той же сессии импорта с last_seq.
+Создание истории и сессии повторяется только при 429/503 и неустановленном соединении — иначе дубли.
+
+Демо-примеры отдельных запросов:
+    python scripts/api_import_story.py demo --user admin --password ...
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
 import requests
 from urllib.parse import urljoin
+from urllib3.exceptions import NewConnectionError
 
 
-BASE = "http://127.0.0.1:8000"  # поправь, если нужен другой хост/порт
+BASE = os.getenv("STORYHUB_URL", "http://127.0.0.1:8000")  # поправь, если нужен другой хост/порт
 LOGIN_URL = f"{BASE}/accounts/login/"
 IMPORT_URL = f"{BASE}/api/stories/import/"
 CREATE_URL = f"{BASE}/api/stories/"  # на случай пошагового пути
 PARSE_URL_TPL = f"{BASE}/api/stories/{{id}}/parse/"
+IMPORT_SESSIONS_URL = f"{BASE}/api/import-sessions/"
 
 def login(session: requests.Session, username: str, password: str):
     # 1) получаем csrftoken
@@ -122,11 +151,244 @@ def create_then_parse_step_by_step(username: str, password: str):
     r.raise_for_status()
     print("Пошаговый импорт:", r.json())
 
-if __name__ == "__main__":
-    # Подставь логин/пароль админа
-    USER = "newStories"
-    PASS = "avWwmzC5qzEPHZamwc"
+# ==== Массовая загрузка ====
+
+# Статусы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Для неидемпотентных запросов (создание истории/сессии) — только те, где сервер точно ничего
+# не сделал: при 502/504 и таймауте чтения импорт мог уже закоммититься, повтор дал бы дубль
+UNSENT_RETRY_STATUSES = {429, 503}
+
+
+class RetryableError(Exception):
+    pass
+
+
+def iter_documents(source: Path) -> Iterator[Tuple[str, dict]]:
+    """(ключ, payload) для каждой истории. Ключ стабилен между запусками и идёт в контрольные точки."""
+    if source.is_dir():
+        for path in sorted(p for p in source.rglob("*") if p.suffix in (".json", ".txt") and p.is_file()):
+            key = str(path.relative_to(source))
+            if path.suffix == ".json":
+                yield key, json.loads(path.read_text(encoding="utf-8"))
+            else:
+                yield key, {"title": path.stem, "original_text": path.read_text(encoding="utf-8-sig")}
+        return
+    with source.open(encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if line.strip():
+                doc = json.loads(line)
+                yield str(doc.get("external_id") or f"{source.name}:{line_no}"), doc
+
+
+def load_checkpoint(path: Path) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """
+    Загруженные истории {ключ: story_id} и незаконченные сессии импорта {ключ: session_id}.
+    Строки с session_id пишутся по ходу поглавной загрузки, чтобы после сбоя продолжить ту же сессию.
+    """
+    done, sessions = {}, {}
+    if path.exists():
+        with path.open(encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    if "story_id" in row:
+                        done[row["key"]] = row["story_id"]
+                    elif "session_id" in row:
+                        sessions[row["key"]] = row["session_id"]
+    return done, sessions
+
+
+def _not_sent(e: Exception) -> bool:
+    # Соединение так и не установлено — запрос до сервера не дошёл, повтор безопасен
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(e, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+class Uploader:
+    """Пул сессий: у каждого потока свой requests.Session со своим логином."""
+
+    def __init__(self, username: str, password: str, retries: int = 5, backoff: float = 1.0,
+                 chunk_bytes: int = 2_000_000, background: bool = False,
+                 sessions: Optional[Dict[str, int]] = None, on_session=None):
+        self.username = username
+        self.password = password
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_bytes = chunk_bytes
+        self.background = background
+        self.sessions = sessions or {}
+        # on_session(key, session_id, last_seq) — запись прогресса поглавной загрузки в контрольные точки
+        self.on_session = on_session or (lambda key, session_id, last_seq: None)
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = requests.Session()
+            self._call(lambda: login(s, self.username, self.password))
+            self._local.session = s
+        return s
+
+    def _call(self, func, idempotent: bool = True):
+        for attempt in range(self.retries + 1):
+            try:
+                return func()
+            except (RetryableError, requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries or not (idempotent or isinstance(e, RetryableError) or _not_sent(e)):
+                    raise
+                delay = getattr(e, "retry_after", None) or self.backoff * (2 ** attempt)
+                time.sleep(delay)
+
+    def _request(self, method: str, url: str, data: Optional[dict] = None, idempotent: bool = True) -> Optional[dict]:
+        statuses = RETRY_STATUSES if idempotent else UNSENT_RETRY_STATUSES
 
-    create_and_parse_one_chapter(USER, PASS)
-    create_and_parse_chapters(USER, PASS)
-    create_then_parse_step_by_step(USER, PASS)
\ No newline at end of file
+        def once():
+            s = self._session()
+            headers = {"Content-Type": "application/json", "X-CSRFToken": s.cookies.get("csrftoken", ""), "Referer": BASE}
+            r = s.request(method, url, json=data, headers=headers, timeout=300)
+            if r.status_code in statuses:
+                err = RetryableError(f"HTTP {r.status_code} {url}")
+                if r.headers.get("Retry-After", "").isdigit():
+                    err.retry_after = int(r.headers["Retry-After"])
+                raise err
+            if method == "GET" and r.status_code == 404:
+                return None
+            r.raise_for_status()
+            return r.json()
+        return self._call(once, idempotent=idempotent)
+
+    def _post(self, url: str, data: dict, idempotent: bool = True) -> dict:
+        return self._request("POST", url, data, idempotent=idempotent)
+
+    def upload(self, key: str, doc: dict) -> int:
+        chapters = doc.get("chapters")
+        if key in self.sessions or (
+            isinstance(chapters, list) and len(json.dumps(doc, ensure_ascii=False).encode("utf-8")) > self.chunk_bytes
+        ):
+            return self._upload_chunked(key, doc)
+        payload = dict(doc, background=True) if self.background else doc
+        return self._post(IMPORT_URL, payload, idempotent=False)["story"]["id"]
+
+    def _upload_chunked(self, key: str, doc: dict) -> int:
+        # Большие истории — по главе за запрос через сессию импорта; seq делает повторы безопасными.
+        # Сессия из контрольных точек продолжается с last_seq, а не создаётся заново
+        session = None
+        if key in self.sessions:
+            session = self._request("GET", f"{IMPORT_SESSIONS_URL}{self.sessions[key]}/")
+        if session is None:
+            meta = {k: v for k, v in doc.items() if k not in ("chapters", "original_text", "machine_text")}
+            session = self._post(IMPORT_SESSIONS_URL, meta, idempotent=False)
+            self.on_session(key, session["id"], session["last_seq"])
+        base = f"{IMPORT_SESSIONS_URL}{session['id']}/"
+        if session["status"] == "COMMITTED":
+            return session["story"]
+        for seq, ch in enumerate(doc.get("chapters") or [], start=1):
+            if seq <= session["last_seq"]:
+                continue
+            session = self._post(f"{base}chapters/", dict(ch, seq=seq))
+            self.on_session(key, session["id"], session["last_seq"])
+        try:
+            return self._post(f"{base}commit/", {})["story"]
+        except requests.HTTPError as e:
+            # Ответ на commit потерялся, и повтор получил 409: сессия уже закрыта — это успех
+            if e.response is not None and e.response.status_code == 409:
+                session = self._request("GET", base)
+                if session and session["status"] == "COMMITTED":
+                    return session["story"]
+            raise
+
+
+def bulk_import(args) -> int:
+    source = Path(args.source)
+    checkpoint = Path(args.checkpoint or f"{source.as_posix().rstrip('/')}.checkpoint.jsonl")
+    done, sessions = load_checkpoint(checkpoint)
+    cp_lock = threading.Lock()
+
+    def write_checkpoint(row: dict) -> None:
+        with cp_lock:
+            cp.write(json.dumps(row, ensure_ascii=False) + "\n")
+            cp.flush()
+
+    uploader = Uploader(args.user, args.password, retries=args.retries, backoff=args.backoff,
+                        chunk_bytes=args.chunk_bytes, background=args.background, sessions=sessions,
+                        on_session=lambda key, session_id, last_seq: write_checkpoint(
+                            {"key": key, "session_id": session_id, "last_seq": last_seq}))
+    defaults = {k: v for k, v in (("original_language", args.original_language),
+                                  ("target_language", args.target_language)) if v is not None}
+
+    def documents():
+        for key, doc in iter_documents(source):
+            if key in done:
+                stats["skipped"] += 1
+                continue
+            yield key, {**defaults, **doc}
+
+    stats = {"uploaded": 0, "skipped": 0, "failed": 0}
+    started = time.monotonic()
+    pending = deque()
+    # Итог по истории пишет основной поток, прогресс сессий импорта — рабочие (под cp_lock)
+    with checkpoint.open("a", encoding="utf-8") as cp, ThreadPoolExecutor(max_workers=args.workers) as pool:
+        def drain(block_until: int):
+            while len(pending) > block_until:
+                key, future = pending.popleft()
+                try:
+                    story_id = future.result()
+                except Exception as e:
+                    stats["failed"] += 1
+                    print(f"[ОШИБКА] {key}: {e}", file=sys.stderr)
+                    continue
+                write_checkpoint({"key": key, "story_id": story_id})
+                stats["uploaded"] += 1
+                if stats["uploaded"] % 100 == 0:
+                    print(f"{stats['uploaded']} историй загружено...")
+
+        for key, doc in documents():
+            pending.append((key, pool.submit(uploader.upload, key, doc)))
+            # В памяти не больше двух историй на поток
+            drain(block_until=args.workers * 2)
+        drain(block_until=0)
+
+    elapsed = time.monotonic() - started
+    print(
+        f"Загружено: {stats['uploaded']}, пропущено (уже в {checkpoint.name}): {stats['skipped']}, "
+        f"ошибок: {stats['failed']} за {elapsed:.1f} с — {stats['uploaded'] / elapsed if elapsed else 0:.2f} docs/s"
+    )
+    return 1 if stats["failed"] else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Импорт историй в StoryHub через API")
+    parser.add_argument("--user", default=os.getenv("STORYHUB_USER"))
+    parser.add_argument("--password", default=os.getenv("STORYHUB_PASSWORD"))
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    bulk = sub.add_parser("bulk", help="Массовая загрузка каталога (.json/.txt) или JSONL")
+    bulk.add_argument("source")
+    bulk.add_argument("--workers", type=int, default=4, help="Одновременных сессий")
+    bulk.add_argument("--retries", type=int, default=5, help="Повторов при 429/5xx и обрыве соединения")
+    bulk.add_argument("--backoff", type=float, default=1.0, help="Начальная пауза перед повтором, с")
+    bulk.add_argument("--checkpoint", default=None, help="Файл контрольных точек (по умолчанию <source>.checkpoint.jsonl)")
+    bulk.add_argument("--original-language", type=int, default=None, help="ID языка, если не указан в истории")
+    bulk.add_argument("--target-language", type=int, default=None, help="ID языка, если не указан в истории")
+    bulk.add_argument("--chunk-bytes", type=int, default=2_000_000,
+                      help="Истории с главами больше этого размера грузятся по главам через /api/import-sessions/")
+    bulk.add_argument("--background", action="store_true", help="Разбор абзацев в фоновой задаче сервера")
+
+    sub.add_parser("demo", help="Примеры отдельных запросов импорта")
+    args = parser.parse_args(argv)
+    if not args.user or not args.password:
+        parser.error("нужны --user и --password (или STORYHUB_USER / STORYHUB_PASSWORD)")
+
+    if args.command == "bulk":
+        return bulk_import(args)
+    create_and_parse_one_chapter(args.user, args.password)
+    create_and_parse_chapters(args.user, args.password)
+    create_then_parse_step_by_step(args.user, args.password)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
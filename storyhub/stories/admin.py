@@ -1,6 +1,6 @@
 # stories/admin.py
 from django.contrib import admin
-from .models import Language, Tag, Story, Paragraph, Illustration, Chapter
+from .models import Language, Tag, Story, Paragraph, Illustration, Chapter, ImportSession, Job
 
 @admin.register(Language)
 class LanguageAdmin(admin.ModelAdmin):
@@ -36,4 +36,15 @@ class StoryAdmin(admin.ModelAdmin):
     list_display = ("title", "status", "original_language", "target_language", "assigned_to", "paragraphs_count", "translated_count", "published_at")
     list_filter = ("status", "original_language", "target_language", "tags")
     search_fields = ("title", "description")
-    filter_horizontal = ("tags",)
\ No newline at end of file
+    filter_horizontal = ("tags",)
+
+@admin.register(ImportSession)
+class ImportSessionAdmin(admin.ModelAdmin):
+    list_display = ("story", "status", "last_seq", "paragraphs_count", "chapters_count", "created_by", "updated_at")
+    list_filter = ("status",)
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "story", "status", "progress", "total", "worker", "created_at", "finished_at")
+    list_filter = ("kind", "status")
+    readonly_fields = ("started_at", "finished_at", "worker", "error")
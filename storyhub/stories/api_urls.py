@@ -1,10 +1,12 @@
 # stories/api_urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import StoryViewSet
+from .views import StoryViewSet, ImportSessionViewSet, JobViewSet
 
 router = DefaultRouter()
 router.register(r"stories", StoryViewSet, basename="stories")
+router.register(r"import-sessions", ImportSessionViewSet, basename="import-sessions")
+router.register(r"jobs", JobViewSet, basename="jobs")
 
 urlpatterns = [
     path("", include(router.urls)),
@@ -0,0 +1,166 @@
+# stories/jobs.py
+# Очередь фоновых задач в БД: без внешнего брокера, воркер — manage.py run_jobs
+import traceback
+from datetime import timedelta
+from typing import Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Job, JobKind, JobStatus, Story, Paragraph, Illustration
+from .services import (
+    PLACEHOLDER_URL, touch_story_content,
+    parse_story_paragraphs, parse_story_with_chapters, machine_translate_story,
+)
+
+# Аренда задачи: RUNNING без отметки прогресса дольше этого срока считается брошенной
+# (воркер упал или был убит) и возвращается в очередь
+JOB_LEASE = timedelta(minutes=30)
+
+
+class JobLeaseLost(Exception):
+    """Аренда истекла, и задачу уже вернули в очередь или взял другой воркер."""
+
+
+def enqueue_job(kind: str, story: Story, payload: Optional[dict] = None, user=None) -> Job:
+    return Job.objects.create(
+        kind=kind,
+        story=story,
+        payload=payload or {},
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+
+
+def requeue_stale_jobs(lease: timedelta = JOB_LEASE) -> int:
+    """Возвращает в очередь задачи RUNNING, чей воркер не отмечался дольше lease. Возвращает их число."""
+    return Job.objects.filter(status=JobStatus.RUNNING, heartbeat_at__lt=timezone.now() - lease).update(
+        status=JobStatus.QUEUED, worker="", started_at=None, heartbeat_at=None,
+    )
+
+
+def claim_next_job(worker: str, kinds=None, lease: timedelta = JOB_LEASE) -> Optional[Job]:
+    """
+    Берёт самую старую задачу из очереди. Захват — условный UPDATE по статусу,
+    поэтому два воркера не получат одну задачу ни в SQLite, ни в PostgreSQL.
+    Перед захватом брошенные задачи (см. requeue_stale_jobs) возвращаются в очередь.
+    """
+    requeue_stale_jobs(lease)
+    qs = Job.objects.filter(status=JobStatus.QUEUED)
+    if kinds:
+        qs = qs.filter(kind__in=kinds)
+    for job_id in qs.order_by("id").values_list("id", flat=True)[:10]:
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=job_id, status=JobStatus.QUEUED).update(
+            status=JobStatus.RUNNING, worker=worker, started_at=now, heartbeat_at=now,
+        )
+        if claimed:
+            return Job.objects.select_related("story").get(pk=job_id)
+    return None
+
+
+def _set_progress(job: Job, progress: int, total: Optional[int] = None) -> None:
+    """
+    Пишет прогресс и продлевает аренду задачи. Если задача этому воркеру уже не принадлежит,
+    бросает JobLeaseLost: обработчик прерывается, а его текущая транзакция откатывается.
+    """
+    job.progress = progress
+    fields = {"progress": progress, "heartbeat_at": timezone.now()}
+    if total is not None:
+        job.total = total
+        fields["total"] = total
+    if not Job.objects.filter(pk=job.pk, status=JobStatus.RUNNING, worker=job.worker).update(**fields):
+        raise JobLeaseLost(f"Задача #{job.pk} больше не принадлежит воркеру {job.worker}")
+
+
+def _run_parse(job: Job) -> dict:
+    payload = job.payload
+    incremental = bool(payload.get("incremental"))
+    chapters = payload.get("chapters")
+    _set_progress(job, 0, 1)
+    # Разбор фиксируется вместе с отметкой прогресса: если аренду уже забрали, он откатывается
+    with transaction.atomic():
+        if isinstance(chapters, list) and chapters:
+            count = parse_story_with_chapters(job.story, chapters, incremental=incremental)
+            ch_count = len(chapters)
+        else:
+            original_text = payload.get("original_text", "") or ""
+            machine_text = payload.get("machine_text", "") or ""
+            count = parse_story_paragraphs(job.story, original_text, machine_text, incremental=incremental)
+            ch_count = 1 if original_text or machine_text else 0
+        _set_progress(job, 1)
+        # Текст истории после разбора в задаче больше не нужен
+        Job.objects.filter(pk=job.pk, worker=job.worker).update(payload={"incremental": incremental})
+    return {"paragraphs": count, "chapters": ch_count}
+
+
+def prune_placeholder_illustrations(story: Story) -> int:
+    """
+    Удаляет сохранённые иллюстрации-заглушки, которые никто не выбрал: они и так вычисляются
+    на лету (Paragraph.illustration_slots). Возвращает число удалённых строк.
+    """
+    deleted, _ = Illustration.objects.filter(
+        paragraph__story=story, is_selected=False, image_url__startswith=PLACEHOLDER_URL.split("{", 1)[0],
+    ).delete()
+    if deleted:
+        # id иллюстраций в /paragraphs/ стали null — старый ETag больше не годится
+        touch_story_content(story)
+    return deleted
+
+
+def _run_illustrations(job: Job) -> dict:
+    _set_progress(job, 0, 1)
+    with transaction.atomic():
+        deleted = prune_placeholder_illustrations(job.story)
+        _set_progress(job, 1)
+    return {"deleted": deleted}
+
+
+def _run_machine_translate(job: Job) -> dict:
+    only_missing = bool(job.payload.get("only_missing"))
+    qs = Paragraph.objects.filter(story=job.story)
+    if only_missing:
+        qs = qs.filter(machine_text="")
+    _set_progress(job, 0, qs.count())
+    progress = {"done": 0}
+
+    def on_write():
+        # Прогресс — в транзакции записи абзаца: потерянная аренда откатывает и запись machine_text
+        progress["done"] += 1
+        _set_progress(job, progress["done"])
+
+    skipped = 0
+    for _, result in machine_translate_story(
+        job.story, only_missing=only_missing, in_flight=job.payload.get("in_flight"), on_write=on_write,
+    ):
+        skipped += int(bool(result.get("synthesis_skipped")))
+    return {"paragraphs": progress["done"], "synthesis_skipped": skipped}
+
+
+HANDLERS = {
+    JobKind.PARSE: _run_parse,
+    JobKind.ILLUSTRATIONS: _run_illustrations,
+    JobKind.MACHINE_TRANSLATE: _run_machine_translate,
+}
+
+
+def run_job(job: Job) -> Job:
+    """Выполняет уже захваченную задачу и записывает итог (DONE/FAILED)."""
+    try:
+        result = HANDLERS[job.kind](job)
+    except JobLeaseLost as e:
+        # Итог запишет воркер, который теперь ведёт задачу
+        job.error = str(e)
+        return job
+    except Exception:
+        job.status = JobStatus.FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = JobStatus.DONE
+        job.result = result
+        job.error = ""
+    job.finished_at = timezone.now()
+    # Если аренда истекла и задачу уже взял другой воркер, итог пишет он
+    Job.objects.filter(pk=job.pk, status=JobStatus.RUNNING, worker=job.worker).update(
+        status=job.status, result=job.result, error=job.error, finished_at=job.finished_at,
+    )
+    return job
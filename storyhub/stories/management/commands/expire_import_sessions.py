@@ -0,0 +1,18 @@
+# stories/management/commands/expire_import_sessions.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from stories.services import IMPORT_SESSION_TTL, expire_import_sessions
+
+
+class Command(BaseCommand):
+    help = "Удаляет истории брошенных поэтапных импортов (сессия открыта и давно не получала частей)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=float, default=IMPORT_SESSION_TTL.total_seconds() / 3600,
+                            help="Сколько часов сессия может простаивать")
+
+    def handle(self, *args, **opts):
+        deleted = expire_import_sessions(timedelta(hours=opts["hours"]))
+        self.stdout.write(self.style.SUCCESS(f"Удалено историй брошенных импортов: {deleted}"))
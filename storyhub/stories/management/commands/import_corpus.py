@@ -0,0 +1,90 @@
+# stories/management/commands/import_corpus.py
+import os
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from stories.models import Language, Story, StoryStatus
+from stories.services import parse_story_paragraphs
+from stories.text import split_normalized_paragraphs
+
+
+def prepare_file(path: str):
+    """Выполняется в дочернем процессе: чтение и нормализация одного файла, без обращений к БД."""
+    started = time.perf_counter()
+    raw = Path(path).read_bytes()
+    paragraphs = split_normalized_paragraphs(raw.decode("utf-8-sig", errors="replace"))
+    return path, paragraphs, len(raw), time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        "Пакетный импорт каталога историй (.txt): нормализация и разбиение на абзацы в пуле процессов, "
+        "запись в БД — одним процессом."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument("--original-language", required=True, help="Код языка оригинала (например, en)")
+        parser.add_argument("--target-language", required=True, help="Код языка перевода (например, ru)")
+        parser.add_argument("--pattern", default="*.txt", help="Маска файлов (ищется рекурсивно)")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Процессов нормализации")
+        parser.add_argument("--chunksize", type=int, default=4, help="Файлов на одну выдачу процессу")
+        parser.add_argument("--dry-run", action="store_true", help="Только нормализация, без записи в БД")
+
+    def handle(self, *args, **opts):
+        root = Path(opts["directory"])
+        if not root.is_dir():
+            raise CommandError(f"{root} is not a directory")
+        try:
+            original = Language.objects.get(code=opts["original_language"])
+            target = Language.objects.get(code=opts["target_language"])
+        except Language.DoesNotExist as e:
+            raise CommandError(f"Language not found: {e}")
+
+        paths = sorted(str(p) for p in root.rglob(opts["pattern"]) if p.is_file())
+        if not paths:
+            raise CommandError(f"No files matching {opts['pattern']} in {root}")
+
+        # Соединения с БД не должны наследоваться дочерними процессами
+        connections.close_all()
+        started = time.perf_counter()
+        stories = paragraphs_total = bytes_total = 0
+        normalize_s = write_s = 0.0
+
+        with Pool(processes=max(1, opts["workers"])) as pool:
+            for path, paragraphs, size, spent in pool.imap_unordered(prepare_file, paths, chunksize=max(1, opts["chunksize"])):
+                normalize_s += spent
+                bytes_total += size
+                paragraphs_total += len(paragraphs)
+                if opts["dry_run"]:
+                    continue
+                # Единственный писатель: все вставки идут из основного процесса
+                write_started = time.perf_counter()
+                with transaction.atomic():
+                    story = Story.objects.create(
+                        title=Path(path).stem[:255],
+                        original_language=original,
+                        target_language=target,
+                        status=StoryStatus.DRAFT,
+                    )
+                    parse_story_paragraphs(story, "\n\n".join(paragraphs), "")
+                write_s += time.perf_counter() - write_started
+                stories += 1
+                if stories % 50 == 0:
+                    self.stdout.write(f"{stories}/{len(paths)} историй...")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Файлов: {len(paths)}, историй создано: {stories}, абзацев: {paragraphs_total}, "
+            f"{bytes_total / 1e6:.1f} МБ за {elapsed:.1f} с"
+        ))
+        if elapsed:
+            self.stdout.write(
+                f"{len(paths) / elapsed:.1f} файлов/с, {paragraphs_total / elapsed:.0f} абзацев/с, "
+                f"{bytes_total / 1e6 / elapsed:.2f} МБ/с; "
+                f"нормализация {normalize_s:.1f} с (суммарно по процессам), запись в БД {write_s:.1f} с"
+            )
@@ -0,0 +1,28 @@
+# stories/management/commands/reconcile_counters.py
+from django.core.management.base import BaseCommand
+
+from stories.models import Story
+from translations.services import reconcile_story_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Полный пересчёт translated_count историй и счётчиков глав. При сохранении перевода они "
+        "меняются дельтой; команда выравнивает их после ручных правок в БД или массовых update()."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--story", type=int, action="append", help="ID истории (можно несколько); по умолчанию все")
+
+    def handle(self, *args, **opts):
+        qs = Story.objects.all().order_by("id")
+        if opts["story"]:
+            qs = qs.filter(pk__in=opts["story"])
+        checked = fixed = 0
+        for story in qs.iterator():
+            before = story.translated_count
+            if reconcile_story_counters(story):
+                fixed += 1
+                self.stdout.write(f"История #{story.pk}: translated_count {before} -> {story.translated_count}")
+            checked += 1
+        self.stdout.write(self.style.SUCCESS(f"Проверено историй: {checked}, исправлено: {fixed}"))
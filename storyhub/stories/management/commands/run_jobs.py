@@ -0,0 +1,44 @@
+# stories/management/commands/run_jobs.py
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from stories.jobs import JOB_LEASE, claim_next_job, run_job
+from stories.models import JobKind, JobStatus
+
+
+class Command(BaseCommand):
+    help = "Воркер очереди фоновых задач (разбор истории, иллюстрации, машинный перевод). Запускайте столько процессов, сколько нужно параллельных задач."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Выполнить все задачи из очереди и выйти")
+        parser.add_argument("--poll-interval", type=float, default=2.0, help="Пауза между проверками пустой очереди, с")
+        parser.add_argument("--kind", action="append", choices=JobKind.values, help="Брать только задачи этого вида (можно несколько)")
+        parser.add_argument("--lease", type=float, default=JOB_LEASE.total_seconds() / 60,
+                            help="Через сколько минут без прогресса задача RUNNING возвращается в очередь")
+
+    def handle(self, *args, **opts):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        lease = timedelta(minutes=opts["lease"])
+        self.stdout.write(f"Воркер {worker} запущен")
+        try:
+            while True:
+                close_old_connections()
+                job = claim_next_job(worker, kinds=opts["kind"], lease=lease)
+                if job is None:
+                    if opts["once"]:
+                        return
+                    time.sleep(opts["poll_interval"])
+                    continue
+                self.stdout.write(f"Задача #{job.pk} {job.kind} (история {job.story_id})...")
+                job = run_job(job)
+                style = self.style.SUCCESS if job.status == JobStatus.DONE else self.style.ERROR
+                self.stdout.write(style(f"Задача #{job.pk}: {job.status} за {job.duration_s:.1f} с"))
+                if job.error:
+                    self.stderr.write(job.error)
+        except KeyboardInterrupt:
+            self.stdout.write("Воркер остановлен")
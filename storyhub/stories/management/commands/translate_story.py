@@ -0,0 +1,34 @@
+# stories/management/commands/translate_story.py
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stories.models import Story
+from stories.services import _consensus_module, machine_translate_story
+
+
+class Command(BaseCommand):
+    help = "Машинный перевод абзацев истории через consensus-translate (KoboldCPP) в Paragraph.machine_text"
+
+    def add_arguments(self, parser):
+        parser.add_argument("story_id", type=int)
+        parser.add_argument("--in-flight", type=int, default=None, help="Сколько абзацев переводить одновременно")
+        parser.add_argument("--only-missing", action="store_true", help="Только абзацы с пустым machine_text")
+
+    def handle(self, *args, **opts):
+        try:
+            story = Story.objects.select_related("original_language", "target_language").get(pk=opts["story_id"])
+        except Story.DoesNotExist:
+            raise CommandError(f"Story {opts['story_id']} not found")
+
+        started = time.monotonic()
+        done = 0
+        for paragraph_id, _ in machine_translate_story(story, only_missing=opts["only_missing"], in_flight=opts["in_flight"]):
+            done += 1
+            if done % 10 == 0:
+                self.stdout.write(f"{done} абзацев...")
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Переведено абзацев: {done} за {elapsed:.1f} с"))
+        if opts["verbosity"] > 1:
+            self.stdout.write(json.dumps(_consensus_module().METRICS.summary(), ensure_ascii=False, indent=2))
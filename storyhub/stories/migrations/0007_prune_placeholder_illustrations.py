@@ -0,0 +1,20 @@
+from django.db import migrations
+
+PLACEHOLDER_PREFIX = "https://picsum.photos/seed/"
+
+
+def prune_placeholders(apps, schema_editor):
+    # Невыбранные заглушки теперь вычисляются на лету (Paragraph.illustration_slots)
+    Illustration = apps.get_model("stories", "Illustration")
+    Illustration.objects.filter(is_selected=False, image_url__startswith=PLACEHOLDER_PREFIX).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stories", "0006_job"),
+    ]
+
+    operations = [
+        migrations.RunPython(prune_placeholders, migrations.RunPython.noop),
+    ]
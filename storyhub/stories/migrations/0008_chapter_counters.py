@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:02
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_counters(apps, schema_editor):
+    Chapter = apps.get_model("stories", "Chapter")
+    Paragraph = apps.get_model("stories", "Paragraph")
+    Translation = apps.get_model("translations", "Translation")
+    paragraphs = dict(
+        Paragraph.objects.filter(chapter__isnull=False).values("chapter_id")
+        .annotate(n=Count("id")).values_list("chapter_id", "n")
+    )
+    finalized = dict(
+        Translation.objects.filter(
+            is_finalized=True,
+            paragraph__chapter__isnull=False,
+            translator_id=models.F("paragraph__story__assigned_to_id"),
+        ).values("paragraph__chapter_id").annotate(n=Count("paragraph_id", distinct=True))
+        .values_list("paragraph__chapter_id", "n")
+    )
+    chapters = list(Chapter.objects.all())
+    for ch in chapters:
+        ch.paragraphs_count = paragraphs.get(ch.id, 0)
+        ch.finalized_count = finalized.get(ch.id, 0)
+    Chapter.objects.bulk_update(chapters, ["paragraphs_count", "finalized_count"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0007_prune_placeholder_illustrations'),
+        ('translations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='finalized_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chapter',
+            name='paragraphs_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0008_chapter_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='reader_snapshot',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
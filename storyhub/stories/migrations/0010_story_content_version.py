@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0009_story_reader_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='content_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def recount_translated_count(apps, schema_editor):
+    # До подключения translations.signals translated_count не обновлялся при сохранении перевода,
+    # а дальше он меняется дельтами — выравниваем один раз по факту
+    Story = apps.get_model("stories", "Story")
+    Translation = apps.get_model("translations", "Translation")
+    finalized = dict(
+        Translation.objects.filter(
+            is_finalized=True,
+            translator_id=models.F("paragraph__story__assigned_to_id"),
+        ).values("paragraph__story_id").annotate(n=Count("paragraph_id", distinct=True))
+        .values_list("paragraph__story_id", "n")
+    )
+    stories = list(Story.objects.only("id", "translated_count"))
+    changed = [s for s in stories if s.translated_count != finalized.get(s.id, 0)]
+    for s in changed:
+        s.translated_count = finalized.get(s.id, 0)
+    Story.objects.bulk_update(changed, ["translated_count"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0010_story_content_version'),
+        ('translations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_translated_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:24
+
+from django.db import migrations, models
+
+
+def backfill_heartbeat(apps, schema_editor):
+    # Уже идущим задачам аренда отсчитывается от захвата, иначе брошенные из них не вернутся в очередь
+    Job = apps.get_model("stories", "Job")
+    Job.objects.filter(status="RUNNING", heartbeat_at__isnull=True).update(heartbeat_at=models.F("started_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0011_recount_translated_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_heartbeat, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0012_job_heartbeat_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='story',
+            name='status',
+            field=models.CharField(choices=[('IMPORTING', 'Importing'), ('DRAFT', 'Draft'), ('IN_TRANSLATION', 'In translation'), ('REVIEW', 'Review'), ('PUBLISHED', 'Published')], default='DRAFT', max_length=20),
+        ),
+    ]
@@ -1,5 +1,7 @@
 # stories/models.py
-from django.db import models
+import re
+from django.db import IntegrityError, models, transaction
+from django.db.models import Q
 from django.utils.text import slugify
 from django.core.validators import MinValueValidator, MaxValueValidator, URLValidator
 from django.contrib.auth import get_user_model
@@ -9,10 +11,24 @@ User = get_user_model()
 
 validate_http_https = URLValidator(schemes=["http", "https"])
 
+PLACEHOLDER_URL = "https://picsum.photos/seed/{seed}/400/300"
+ILLUSTRATION_POSITIONS = range(1, 6)
+
+
+def placeholder_url(story_id: int, index: int, position: int) -> str:
+    return PLACEHOLDER_URL.format(seed=f"{story_id}-{index}-{position}")
+
+
+def _percent(done: int, total: int) -> int:
+    return min(100, done * 100 // total) if total else 0
+
 class Chapter(models.Model):
     story = models.ForeignKey("stories.Story", related_name="chapters", on_delete=models.CASCADE)
     index = models.PositiveIntegerField()  # порядковый номер главы внутри истории (1..N)
     title = models.CharField(max_length=255, blank=True, default="")  # название главы
+    # Денормализованные счётчики: обновляются при разборе и сохранении перевода, без агрегатов при чтении
+    paragraphs_count = models.PositiveIntegerField(default=0)
+    finalized_count = models.PositiveIntegerField(default=0)  # абзацы, финализированные назначенным переводчиком
 
     class Meta:
         unique_together = [("story", "index")]
@@ -21,6 +37,10 @@ class Chapter(models.Model):
     def __str__(self):
         return f"{self.story.title} / Глава {self.index}: {self.title or 'Без названия'}"
 
+    @property
+    def progress_percent(self):
+        return _percent(self.finalized_count, self.paragraphs_count)
+
 
 
 
@@ -46,6 +66,8 @@ class Tag(models.Model):
 
 
 class StoryStatus(models.TextChoices):
+    # Поэтапный импорт ещё идёт (ImportSession открыта): историю видит только админ
+    IMPORTING = "IMPORTING", "Importing"
     DRAFT = "DRAFT", "Draft"
     IN_TRANSLATION = "IN_TRANSLATION", "In translation"
     REVIEW = "REVIEW", "Review"
@@ -65,27 +87,56 @@ class Story(models.Model):
     translated_count = models.PositiveIntegerField(default=0)
     published_at = models.DateTimeField(null=True, blank=True)
     poster_url = models.URLField(blank=True, default="")
+    # Готовый к чтению текст опубликованной истории (stories.reader); None — собрать заново
+    reader_snapshot = models.JSONField(null=True, blank=True, editable=False)
+    # Растёт при любом изменении абзацев и иллюстраций; из него строится ETag списка абзацев
+    content_version = models.PositiveIntegerField(default=0, editable=False)
 
 
     class Meta:
         ordering = ["-id"]
 
+    # Сколько раз пробовать новый slug, если параллельная вставка заняла выбранный
+    SLUG_SAVE_ATTEMPTS = 5
+
+    def _free_slug(self, base: str) -> str:
+        # Один запрос на занятые base и base-N (не на все slug с префиксом base), затем первый свободный суффикс
+        taken = set(
+            Story.objects.filter(Q(slug=base) | Q(slug__regex=rf"^{re.escape(base)}-\d+$"))
+            .exclude(pk=self.pk).values_list("slug", flat=True)
+        )
+        if base not in taken:
+            return base
+        n = 1
+        while f"{base}-{n}" in taken:
+            n += 1
+        return f"{base}-{n}"
+
     def save(self, *args, **kwargs):
-        if not self.slug:
-            base = slugify(self.title, allow_unicode=True)[:240] or "story"
-            slug = base
-            n = 1
-            while Story.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                slug = f"{base}-{n}"
-                n += 1
-            self.slug = slug
-        super().save(*args, **kwargs)
+        if self.slug:
+            return super().save(*args, **kwargs)
+        base = slugify(self.title, allow_unicode=True)[:240] or "story"
+        for attempt in range(self.SLUG_SAVE_ATTEMPTS):
+            self.slug = self._free_slug(base)
+            try:
+                # Точка сохранения: при конфликте откатывается только эта вставка, а не внешняя транзакция
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                taken = Story.objects.filter(slug=self.slug).exclude(pk=self.pk).exists()
+                if not taken or attempt == self.SLUG_SAVE_ATTEMPTS - 1:
+                    self.slug = ""
+                    raise
 
 
     @property
     def is_published(self):
         return self.status == StoryStatus.PUBLISHED
 
+    @property
+    def progress_percent(self):
+        return _percent(self.translated_count, self.paragraphs_count)
+
     def __str__(self):
         return self.title
 
@@ -106,6 +157,21 @@ class Paragraph(models.Model):
     def __str__(self):
         return f"{self.story.title} #{self.index}"
 
+    @property
+    def illustration_slots(self):
+        """
+        Пять иллюстраций абзаца по позициям. В БД хранятся только выбранные или с настоящим URL,
+        остальные позиции — несохранённые заглушки (id=None), вычисляемые из (story_id, index, position).
+        Использует prefetch_related("illustrations"), если он был.
+        """
+        stored = {ill.position: ill for ill in self.illustrations.all()}
+        return [
+            stored.get(pos) or Illustration(
+                paragraph=self, position=pos, image_url=placeholder_url(self.story_id, self.index, pos),
+            )
+            for pos in ILLUSTRATION_POSITIONS
+        ]
+
 
 class Illustration(models.Model):
     paragraph = models.ForeignKey(Paragraph, related_name="illustrations", on_delete=models.CASCADE)
@@ -118,4 +184,78 @@ class Illustration(models.Model):
         ordering = ["position"]
 
     def __str__(self):
-        return f"Illu p{self.paragraph_id} pos{self.position}"
\ No newline at end of file
+        return f"Illu p{self.paragraph_id} pos{self.position}"
+
+class ImportSessionStatus(models.TextChoices):
+    OPEN = "OPEN", "Open"
+    COMMITTED = "COMMITTED", "Committed"
+
+
+class ImportSession(models.Model):
+    """
+    Поэтапный импорт большой истории: текст приходит частями (главами или пачками абзацев),
+    каждая часть сразу пишется в БД. seq — номер последней принятой части,
+    по нему клиент продолжает импорт после обрыва.
+    """
+    story = models.ForeignKey(Story, related_name="import_sessions", on_delete=models.CASCADE)
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name="import_sessions")
+    status = models.CharField(max_length=12, choices=ImportSessionStatus.choices, default=ImportSessionStatus.OPEN)
+    last_seq = models.PositiveIntegerField(default=0)
+    paragraphs_count = models.PositiveIntegerField(default=0)
+    chapters_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Import #{self.pk} -> {self.story_id} ({self.status})"
+
+
+class JobKind(models.TextChoices):
+    PARSE = "PARSE", "Parse story"
+    ILLUSTRATIONS = "ILLUSTRATIONS", "Placeholder illustrations"
+    MACHINE_TRANSLATE = "MACHINE_TRANSLATE", "Machine translation"
+
+
+class JobStatus(models.TextChoices):
+    QUEUED = "QUEUED", "Queued"
+    RUNNING = "RUNNING", "Running"
+    DONE = "DONE", "Done"
+    FAILED = "FAILED", "Failed"
+
+
+class Job(models.Model):
+    """
+    Фоновая задача по истории. Очередь хранится в БД, выполняет её `manage.py run_jobs`
+    (сколько процессов воркера запущено — столько задач идёт одновременно).
+    """
+    kind = models.CharField(max_length=20, choices=JobKind.choices)
+    story = models.ForeignKey(Story, related_name="jobs", on_delete=models.CASCADE)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=JobStatus.choices, default=JobStatus.QUEUED)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    result = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True, default="")
+    worker = models.CharField(max_length=64, blank=True, default="")
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name="jobs")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Последний признак жизни воркера (захват, прогресс); по нему зависшие RUNNING возвращаются в очередь
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["status", "id"]),
+            models.Index(fields=["story", "status"]),
+        ]
+
+    @property
+    def duration_s(self):
+        if not self.started_at:
+            return None
+        return ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+
+    def __str__(self):
+        return f"Job #{self.pk} {self.kind} story={self.story_id} ({self.status})"
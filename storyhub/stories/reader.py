@@ -0,0 +1,186 @@
+# stories/reader.py
+# Сборка текста истории для страницы чтения: фиксированное число запросов
+# независимо от длины истории, результат — неизменяемые кортежи для шаблона.
+from typing import NamedTuple, Optional, Tuple
+
+from django.db.models import F, Prefetch
+
+from .models import Chapter, Illustration, Paragraph, Story, StoryStatus
+
+
+class ReaderIllustration(NamedTuple):
+    position: int
+    image_url: str
+
+
+class ReaderItem(NamedTuple):
+    index: int
+    text: str
+    illustrations: Tuple[ReaderIllustration, ...]
+
+
+class ReaderChapter(NamedTuple):
+    index: int
+    title: str
+    items: Tuple[ReaderItem, ...]
+
+
+class ReaderContent(NamedTuple):
+    chapters: Tuple[ReaderChapter, ...]  # пусто, если у истории нет глав
+    items: Tuple[ReaderItem, ...]        # абзацы истории без глав
+
+
+def reader_paragraphs(story: Story, translator_id: Optional[int] = None):
+    """
+    Абзацы истории с финализированным переводом назначенного переводчика (p.reader_translations)
+    и выбранными иллюстрациями (p.selected_illustrations). Всего три запроса на любой объём.
+    """
+    from translations.models import Translation
+
+    translator_id = story.assigned_to_id if translator_id is None else translator_id
+    return (
+        Paragraph.objects.filter(story=story)
+        .only("id", "index", "chapter_id")
+        .order_by("index")
+        .prefetch_related(
+            Prefetch(
+                "translations",
+                queryset=Translation.objects.filter(translator_id=translator_id, is_finalized=True).only("paragraph_id", "text"),
+                to_attr="reader_translations",
+            ),
+            Prefetch(
+                "illustrations",
+                queryset=Illustration.objects.filter(is_selected=True).only("paragraph_id", "position", "image_url"),
+                to_attr="selected_illustrations",
+            ),
+        )
+    )
+
+
+def reader_item(p: Paragraph) -> ReaderItem:
+    tr = p.reader_translations[0] if p.reader_translations else None
+    return ReaderItem(
+        index=p.index,
+        text=tr.text if tr else "",
+        illustrations=tuple(ReaderIllustration(i.position, i.image_url) for i in p.selected_illustrations[:5]),
+    )
+
+
+def build_reader_content(story: Story) -> ReaderContent:
+    """Весь текст истории для чтения: главы и абзацы за четыре запроса."""
+    chapters = list(Chapter.objects.filter(story=story).order_by("index").values_list("id", "index", "title"))
+    items_by_chapter = {}
+    plain = []
+    for p in reader_paragraphs(story):
+        item = reader_item(p)
+        if chapters:
+            items_by_chapter.setdefault(p.chapter_id, []).append(item)
+        else:
+            plain.append(item)
+    return ReaderContent(
+        chapters=tuple(
+            ReaderChapter(index, title, tuple(items_by_chapter.get(ch_id, ())))
+            for ch_id, index, title in chapters
+        ),
+        items=tuple(plain),
+    )
+
+
+# Версия формата снимка: при смене структуры старые снимки просто пересобираются
+SNAPSHOT_VERSION = 2
+# Абзацев на страницу чтения у историй без глав; у историй с главами страница — глава
+READER_PAGE_SIZE = 50
+
+
+class ReaderPage(NamedTuple):
+    number: int                     # с 0
+    pages_count: int
+    chapter: Optional[ReaderChapter]  # глава целиком, если история разбита на главы
+    items: Tuple[ReaderItem, ...]   # абзацы страницы (у главы — её абзацы)
+
+    @property
+    def next_number(self) -> Optional[int]:
+        return self.number + 1 if self.number + 1 < self.pages_count else None
+
+
+def _item_to_json(item: ReaderItem) -> list:
+    return [item.index, item.text, [[i.position, i.image_url] for i in item.illustrations]]
+
+
+def _item_from_json(row: list) -> ReaderItem:
+    index, text, illustrations = row
+    return ReaderItem(index, text, tuple(ReaderIllustration(pos, url) for pos, url in illustrations))
+
+
+def snapshot_from_content(content: ReaderContent) -> dict:
+    """
+    Компактный JSON, заранее разбитый на страницы: {"v", "pages_count", "pages": [{"chapter", "items"}]}.
+    Абзац — [index, text, [[position, image_url], ...]]. Страницу читаем из БД по пути
+    reader_snapshot__pages__N, не загружая снимок целиком.
+    """
+    if content.chapters:
+        pages = [
+            {"chapter": {"index": ch.index, "title": ch.title}, "items": [_item_to_json(i) for i in ch.items]}
+            for ch in content.chapters
+        ]
+    else:
+        items = [_item_to_json(i) for i in content.items]
+        pages = [
+            {"chapter": None, "items": items[start:start + READER_PAGE_SIZE]}
+            for start in range(0, len(items), READER_PAGE_SIZE)
+        ]
+    return {"v": SNAPSHOT_VERSION, "pages_count": len(pages), "pages": pages}
+
+
+def _page_from_json(number: int, pages_count: int, data: dict) -> ReaderPage:
+    items = tuple(_item_from_json(r) for r in data["items"])
+    ch = data.get("chapter")
+    chapter = ReaderChapter(ch["index"], ch["title"], items) if ch else None
+    return ReaderPage(number, pages_count, chapter, items)
+
+
+def store_reader_snapshot(story: Story) -> dict:
+    """
+    Собирает текст для чтения и сохраняет его в story.reader_snapshot (при публикации).
+    Запись условная по content_version, прочитанной до сборки: если правка успела пройти,
+    пока снимок собирался, он отдаётся этому запросу, но не сохраняется.
+    """
+    version = Story.objects.filter(pk=story.pk).values_list("content_version", flat=True).first()
+    data = snapshot_from_content(build_reader_content(story))
+    stored = Story.objects.filter(pk=story.pk, content_version=version).update(reader_snapshot=data)
+    story.reader_snapshot = data if stored else None
+    return data
+
+
+def invalidate_reader_snapshot(**filters) -> None:
+    """
+    Отмечает изменение содержимого историй по фильтру (pk=..., paragraphs=...): сдвигает
+    content_version и сбрасывает снимок — его пересоберёт следующее чтение.
+    """
+    Story.objects.filter(**filters).update(content_version=F("content_version") + 1, reader_snapshot=None)
+
+
+def reader_page(story: Story, number: int = 0) -> Optional[ReaderPage]:
+    """
+    Одна страница текста для чтения; None — страницы с таким номером нет.
+
+    Опубликованная история читается из снимка одним запросом, который достаёт из JSON только
+    нужную страницу — память на запрос не растёт с длиной истории. Если снимка нет (сброшен
+    правкой или история опубликована до его появления), он собирается и сохраняется.
+    Неопубликованная история собирается заново при каждом обращении.
+    """
+    if number < 0:
+        return None
+    if story.status == StoryStatus.PUBLISHED:
+        row = Story.objects.filter(pk=story.pk).values_list(
+            "reader_snapshot__v", "reader_snapshot__pages_count", f"reader_snapshot__pages__{number}",
+        ).first()
+        if row and row[0] == SNAPSHOT_VERSION:
+            pages_count, page = row[1], row[2]
+            return _page_from_json(number, pages_count, page) if page else None
+        data = store_reader_snapshot(story)
+    else:
+        data = snapshot_from_content(build_reader_content(story))
+    if number >= data["pages_count"]:
+        return None
+    return _page_from_json(number, data["pages_count"], data["pages"][number])
@@ -1,6 +1,6 @@
 # stories/serializers.py
 from rest_framework import serializers
-from .models import Language, Tag, Story, Paragraph, Illustration, Chapter
+from .models import Language, Tag, Story, Paragraph, Illustration, Chapter, ImportSession, Job
 from translations.models import Translation
 
 class LanguageSerializer(serializers.ModelSerializer):
@@ -19,7 +19,8 @@ class IllustrationSerializer(serializers.ModelSerializer):
         fields = ["id", "image_url", "position", "is_selected"]
 
 class ParagraphSerializer(serializers.ModelSerializer):
-    illustrations = IllustrationSerializer(many=True, read_only=True)
+    # Всегда 5 позиций: сохранённые иллюстрации + вычисляемые заглушки (id = null)
+    illustrations = IllustrationSerializer(source="illustration_slots", many=True, read_only=True)
 
     class Meta:
         model = Paragraph
@@ -37,18 +38,24 @@ class ChapterSerializer(serializers.ModelSerializer):
     paragraphs = ParagraphSerializer(many=True, read_only=True)
     class Meta:
         model = Chapter
-        fields = ["id", "index", "title", "paragraphs"]
+        fields = ["id", "index", "title", "paragraphs_count", "finalized_count", "progress_percent", "paragraphs"]
+
+class ChapterSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Chapter
+        fields = ["id", "index", "title", "paragraphs_count", "finalized_count", "progress_percent"]
 
 class StoryDetailSerializer(serializers.ModelSerializer):
+    # Только метаданные и оглавление; абзацы — GET /api/stories/{id}/paragraphs/ (с диапазонами)
     tags = TagSerializer(many=True, read_only=True)
-    paragraphs = ParagraphSerializer(many=True, read_only=True)
+    chapters = ChapterSummarySerializer(many=True, read_only=True)
 
     class Meta:
         model = Story
         fields = [
             "id", "title", "slug", "description", "status",
             "paragraphs_count", "translated_count", "tags", "published_at",
-            "poster_url", "paragraphs"
+            "poster_url", "chapters"
         ]
 
 
@@ -65,3 +72,39 @@ class StoryCreateSerializer(serializers.ModelSerializer):
         if tags:
             story.tags.set(tags)
         return story
+
+
+class ImportSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportSession
+        fields = ["id", "story", "status", "last_seq", "paragraphs_count", "chapters_count", "created_at", "updated_at"]
+        read_only_fields = fields
+
+
+class ImportChapterChunkSerializer(serializers.Serializer):
+    seq = serializers.IntegerField(min_value=1)
+    title = serializers.CharField(required=False, allow_blank=True, default="")
+    original_text = serializers.CharField(required=False, allow_blank=True, default="", trim_whitespace=False)
+    machine_text = serializers.CharField(required=False, allow_blank=True, default="", trim_whitespace=False)
+
+
+class ImportParagraphRowSerializer(serializers.Serializer):
+    original_text = serializers.CharField(allow_blank=True)
+    machine_text = serializers.CharField(required=False, allow_blank=True, default="")
+
+
+class ImportParagraphsChunkSerializer(serializers.Serializer):
+    seq = serializers.IntegerField(min_value=1)
+    paragraphs = ImportParagraphRowSerializer(many=True)
+
+
+class JobSerializer(serializers.ModelSerializer):
+    duration_s = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Job
+        fields = [
+            "id", "kind", "story", "status", "progress", "total", "result", "error",
+            "created_at", "started_at", "finished_at", "duration_s",
+        ]
+        read_only_fields = fields
@@ -1,81 +1,453 @@
 # stories/services.py
-from typing import List
+import difflib
+import hashlib
+import sys
+from datetime import timedelta
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+from django.conf import settings
 from django.db import transaction
-from .models import Story, Paragraph, Illustration
+from django.db.models import Count, F
+from .models import Story, StoryStatus, Paragraph, ImportSession, ImportSessionStatus, PLACEHOLDER_URL
+from .reader import invalidate_reader_snapshot
+from django.utils import timezone
 from django.utils.text import slugify
 
-PLACEHOLDER_URL = "https://picsum.photos/seed/{seed}/400/300"
-
 def _split_paragraphs(text: str) -> List[str]:
     if not text:
         return []
+    # Тексты из Windows приходят с CRLF — без замены "\r\n\r\n" не делится на абзацы
+    text = text.replace("\r\n", "\n")
     parts = [p.strip() for p in text.strip().split("\n\n")]
     return [p for p in parts if p != ""]
 
-@transaction.atomic
-def parse_story_paragraphs(story: Story, original_text: str, machine_text: str):
-    # Простой режим без глав (совместим с текущей БД даже если нет таблицы Chapter)
-    Paragraph.objects.filter(story=story).delete()
+# Размер пачки для bulk_create: укладывается в лимит параметров SQLite и не раздувает запрос в PostgreSQL
+BULK_BATCH_SIZE = 500
+
+
+def _resolve_pks(objs: list, model, story: Story) -> None:
+    # PostgreSQL и SQLite >= 3.35 возвращают pk из bulk_create (RETURNING).
+    # На прочих бэкендах добираем их одним запросом по (story, index).
+    if not objs or objs[0].pk is not None:
+        return
+    ids = dict(model.objects.filter(story=story).values_list("index", "id"))
+    for obj in objs:
+        obj.pk = ids[obj.index]
+
 
+def _bulk_create_paragraphs(story: Story, paragraphs: List[Paragraph]) -> int:
+    """Вставляет абзацы пачками, а не по одному INSERT. Иллюстрации-заглушки не хранятся (Paragraph.illustration_slots)."""
+    Paragraph.objects.bulk_create(paragraphs, batch_size=BULK_BATCH_SIZE)
+    _resolve_pks(paragraphs, Paragraph, story)
+    return len(paragraphs)
+
+
+def _paragraph_rows(original_text: str, machine_text: str):
     orig = _split_paragraphs(original_text)
     mach = _split_paragraphs(machine_text)
+    for i in range(max(len(orig), len(mach))):
+        yield (orig[i] if i < len(orig) else ""), (mach[i] if i < len(mach) else "")
+
+
+def _content_hash(text: str) -> str:
+    # Пробелы по краям и внутри строки не считаем изменением текста
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
 
-    n = max(len(orig), len(mach))
-    created = 0
-    for i in range(n):
-        o = orig[i] if i < len(orig) else ""
-        m = mach[i] if i < len(mach) else ""
-        p = Paragraph.objects.create(story=story, index=i+1, original_text=o, machine_text=m)
-        for pos in range(1, 6):
-            Illustration.objects.create(
-                paragraph=p,
-                position=pos,
-                image_url=PLACEHOLDER_URL.format(seed=f"{story.id}-{i+1}-{pos}")
-            )
-        created += 1
+def touch_story_content(story: Story) -> None:
+    """
+    Отмечает изменение абзацев, иллюстраций или переводов истории: сдвигает content_version
+    (ETag списка абзацев, защита от записи устаревшего снимка) и сбрасывает снимок для чтения.
+    Одно UPDATE с F(), без гонок между запросами.
+    """
+    invalidate_reader_snapshot(pk=story.pk)
+    story.reader_snapshot = None
+
+
+# Внутри deferred_counters() удаления абзацев и глав идут из разбора, который сам пересчитывает
+# счётчики в конце: обработчик каскадного удаления переводов их не трогает
+_counters_deferred = ContextVar("counters_deferred", default=False)
+
+
+@contextmanager
+def deferred_counters():
+    token = _counters_deferred.set(True)
+    try:
+        yield
+    finally:
+        _counters_deferred.reset(token)
+
+
+def counters_deferred() -> bool:
+    return _counters_deferred.get()
+
+
+def _finalized_count(story: Story) -> int:
+    from translations.models import Translation
+    if not story.assigned_to_id:
+        return 0
+    return Translation.objects.filter(
+        paragraph__story=story, translator_id=story.assigned_to_id, is_finalized=True,
+    ).values("paragraph_id").distinct().count()
+
+
+def refresh_chapter_counters(story: Story) -> None:
+    """
+    Пересчитывает paragraphs_count / finalized_count всех глав истории двумя агрегатами.
+    Нужен после разбора, когда абзацы переезжают между главами; при сохранении перевода
+    счётчики меняются дельтой (translations.services.apply_finalized_change).
+    """
+    from .models import Chapter
+    from translations.models import Translation
+
+    chapters = list(Chapter.objects.filter(story=story))
+    if not chapters:
+        return
+    paragraphs = dict(
+        Paragraph.objects.filter(story=story, chapter__isnull=False).values("chapter_id")
+        .annotate(n=Count("id")).values_list("chapter_id", "n")
+    )
+    finalized = {}
+    if story.assigned_to_id:
+        finalized = dict(
+            Translation.objects.filter(
+                paragraph__story=story, paragraph__chapter__isnull=False,
+                translator_id=story.assigned_to_id, is_finalized=True,
+            ).values("paragraph__chapter_id").annotate(n=Count("paragraph_id", distinct=True))
+            .values_list("paragraph__chapter_id", "n")
+        )
+    for ch in chapters:
+        ch.paragraphs_count = paragraphs.get(ch.pk, 0)
+        ch.finalized_count = finalized.get(ch.pk, 0)
+    Chapter.objects.bulk_update(chapters, ["paragraphs_count", "finalized_count"], batch_size=BULK_BATCH_SIZE)
+
+
+def _reparse_incremental(story: Story, rows: List[Tuple[str, str, Optional[int]]]) -> dict:
+    """
+    Применяет новый список абзацев (original, machine, chapter_id) к уже разобранной истории.
+
+    Старые и новые абзацы выравниваются по хэшу текста (difflib.SequenceMatcher):
+    совпавшие сохраняются вместе с переводами, заметками и иллюстрациями (меняется только index,
+    если абзац сдвинулся), заменённые один к одному обновляются на месте (их переводы перестают
+    быть финализированными), лишние удаляются, недостающие создаются. Трогаются только
+    изменившиеся строки.
+    """
+    existing = list(
+        Paragraph.objects.filter(story=story).order_by("index")
+        .only("id", "index", "original_text", "machine_text", "chapter_id")
+    )
+    matcher = difflib.SequenceMatcher(
+        None,
+        [_content_hash(p.original_text) for p in existing],
+        [_content_hash(o) for o, _, _ in rows],
+        autojunk=False,
+    )
+
+    to_update, to_create, to_delete = [], [], []
+    moved_ids, rewritten_ids = [], []
+
+    def keep(p: Paragraph, j: int, text_changed: bool) -> None:
+        o, m, chapter_id = rows[j]
+        new_index = j + 1
+        # Машинный перевод из запроса перезаписывает старый, только если он передан
+        # или если изменился сам исходный текст (старый перевод устарел)
+        machine = m if (m or text_changed) else p.machine_text
+        if (p.index, p.original_text, p.machine_text, p.chapter_id) == (new_index, o, machine, chapter_id):
+            return
+        if p.index != new_index:
+            moved_ids.append(p.pk)
+        if p.original_text != o:
+            rewritten_ids.append(p.pk)
+        p.index, p.original_text, p.machine_text, p.chapter_id = new_index, o, machine, chapter_id
+        to_update.append(p)
+
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for k in range(i2 - i1):
+                keep(existing[i1 + k], j1 + k, text_changed=False)
+            continue
+        # replace / delete / insert: попарно обновляем, остаток удаляем или создаём
+        paired = min(i2 - i1, j2 - j1)
+        for k in range(paired):
+            keep(existing[i1 + k], j1 + k, text_changed=True)
+        to_delete.extend(p.pk for p in existing[i1 + paired:i2])
+        for j in range(j1 + paired, j2):
+            o, m, chapter_id = rows[j]
+            to_create.append(Paragraph(story=story, index=j + 1, original_text=o, machine_text=m, chapter_id=chapter_id))
+
+    if to_delete:
+        with deferred_counters():
+            Paragraph.objects.filter(pk__in=to_delete).delete()
+    if moved_ids:
+        # Уводим сдвинутые абзацы за пределы диапазона, чтобы не нарушить unique (story, index)
+        offset = max([p.index for p in existing] + [len(rows)]) + len(existing) + 1
+        Paragraph.objects.filter(pk__in=moved_ids).update(index=F("index") + offset)
+    Paragraph.objects.bulk_update(
+        to_update, ["index", "original_text", "machine_text", "chapter"], batch_size=BULK_BATCH_SIZE,
+    )
+    _bulk_create_paragraphs(story, to_create)
+    if rewritten_ids:
+        # Перевод остаётся черновиком для переводчика, но к новому исходному тексту уже не готов
+        from translations.models import Translation
+        Translation.objects.filter(paragraph_id__in=rewritten_ids, is_finalized=True).update(is_finalized=False)
+
+    story.paragraphs_count = len(rows)
+    story.translated_count = _finalized_count(story)
+    story.save(update_fields=["paragraphs_count", "translated_count"])
+    touch_story_content(story)
+    refresh_chapter_counters(story)
+    return {
+        "kept": len(existing) - len(to_delete) - len(to_update),
+        "updated": len(to_update),
+        "created": len(to_create),
+        "deleted": len(to_delete),
+    }
+
+
+@transaction.atomic
+def parse_story_paragraphs(story: Story, original_text: str, machine_text: str, incremental: bool = False):
+    if incremental:
+        rows = [(o, m, None) for o, m in _paragraph_rows(original_text, machine_text)]
+        _reparse_incremental(story, rows)
+        return len(rows)
+
+    # Простой режим без глав (совместим с текущей БД даже если нет таблицы Chapter)
+    with deferred_counters():
+        Paragraph.objects.filter(story=story).delete()
+    story.chapters.update(paragraphs_count=0, finalized_count=0)
+
+    paragraphs = [
+        Paragraph(story=story, index=i, original_text=o, machine_text=m)
+        for i, (o, m) in enumerate(_paragraph_rows(original_text, machine_text), start=1)
+    ]
+    created = _bulk_create_paragraphs(story, paragraphs)
 
     story.paragraphs_count = created
     story.translated_count = 0
     story.save(update_fields=["paragraphs_count", "translated_count"])
+    touch_story_content(story)
     return created
 
+def _reparse_chapters_incremental(story: Story, chapters_payload: List[dict]) -> int:
+    from .models import Chapter
+
+    # Главы сопоставляем по номеру: переименование главы не пересоздаёт её абзацы
+    chapters = {c.index: c for c in Chapter.objects.filter(story=story)}
+    new_chapters, renamed = [], []
+    for ch_idx, ch in enumerate(chapters_payload, start=1):
+        title = (ch.get("title") or "").strip()
+        chapter = chapters.get(ch_idx)
+        if chapter is None:
+            new_chapters.append(Chapter(story=story, index=ch_idx, title=title))
+        elif chapter.title != title:
+            chapter.title = title
+            renamed.append(chapter)
+    Chapter.objects.bulk_create(new_chapters, batch_size=BULK_BATCH_SIZE)
+    _resolve_pks(new_chapters, Chapter, story)
+    Chapter.objects.bulk_update(renamed, ["title"], batch_size=BULK_BATCH_SIZE)
+    chapters.update({c.index: c for c in new_chapters})
+
+    rows = []
+    for ch_idx, ch in enumerate(chapters_payload, start=1):
+        for o, m in _paragraph_rows(ch.get("original_text") or "", ch.get("machine_text") or ""):
+            rows.append((o, m, chapters[ch_idx].pk))
+    _reparse_incremental(story, rows)
+    # Лишние главы удаляем последними: их абзацы к этому моменту уже перенесены или удалены
+    with deferred_counters():
+        Chapter.objects.filter(story=story, index__gt=len(chapters_payload)).delete()
+    return len(rows)
+
+
 @transaction.atomic
-def parse_story_with_chapters(story: Story, chapters_payload: List[dict]):
+def parse_story_with_chapters(story: Story, chapters_payload: List[dict], incremental: bool = False):
     # Импортируем Chapter лениво, чтобы отсутствие модели/таблицы не ломало parse_story_paragraphs
     from .models import Chapter
 
-    Paragraph.objects.filter(story=story).delete()
-    Chapter.objects.filter(story=story).delete()
+    if incremental:
+        return _reparse_chapters_incremental(story, chapters_payload)
 
-    global_index = 0
-    created = 0
-    for ch_idx, ch in enumerate(chapters_payload, start=1):
-        chapter = Chapter.objects.create(
-            story=story, index=ch_idx, title=(ch.get("title") or "").strip()
-        )
-        orig = _split_paragraphs(ch.get("original_text") or "")
-        mach = _split_paragraphs(ch.get("machine_text") or "")
-        n = max(len(orig), len(mach))
-        for i in range(n):
-            global_index += 1
-            o = orig[i] if i < len(orig) else ""
-            m = mach[i] if i < len(mach) else ""
-            p = Paragraph.objects.create(
+    with deferred_counters():
+        Paragraph.objects.filter(story=story).delete()
+        Chapter.objects.filter(story=story).delete()
+
+    rows_by_chapter = [
+        list(_paragraph_rows(ch.get("original_text") or "", ch.get("machine_text") or ""))
+        for ch in chapters_payload
+    ]
+    chapters = [
+        Chapter(story=story, index=ch_idx, title=(ch.get("title") or "").strip(), paragraphs_count=len(rows))
+        for ch_idx, (ch, rows) in enumerate(zip(chapters_payload, rows_by_chapter), start=1)
+    ]
+    Chapter.objects.bulk_create(chapters, batch_size=BULK_BATCH_SIZE)
+    _resolve_pks(chapters, Chapter, story)
+
+    paragraphs = []
+    for chapter, rows in zip(chapters, rows_by_chapter):
+        for o, m in rows:
+            paragraphs.append(Paragraph(
                 story=story,
                 chapter=chapter,
-                index=global_index,
+                index=len(paragraphs) + 1,
                 original_text=o,
                 machine_text=m,
-            )
-            for pos in range(1, 6):
-                Illustration.objects.create(
-                    paragraph=p,
-                    position=pos,
-                    image_url=PLACEHOLDER_URL.format(seed=f"{story.id}-{global_index}-{pos}")
-                )
-            created += 1
+            ))
+    created = _bulk_create_paragraphs(story, paragraphs)
 
     story.paragraphs_count = created
     story.translated_count = 0
     story.save(update_fields=["paragraphs_count", "translated_count"])
-    return created
\ No newline at end of file
+    touch_story_content(story)
+    return created
+
+
+class ImportChunkError(Exception):
+    """Часть импорта не может быть принята (сессия закрыта или пропущен номер части)."""
+
+
+def _lock_import_session(session_id: int) -> ImportSession:
+    session = ImportSession.objects.select_for_update().select_related("story").get(pk=session_id)
+    if session.status != ImportSessionStatus.OPEN:
+        raise ImportChunkError("Import session is already committed")
+    return session
+
+
+def _check_seq(session: ImportSession, seq: int) -> bool:
+    # Повтор уже принятой части (клиент не получил ответ) — не ошибка, просто пропускаем
+    if seq <= session.last_seq:
+        return False
+    if seq != session.last_seq + 1:
+        raise ImportChunkError(f"Expected chunk {session.last_seq + 1}, got {seq}")
+    return True
+
+
+@transaction.atomic
+def import_append_chapter(session_id: int, seq: int, title: str, original_text: str, machine_text: str) -> ImportSession:
+    """Добавляет в открытую сессию главу целиком."""
+    from .models import Chapter
+
+    session = _lock_import_session(session_id)
+    if not _check_seq(session, seq):
+        return session
+    rows = list(_paragraph_rows(original_text, machine_text))
+    chapter = Chapter.objects.create(
+        story=session.story, index=session.chapters_count + 1, title=(title or "").strip(), paragraphs_count=len(rows),
+    )
+    paragraphs = [
+        Paragraph(story=session.story, chapter=chapter, index=session.paragraphs_count + i,
+                  original_text=o, machine_text=m)
+        for i, (o, m) in enumerate(rows, start=1)
+    ]
+    session.paragraphs_count += _bulk_create_paragraphs(session.story, paragraphs)
+    touch_story_content(session.story)
+    session.chapters_count += 1
+    session.last_seq = seq
+    session.save(update_fields=["paragraphs_count", "chapters_count", "last_seq", "updated_at"])
+    return session
+
+
+@transaction.atomic
+def import_append_paragraphs(session_id: int, seq: int, rows: List[dict]) -> ImportSession:
+    """
+    Добавляет пачку абзацев [{"original_text", "machine_text"}] в конец истории
+    (в последнюю главу, если главы уже есть).
+    """
+    from .models import Chapter
+
+    session = _lock_import_session(session_id)
+    if not _check_seq(session, seq):
+        return session
+    chapter_id = None
+    if session.chapters_count:
+        chapter_id = (
+            Chapter.objects.filter(story=session.story, index=session.chapters_count)
+            .values_list("id", flat=True).first()
+        )
+    paragraphs = [
+        Paragraph(story=session.story, chapter_id=chapter_id, index=session.paragraphs_count + i,
+                  original_text=(row.get("original_text") or "").strip(),
+                  machine_text=(row.get("machine_text") or "").strip())
+        for i, row in enumerate(rows, start=1)
+    ]
+    session.paragraphs_count += _bulk_create_paragraphs(session.story, paragraphs)
+    if chapter_id:
+        Chapter.objects.filter(pk=chapter_id).update(paragraphs_count=F("paragraphs_count") + len(paragraphs))
+    touch_story_content(session.story)
+    session.last_seq = seq
+    session.save(update_fields=["paragraphs_count", "last_seq", "updated_at"])
+    return session
+
+
+@transaction.atomic
+def import_commit(session_id: int) -> ImportSession:
+    """Закрывает сессию, проставляет счётчики истории и открывает её переводчикам (DRAFT)."""
+    session = _lock_import_session(session_id)
+    story = session.story
+    story.paragraphs_count = session.paragraphs_count
+    story.translated_count = 0
+    story.status = StoryStatus.DRAFT
+    story.save(update_fields=["paragraphs_count", "translated_count", "status"])
+    touch_story_content(story)
+    session.status = ImportSessionStatus.COMMITTED
+    session.save(update_fields=["status", "updated_at"])
+    return session
+
+
+# Сколько открытая сессия импорта может простаивать, прежде чем её история будет удалена
+IMPORT_SESSION_TTL = timedelta(days=1)
+
+
+def expire_import_sessions(ttl: timedelta = IMPORT_SESSION_TTL) -> int:
+    """
+    Удаляет истории брошенных импортов: сессия открыта и не получала частей дольше ttl.
+    Такие истории ещё в статусе IMPORTING и никому, кроме админа, не видны. Возвращает их число.
+    """
+    stale = Story.objects.filter(
+        status=StoryStatus.IMPORTING,
+        import_sessions__status=ImportSessionStatus.OPEN,
+        import_sessions__updated_at__lt=timezone.now() - ttl,
+    ).values_list("pk", flat=True)
+    ids = list(stale)
+    if ids:
+        Story.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def _consensus_module():
+    # Пайплайн живёт вне Django-проекта, подключаем его по пути из настроек
+    path = str(settings.CONSENSUS_TRANSLATE_DIR)
+    if path not in sys.path:
+        sys.path.append(path)
+    import kobold_cpp_implimitation
+    return kobold_cpp_implimitation
+
+
+def machine_translate_story(story: Story, only_missing: bool = False, in_flight: int = None,
+                            on_write=None, **kwargs):
+    """
+    Прогоняет абзацы истории через consensus_translate_batch и пишет результат в machine_text.
+    Генератор: отдаёт (paragraph_id, результат) по мере готовности.
+    on_write() вызывается в транзакции записи каждого абзаца; исключение из него откатывает запись.
+    """
+    ct = _consensus_module()
+    qs = Paragraph.objects.filter(story=story).order_by("index")
+    if only_missing:
+        qs = qs.filter(machine_text="")
+    rows = list(qs.values_list("id", "original_text"))
+
+    results = ct.consensus_translate_batch(
+        (text for _, text in rows),
+        target_lang=story.target_language.name,
+        source_lang=story.original_language.name,
+        in_flight=in_flight or ct.Config.PARAGRAPHS_IN_FLIGHT,
+        **kwargs,
+    )
+    for i, result in results:
+        # Пишем сразу: при падении посреди истории готовые абзацы сохранятся. machine_text входит
+        # в /paragraphs/, поэтому версия содержимого (ETag) сдвигается в той же транзакции
+        with transaction.atomic():
+            Paragraph.objects.filter(pk=rows[i][0]).update(machine_text=result["final_translation"])
+            touch_story_content(story)
+            if on_write is not None:
+                on_write()
+        yield rows[i][0], result
@@ -0,0 +1,122 @@
+# stories/text.py
+# Нормализация сырого текста перед импортом. Чистые функции без Django —
+# их можно гонять в пуле процессов (см. manage.py import_corpus).
+import re
+from typing import List, Set
+
+# Неразрывные и «узкие» пробелы -> обычный пробел
+_SPACES_RE = re.compile("[\u00a0\u2007\u2009\u202f\u3000\t]")
+# Zero-width символы, BOM и мягкий перенос — удаляем
+_INVISIBLE_RE = re.compile("[\u200b\u200c\u200d\u2060\ufeff\u00ad]")
+_MULTISPACE_RE = re.compile(" {2,}")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n")
+
+# Блок, где типичная строка короче этого, свёрстан не по ширине (стихи, списки): переносы в нём
+# осмысленные, склеиваем только продолжение со строчной буквы
+_SHORT_LINE = 60
+# В блоке, свёрстанном по ширине, перенос после строки короче этой доли ширины — настоящий
+_SHORT_LINE_RATIO = 0.75
+_OPEN_QUOTES = "“«"
+_CLOSE_QUOTES = "”»"
+# Абзац, оборванный на этих знаках, может продолжаться абзацем со строчной буквы
+_CONTINUATION_CHARS = (",", ";", ":", "-", "—", "–")
+# Сколько следующих абзацев может дописать незакрытая реплика
+_MAX_DIALOGUE_MERGES = 3
+_WORD_RE = re.compile(r"\w+")
+_WORD_TAIL_RE = re.compile(r"\w+$")
+
+
+def normalize_text(text: str) -> str:
+    """CRLF/CR -> LF, неразрывные пробелы -> пробел, невидимые символы удаляются."""
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = _INVISIBLE_RE.sub("", text)
+    text = _SPACES_RE.sub(" ", text)
+    return "\n".join(_MULTISPACE_RE.sub(" ", line).strip() for line in text.split("\n"))
+
+
+def _wrap_width(lines: List[str]) -> int:
+    # Верхняя медиана длин: последняя строка абзаца и редкие короткие строки её не сбивают
+    lengths = sorted(len(l) for l in lines)
+    return lengths[len(lengths) // 2]
+
+
+def _rejoin_hard_wraps(block: str, vocabulary: Set[str]) -> str:
+    """
+    Склеивает строки, разорванные жёстким переносом. Перенос сохраняется, только если строка
+    заметно короче типичной ширины блока (заголовок, конец абзаца внутри блока) — знак препинания
+    на конце строки сам по себе ничего не значит. Дефис на конце строки убирается, только если
+    слитное слово встречается в тексте (exam-/ple при наличии «example»); иначе это настоящий
+    дефис (well-/known -> well-known).
+    """
+    lines = [l for l in block.split("\n") if l]
+    if not lines:
+        return ""
+    width = _wrap_width(lines)
+    out = prev = lines[0]
+    for line in lines[1:]:
+        if prev.endswith("-") and line[:1].islower():
+            head = _WORD_TAIL_RE.search(prev[:-1])
+            tail = _WORD_RE.match(line)
+            joined = (head.group(0) if head else "") + (tail.group(0) if tail else "")
+            out = (out[:-1] if joined.lower() in vocabulary else out) + line
+        elif width < _SHORT_LINE:
+            out += (" " if line[:1].islower() else "\n") + line
+        elif len(prev) < width * _SHORT_LINE_RATIO:
+            out += "\n" + line
+        else:
+            out += " " + line
+        prev = line
+    return out
+
+
+def _quote_open(text: str) -> bool:
+    if any(q in text for q in _OPEN_QUOTES + _CLOSE_QUOTES):
+        return sum(text.count(q) for q in _OPEN_QUOTES) > sum(text.count(q) for q in _CLOSE_QUOTES)
+    # Прямые кавычки не различаются: нечётное число — реплика не закрыта
+    return text.count('"') % 2 == 1
+
+
+def _continues_sentence(prev: str, p: str) -> bool:
+    # Строчная буква сама по себе не повод: предыдущий абзац должен обрываться без точки
+    # («“Hey,” / said Tania.»), а не заканчивать предложение
+    return p[:1].islower() and prev.rstrip(_CLOSE_QUOTES + '"').endswith(_CONTINUATION_CHARS)
+
+
+def _merge_dialogue(paragraphs: List[str]) -> List[str]:
+    """
+    Сливает обрывки реплик: абзац с незакрытой кавычкой склеивается со следующими, только если
+    не дальше чем через _MAX_DIALOGUE_MERGES абзацев кавычка закрывается (одиночная «12"» ничего
+    не съест); абзац со строчной буквы после оборванной фразы — продолжение предыдущего.
+    """
+    merged: List[str] = []
+    i = 0
+    while i < len(paragraphs):
+        p = paragraphs[i]
+        if merged and _continues_sentence(merged[-1], p):
+            merged[-1] = f"{merged[-1]} {p}"
+            i += 1
+            continue
+        merged.append(p)
+        i += 1
+        if not _quote_open(p):
+            continue
+        joined = p
+        for j in range(i, min(i + _MAX_DIALOGUE_MERGES, len(paragraphs))):
+            if paragraphs[j][:1] in _OPEN_QUOTES + '"':
+                break  # новая реплика — прежняя так и осталась незакрытой
+            joined = f"{joined} {paragraphs[j]}"
+            if not _quote_open(joined):
+                merged[-1] = joined
+                i = j + 1
+                break
+    return merged
+
+
+def split_normalized_paragraphs(text: str) -> List[str]:
+    """Нормализует текст и делит его на абзацы по пустым строкам."""
+    if not text:
+        return []
+    blocks = _BLANK_LINES_RE.split(normalize_text(text).strip())
+    vocabulary = {w.lower() for w in _WORD_RE.findall(" ".join(blocks))}
+    paragraphs = [p for p in (_rejoin_hard_wraps(b, vocabulary) for b in blocks) if p]
+    return _merge_dialogue(paragraphs)
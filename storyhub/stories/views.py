@@ -1,22 +1,104 @@
 # stories/views.py
+import hashlib
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 from django.shortcuts import get_object_or_404
 from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 from django.urls import reverse
 
-from .models import Story, StoryStatus, Paragraph, Illustration
-from .serializers import StoryListSerializer, StoryDetailSerializer, ParagraphSerializer, IllustrationSerializer, StoryCreateSerializer
+from .models import Story, StoryStatus, Paragraph, Illustration, ImportSession, Job, JobKind
+from .serializers import (
+    StoryListSerializer, StoryDetailSerializer, ParagraphSerializer, IllustrationSerializer, StoryCreateSerializer,
+    ImportSessionSerializer, ImportChapterChunkSerializer, ImportParagraphsChunkSerializer, JobSerializer,
+)
 from .filters import StoryFilter
-from users.permissions import IsAdminGroup, IsTranslatorGroup
-from .services import parse_story_paragraphs, parse_story_with_chapters
+from users.permissions import IsAdminGroup, IsTranslatorGroup, is_admin_user
+from .services import (
+    parse_story_paragraphs, parse_story_with_chapters,
+    ImportChunkError, import_append_chapter, import_append_paragraphs, import_commit, expire_import_sessions,
+)
+from .jobs import enqueue_job
+from .reader import reader_page, store_reader_snapshot
 from translations.models import TranslatorAssignment, AssignmentStatus, Translation
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 
 
+def _flag(request, name: str) -> bool:
+    return str(request.data.get(name, request.query_params.get(name, ""))).lower() in ("1", "true", "yes")
+
+
+def _parse_payload(request) -> dict:
+    keys = ("chapters", "original_text", "machine_text")
+    return {k: request.data.get(k) for k in keys if request.data.get(k) is not None}
+
+
+def _story_ref(story: Story) -> dict:
+    return {"id": story.id, "slug": story.slug, "title": story.title, "status": story.status}
+
+
+# Параметры выборки абзацев: входят в ETag
+PARAGRAPH_QUERY_PARAMS = ("chapter", "from", "to", "after", "limit")
+PARAGRAPHS_MAX_LIMIT = 500
+
+
+def _int_param(request, name: str):
+    value = request.query_params.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: "Must be an integer"})
+
+
+def _paragraphs_etag(request, story: Story) -> str:
+    # Сильный ETag: версия содержимого истории + параметры выборки (разные диапазоны — разные ответы)
+    params = "&".join(f"{name}={request.query_params.get(name, '')}" for name in PARAGRAPH_QUERY_PARAMS)
+    return quote_etag(f"{story.pk}-{story.content_version}-{hashlib.sha1(params.encode()).hexdigest()[:16]}")
+
+
+def _paragraphs_response(request, story: Story) -> Response:
+    """
+    Абзацы истории с иллюстрациями. Фильтры: ?chapter=<index>, ?from=&to= — диапазон номеров
+    (включительно); ?after=<index>&limit=N — keyset-пагинация по (story, index), ссылка на
+    следующую порцию — в заголовке Link. If-None-Match с текущим ETag даёт 304 без запросов к абзацам.
+    """
+    etag = _paragraphs_etag(request, story)
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == "*"):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    params = {name: _int_param(request, name) for name in PARAGRAPH_QUERY_PARAMS}
+    qs = Paragraph.objects.filter(story=story).order_by("index").prefetch_related("illustrations")
+    if params["chapter"] is not None:
+        qs = qs.filter(chapter__index=params["chapter"])
+    if params["from"] is not None:
+        qs = qs.filter(index__gte=params["from"])
+    if params["to"] is not None:
+        qs = qs.filter(index__lte=params["to"])
+    if params["after"] is not None:
+        qs = qs.filter(index__gt=params["after"])
+    headers = {"ETag": etag}
+    limit = params["limit"]
+    if limit is not None:
+        limit = max(1, min(limit, PARAGRAPHS_MAX_LIMIT))
+        rows = list(qs[:limit])
+        if len(rows) == limit:
+            next_url = replace_query_param(request.build_absolute_uri(), "after", rows[-1].index)
+            headers["Link"] = f'<{next_url}>; rel="next"'
+    else:
+        rows = qs
+    return Response(ParagraphSerializer(rows, many=True).data, headers=headers)
+
+
 class StoryViewSet(viewsets.ModelViewSet):
     queryset = Story.objects.all().prefetch_related("tags")
     filterset_class = StoryFilter
@@ -33,6 +115,13 @@ class StoryViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if not user.is_authenticated or not (user.groups.filter(name__in=["admin", "translator"]).exists()):
             qs = qs.filter(status=StoryStatus.PUBLISHED)
+        elif not is_admin_user(user):
+            # Недогруженную историю переводчик не должен ни видеть, ни брать в работу
+            qs = qs.exclude(status=StoryStatus.IMPORTING)
+        # Снимок для чтения нужен только reader-у опубликованной истории, и тот читает его по частям
+        qs = qs.defer("reader_snapshot")
+        if self.action == "retrieve":
+            qs = qs.prefetch_related("chapters")
         return qs
 
     def create(self, request, *args, **kwargs):
@@ -47,9 +136,7 @@ class StoryViewSet(viewsets.ModelViewSet):
     def preview_paragraphs(self, request, pk=None):
         if not (IsAdminGroup().has_permission(request, self) or IsTranslatorGroup().has_permission(request, self)):
             return Response(status=status.HTTP_403_FORBIDDEN)
-        story = self.get_object()
-        qs = story.paragraphs.all().prefetch_related("illustrations")
-        return Response(ParagraphSerializer(qs, many=True).data)
+        return _paragraphs_response(request, self.get_object())
 
     @action(detail=False, methods=["post"], url_path="import")
     def import_story(self, request):
@@ -57,25 +144,38 @@ class StoryViewSet(viewsets.ModelViewSet):
         if not IsAdminGroup().has_permission(request, self):
             return Response(status=status.HTTP_403_FORBIDDEN)
 
-        # 1) создаём историю
         create_ser = StoryCreateSerializer(data=request.data)
         create_ser.is_valid(raise_exception=True)
-        story = create_ser.save(status=StoryStatus.DRAFT)
 
-        # 2) парсим абзацы
-        chapters = request.data.get("chapters")
-        if isinstance(chapters, list) and chapters:
-            count = parse_story_with_chapters(story, chapters)
-            ch_count = len(chapters)
-        else:
-            original_text = request.data.get("original_text", "") or ""
-            machine_text = request.data.get("machine_text", "") or ""  # если пусто — ок, «без перевода»
-            count = parse_story_paragraphs(story, original_text, machine_text)
-            ch_count = 1 if original_text or machine_text else 0
+        # Создание и разбор — одна транзакция: при ошибке не остаётся пустой истории,
+        # и клиент может безопасно повторить запрос
+        with transaction.atomic():
+            # 1) создаём историю
+            story = create_ser.save(status=StoryStatus.DRAFT)
+
+            # 2) парсим абзацы (background=true — в фоновой задаче, ответ сразу)
+            if _flag(request, "background"):
+                job = enqueue_job(JobKind.PARSE, story, _parse_payload(request), request.user)
+                return Response({
+                    "ok": True,
+                    "story": _story_ref(story),
+                    "job": JobSerializer(job).data,
+                }, status=status.HTTP_202_ACCEPTED)
 
+            chapters = request.data.get("chapters")
+            if isinstance(chapters, list) and chapters:
+                count = parse_story_with_chapters(story, chapters)
+                ch_count = len(chapters)
+            else:
+                original_text = request.data.get("original_text", "") or ""
+                machine_text = request.data.get("machine_text", "") or ""  # если пусто — ок, «без перевода»
+                count = parse_story_paragraphs(story, original_text, machine_text)
+                ch_count = 1 if original_text or machine_text else 0
+
+        # Только счётчики: сериализовать только что загруженный текст обратно незачем
         return Response({
             "ok": True,
-            "story": StoryDetailSerializer(story).data,
+            "story": _story_ref(story),
             "paragraphs": count,
             "chapters": ch_count
         }, status=status.HTTP_201_CREATED)
@@ -86,16 +186,45 @@ class StoryViewSet(viewsets.ModelViewSet):
         if not IsAdminGroup().has_permission(request, self):
             return Response(status=status.HTTP_403_FORBIDDEN)
         story = self.get_object()
+        # incremental=true: сохраняем неизменившиеся абзацы и их переводы вместо полного пересоздания
+        incremental = _flag(request, "incremental")
+        if _flag(request, "background"):
+            job = enqueue_job(JobKind.PARSE, story, {**_parse_payload(request), "incremental": incremental}, request.user)
+            return Response({"ok": True, "job": JobSerializer(job).data}, status=status.HTTP_202_ACCEPTED)
         chapters = request.data.get("chapters")
         if isinstance(chapters, list) and chapters:
-            count = parse_story_with_chapters(story, chapters)
+            count = parse_story_with_chapters(story, chapters, incremental=incremental)
             return Response({"ok": True, "paragraphs": count, "chapters": len(chapters)})
         original_text = request.data.get("original_text", "") or ""
         machine_text = request.data.get("machine_text", "") or ""
-        parse_story_paragraphs(story, original_text, machine_text)
+        parse_story_paragraphs(story, original_text, machine_text, incremental=incremental)
         return Response({"ok": True, "paragraphs": story.paragraphs_count, "chapters": 1 if (original_text or machine_text) else 0})
 
 
+    @action(detail=True, methods=["post"], url_path="machine-translate")
+    def machine_translate(self, request, pk=None):
+        if not IsAdminGroup().has_permission(request, self):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        story = self.get_object()
+        payload = {"only_missing": _flag(request, "only_missing")}
+        in_flight = request.data.get("in_flight")
+        if in_flight not in (None, ""):
+            try:
+                payload["in_flight"] = int(in_flight)
+            except (TypeError, ValueError):
+                raise ValidationError({"in_flight": "Must be an integer"})
+            if payload["in_flight"] < 1:
+                raise ValidationError({"in_flight": "Must be at least 1"})
+        job = enqueue_job(JobKind.MACHINE_TRANSLATE, story, payload, request.user)
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=["post"])
+    def illustrations(self, request, pk=None):
+        if not IsAdminGroup().has_permission(request, self):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        job = enqueue_job(JobKind.ILLUSTRATIONS, self.get_object(), user=request.user)
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
     @action(detail=True, methods=["post"])
     def claim(self, request, pk=None):
         if not IsTranslatorGroup().has_permission(request, self):
@@ -127,8 +256,7 @@ class StoryViewSet(viewsets.ModelViewSet):
         user = request.user
         if not (user.is_authenticated and (user.groups.filter(name="admin").exists() or (user.groups.filter(name="translator").exists() and story.assigned_to_id == user.id))):
             return Response(status=status.HTTP_403_FORBIDDEN)
-        qs = story.paragraphs.all().prefetch_related("illustrations")
-        return Response(ParagraphSerializer(qs, many=True).data)
+        return _paragraphs_response(request, story)
 
     @action(detail=True, methods=["post"])
     def complete(self, request, pk=None):
@@ -165,4 +293,132 @@ class StoryViewSet(viewsets.ModelViewSet):
         story.status = StoryStatus.PUBLISHED
         story.published_at = timezone.now()
         story.save(update_fields=["status", "published_at"])
-        return Response({"ok": True, "status": story.status})
\ No newline at end of file
+        # Читатели получают готовый снимок, а не собирают историю из абзацев на каждый запрос
+        store_reader_snapshot(story)
+        return Response({"ok": True, "status": story.status})
+
+    @action(detail=True, methods=["post"])
+    def unpublish(self, request, pk=None):
+        # admin only: возвращает историю на проверку
+        if not IsAdminGroup().has_permission(request, self):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        story = self.get_object()
+        if story.status != StoryStatus.PUBLISHED:
+            return Response({"detail": "Story is not published"}, status=status.HTTP_400_BAD_REQUEST)
+        story.status = StoryStatus.REVIEW
+        story.reader_snapshot = None
+        story.save(update_fields=["status", "reader_snapshot"])
+        return Response({"ok": True, "status": story.status})
+
+    @action(detail=True, methods=["get"])
+    def reader(self, request, pk=None):
+        """
+        Текст для чтения постранично (у историй с главами страница — глава): ?cursor=N,
+        ссылка на следующую страницу — в поле next. Опубликованные отдаются из снимка.
+        """
+        story = self.get_object()
+        try:
+            number = int(request.query_params.get("cursor", 0))
+        except ValueError:
+            return Response({"detail": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+        page = reader_page(story, number)
+        if page is None and number:
+            return Response({"detail": "No such page"}, status=status.HTTP_404_NOT_FOUND)
+        next_url = None
+        if page is not None and page.next_number is not None:
+            next_url = replace_query_param(request.build_absolute_uri(), "cursor", page.next_number)
+        return Response({
+            "id": story.id,
+            "slug": story.slug,
+            "title": story.title,
+            "published_at": story.published_at,
+            "pages_count": page.pages_count if page else 0,
+            "chapter": {"index": page.chapter.index, "title": page.chapter.title} if page and page.chapter else None,
+            "items": [
+                {
+                    "index": item.index,
+                    "text": item.text,
+                    "illustrations": [{"position": i.position, "image_url": i.image_url} for i in item.illustrations],
+                }
+                for item in (page.items if page else ())
+            ],
+            "next": next_url,
+        })
+
+
+class ImportSessionViewSet(viewsets.GenericViewSet):
+    """
+    Поэтапный импорт больших историй, чтобы не упираться в лимит размера запроса:
+
+    POST /api/import-sessions/                  — метаданные истории (как в /stories/import/), открывает сессию
+    POST /api/import-sessions/{id}/chapters/    — {"seq", "title", "original_text", "machine_text"}
+    POST /api/import-sessions/{id}/paragraphs/  — {"seq", "paragraphs": [{"original_text", "machine_text"}]}
+    POST /api/import-sessions/{id}/commit/      — закрывает сессию, проставляет paragraphs_count
+    GET  /api/import-sessions/{id}/             — состояние; last_seq показывает, с какой части продолжать
+
+    Части нумеруются с 1 подряд; повтор уже принятой части игнорируется, пропуск — 409.
+    До commit история в статусе IMPORTING и видна только админам; истории сессий, простаивающих
+    дольше IMPORT_SESSION_TTL, удаляются (при открытии новой сессии и manage.py expire_import_sessions).
+    """
+    queryset = ImportSession.objects.all()
+    serializer_class = ImportSessionSerializer
+    permission_classes = [IsAdminGroup]
+
+    def create(self, request, *args, **kwargs):
+        create_ser = StoryCreateSerializer(data=request.data)
+        create_ser.is_valid(raise_exception=True)
+        expire_import_sessions()
+        with transaction.atomic():
+            story = create_ser.save(status=StoryStatus.IMPORTING)
+            session = ImportSession.objects.create(story=story, created_by=request.user)
+        return Response(ImportSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        return Response(ImportSessionSerializer(self.get_object()).data)
+
+    def _apply(self, func, *args):
+        try:
+            session = func(*args)
+        except ImportChunkError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response(ImportSessionSerializer(session).data)
+
+    @action(detail=True, methods=["post"])
+    def chapters(self, request, pk=None):
+        session = self.get_object()
+        ser = ImportChapterChunkSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        d = ser.validated_data
+        return self._apply(import_append_chapter, session.pk, d["seq"], d["title"], d["original_text"], d["machine_text"])
+
+    @action(detail=True, methods=["post"])
+    def paragraphs(self, request, pk=None):
+        session = self.get_object()
+        ser = ImportParagraphsChunkSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        d = ser.validated_data
+        return self._apply(import_append_paragraphs, session.pk, d["seq"], d["paragraphs"])
+
+    @action(detail=True, methods=["post"])
+    def commit(self, request, pk=None):
+        session = self.get_object()
+        return self._apply(import_commit, session.pk)
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Статус фоновых задач: GET /api/jobs/{id}/ для опроса, ?story=<id> — задачи одной истории.
+    Админ видит все задачи, переводчик — свои и задачи по назначенным ему историям.
+    """
+    serializer_class = JobSerializer
+    permission_classes = [IsTranslatorGroup]
+
+    def get_queryset(self):
+        qs = Job.objects.all()
+        user = self.request.user
+        if not is_admin_user(user):
+            qs = qs.filter(Q(created_by=user) | Q(story__assigned_to=user))
+        story_id = self.request.query_params.get("story")
+        if story_id:
+            qs = qs.filter(story_id=story_id)
+        return qs
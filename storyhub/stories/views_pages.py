@@ -1,7 +1,10 @@
 # stories/views_pages.py
 from django.views.generic import ListView, DetailView
 from .models import Story, StoryStatus
+from .reader import reader_page
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
 from django.contrib.auth.models import Group
 
 class CatalogView(ListView):
@@ -10,7 +13,7 @@ class CatalogView(ListView):
     paginate_by = 20
 
     def get_queryset(self):
-        qs = Story.objects.filter(status=StoryStatus.PUBLISHED).prefetch_related("tags")
+        qs = Story.objects.filter(status=StoryStatus.PUBLISHED).defer("reader_snapshot").prefetch_related("tags")
         tags = self.request.GET.get("tags")
         search = self.request.GET.get("search")
         if tags:
@@ -31,28 +34,33 @@ class StoryDetailView(DetailView):
     slug_url_kwarg = "slug"
 
     def get_object(self):
-        return get_object_or_404(Story, slug=self.kwargs["slug"], status=StoryStatus.PUBLISHED)
+        return get_object_or_404(
+            Story.objects.defer("reader_snapshot"), slug=self.kwargs["slug"], status=StoryStatus.PUBLISHED,
+        )
+
+    def _page_number(self) -> int:
+        try:
+            return int(self.request.GET.get("page", 0))
+        except ValueError:
+            raise Http404("Invalid page")
+
+    def get_template_names(self):
+        # HTMX подгружает следующие страницы без обёртки base.html
+        if self.request.headers.get("HX-Request"):
+            return ["stories/_reader_page.html"]
+        return super().get_template_names()
+
+    def render_to_response(self, context, **response_kwargs):
+        # Один URL отдаёт и страницу целиком, и фрагмент для HTMX — кэши должны различать их
+        response = super().render_to_response(context, **response_kwargs)
+        patch_vary_headers(response, ["HX-Request"])
+        return response
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        story = self.object
-        user_id = story.assigned_to_id
-
-        chapters_qs = story.chapters.all().prefetch_related("paragraphs__illustrations", "paragraphs__translations")
-        if chapters_qs.exists():
-            ch_list = []
-            for ch in chapters_qs:
-                items = []
-                for p in ch.paragraphs.all().order_by("index"):
-                    tr = p.translations.filter(translator_id=user_id, is_finalized=True).first()
-                    text = tr.text if tr else ""
-                    items.append({"text": text, "illustrations": p.illustrations.filter(is_selected=True)[:5]})
-                ch_list.append({"index": ch.index, "title": ch.title, "items": items})
-            ctx["chapters"] = ch_list
-        else:
-            items = []
-            for p in story.paragraphs.all().prefetch_related("illustrations"):
-                tr = p.translations.filter(translator_id=user_id, is_finalized=True).first()
-                items.append({"text": tr.text if tr else "", "illustrations": p.illustrations.filter(is_selected=True)[:5]})
-            ctx["content"] = items
-        return ctx
\ No newline at end of file
+        number = self._page_number()
+        page = reader_page(self.object, number)
+        if page is None and number:
+            raise Http404("No such page")
+        ctx["page"] = page
+        return ctx
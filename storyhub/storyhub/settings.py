@@ -132,6 +132,10 @@ STATIC_URL = "static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
+# Каталог с LLM-пайплайном consensus-translate (kobold_cpp_implimitation.py)
+CONSENSUS_TRANSLATE_DIR = os.getenv("CONSENSUS_TRANSLATE_DIR", str(BASE_DIR.parent / "consensus-translate"))
+
+
 LOGIN_URL = "/accounts/login/"
 LOGIN_REDIRECT_URL = "/translator/dashboard/"
 LOGOUT_REDIRECT_URL = "/"
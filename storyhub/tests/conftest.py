@@ -1,41 +1,35 @@
-# translations/views_pages.py
-from django.views.generic import TemplateView
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.shortcuts import get_object_or_404
-from users.permissions import in_group
-from stories.models import Story, StoryStatus
-
-class TranslatorDashboardView(LoginRequiredMixin, TemplateView):
-    template_name = "translations/dashboard.html"
-
-    def dispatch(self, request, *args, **kwargs):
-        if not in_group(request.user, "translator") and not in_group(request.user, "admin"):
-            return self.handle_no_permission()
-        return super().dispatch(request, *args, **kwargs)
-
-    def get_context_data(self, **kwargs):
-        user = self.request.user
-        ctx = super().get_context_data(**kwargs)
-        ctx["available"] = Story.objects.filter(status__in=[StoryStatus.DRAFT, StoryStatus.IN_TRANSLATION], assigned_to__isnull=True)
-        ctx["in_progress"] = Story.objects.filter(status=StoryStatus.IN_TRANSLATION, assigned_to=user)
-        ctx["completed"] = Story.objects.filter(status__in=[StoryStatus.REVIEW, StoryStatus.PUBLISHED], assigned_to=user)
-        return ctx
-
-class EditorView(LoginRequiredMixin, TemplateView):
-    template_name = "translations/editor.html"
-
-    def dispatch(self, request, *args, **kwargs):
-        if not in_group(request.user, "translator") and not in_group(request.user, "admin"):
-            return self.handle_no_permission()
-        return super().dispatch(request, *args, **kwargs)
-
-    def get_context_data(self, slug, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        story = get_object_or_404(Story, slug=slug)
-        user = self.request.user
-        if in_group(user, "translator") and story.assigned_to_id != user.id:
-            self.raise_exception = True
-            raise PermissionError("Not assigned")
-        ctx["story"] = story
-        ctx["paragraphs"] = story.paragraphs.all().prefetch_related("illustrations")
-        return ctx
\ No newline at end of file
+import pytest
+from django.contrib.auth.models import Group, User
+
+from stories.models import Language, Story, Tag
+from stories.services import parse_story_paragraphs
+
+
+@pytest.fixture(autouse=True)
+def groups(db):
+    # Те же группы, что в users/migrations/0002_groups.py (у users нет пакета миграций, в тестовую БД она не попадает)
+    return {name: Group.objects.get_or_create(name=name)[0] for name in ("reader", "translator", "admin")}
+
+
+@pytest.fixture
+def translator_user(groups):
+    u = User.objects.create_user("tr", "", "pass")
+    u.groups.add(groups["translator"])
+    return u
+
+
+@pytest.fixture
+def admin_user(groups):
+    u = User.objects.create_superuser("admin", "", "pass")
+    u.groups.add(groups["admin"])
+    return u
+
+
+@pytest.fixture
+def story_draft(db):
+    en = Language.objects.create(code="en", name="English")
+    ru = Language.objects.create(code="ru", name="Russian")
+    s = Story.objects.create(title="Draft", original_language=en, target_language=ru)
+    s.tags.add(Tag.objects.create(name="Sci-Fi", slug="sci-fi"))
+    parse_story_paragraphs(s, "A\n\nB\n\nC", "a\n\nb\n\nc")
+    return s
@@ -7,4 +7,115 @@ def test_reader_sees_only_published(client, story_draft):
     story_draft.status = StoryStatus.PUBLISHED
     story_draft.save()
     resp = client.get("/api/stories/")
-    assert len(resp.json()) == 1
\ No newline at end of file
+    assert len(resp.json()) == 1
+
+def test_reader_page_constant_queries(client, translator_user, story_draft, django_assert_max_num_queries):
+    from stories.models import Paragraph
+    from translations.models import Translation
+    story_draft.status = StoryStatus.PUBLISHED
+    story_draft.assigned_to = translator_user
+    story_draft.save()
+    paragraphs = [Paragraph(story=story_draft, index=i, original_text=f"O{i}") for i in range(4, 60)]
+    Paragraph.objects.bulk_create(paragraphs)
+    for p in story_draft.paragraphs.all():
+        Translation.objects.create(paragraph=p, translator=translator_user, text=f"T{p.index}", is_finalized=True)
+
+    with django_assert_max_num_queries(8):
+        resp = client.get(f"/stories/{story_draft.slug}/")
+    assert resp.status_code == 200
+    html = resp.content.decode()
+    assert "T50" in html and "T51" not in html and "?page=1" in html
+
+    resp = client.get(f"/stories/{story_draft.slug}/?page=1", HTTP_HX_REQUEST="true")
+    html = resp.content.decode()
+    assert "T59" in html and "<html" not in html and "?page=2" not in html
+    assert "HX-Request" in resp["Vary"]
+    assert client.get(f"/stories/{story_draft.slug}/?page=2").status_code == 404
+
+
+def test_reader_snapshot_stored_and_invalidated(client, translator_user, story_draft, django_assert_max_num_queries):
+    from stories.models import Story
+    from stories.reader import store_reader_snapshot
+    from translations.models import Translation
+    story_draft.status = StoryStatus.PUBLISHED
+    story_draft.assigned_to = translator_user
+    story_draft.save()
+    p = story_draft.paragraphs.get(index=1)
+    t = Translation.objects.create(paragraph=p, translator=translator_user, text="Old", is_finalized=True)
+    store_reader_snapshot(story_draft)
+
+    with django_assert_max_num_queries(2):
+        resp = client.get(f"/stories/{story_draft.slug}/")
+    assert "Old" in resp.content.decode()
+
+    t.text = "New"
+    t.save()
+    assert Story.objects.get(pk=story_draft.pk).reader_snapshot is None
+    data = client.get(f"/api/stories/{story_draft.id}/reader/").json()
+    assert data["items"][0]["text"] == "New"
+    assert (data["pages_count"], data["next"]) == (1, None)
+    assert Story.objects.get(pk=story_draft.pk).reader_snapshot["pages"][0]["items"][0][1] == "New"
+
+
+def test_story_detail_is_metadata_only(client, admin_user, story_draft, django_assert_max_num_queries):
+    from django.contrib.auth.models import Group
+    admin_user.groups.add(Group.objects.get(name="admin"))
+    client.force_login(admin_user)
+    with django_assert_max_num_queries(8):
+        data = client.get(f"/api/stories/{story_draft.id}/").json()
+    assert "paragraphs" not in data and data["paragraphs_count"] == story_draft.paragraphs_count
+
+    rows = client.get(f"/api/stories/{story_draft.id}/paragraphs/?from=2&to=3").json()
+    assert [r["index"] for r in rows] == [2, 3]
+    assert client.get(f"/api/stories/{story_draft.id}/paragraphs/?from=x").status_code == 400
+
+
+def test_paragraphs_keyset_and_etag(client, admin_user, story_draft):
+    from django.contrib.auth.models import Group
+    admin_user.groups.add(Group.objects.get(name="admin"))
+    client.force_login(admin_user)
+    url = f"/api/stories/{story_draft.id}/paragraphs/"
+
+    resp = client.get(url + "?limit=2")
+    assert [r["index"] for r in resp.json()] == [1, 2]
+    assert "after=2" in resp["Link"]
+    assert [r["index"] for r in client.get(url + "?limit=2&after=2").json()] == [3]
+
+    etag = client.get(url)["ETag"]
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    assert client.get(url + "?limit=2", HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    p = story_draft.paragraphs.get(index=1)
+    client.post(f"/api/paragraphs/{p.id}/illustrations/2/select/", {"is_selected": "true"}, content_type="application/json")
+    resp = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 200 and resp["ETag"] != etag
+
+
+def test_reader_snapshot_follows_reassignment_and_skips_stale_write(translator_user, story_draft, monkeypatch):
+    from django.contrib.auth.models import User
+    from stories import reader
+    from stories.models import Story
+    from translations.models import Translation, TranslatorAssignment, AssignmentStatus
+    story_draft.status = StoryStatus.PUBLISHED
+    story_draft.assigned_to = translator_user
+    story_draft.save()
+    p = story_draft.paragraphs.get(index=1)
+    Translation.objects.create(paragraph=p, translator=translator_user, text="Old", is_finalized=True)
+    reader.store_reader_snapshot(story_draft)
+
+    other = User.objects.create_user("tr2", "", "pass")
+    Translation.objects.create(paragraph=p, translator=other, text="Other", is_finalized=True)
+    TranslatorAssignment.objects.create(story=story_draft, translator=other, status=AssignmentStatus.ACTIVE)
+    story = Story.objects.get(pk=story_draft.pk)
+    assert story.reader_snapshot is None
+    assert reader.reader_page(story).items[0].text == "Other"
+
+    # Правка во время сборки снимка: собранный снимок не сохраняется
+    build = reader.build_reader_content
+    def build_with_edit(s):
+        content = build(s)
+        reader.invalidate_reader_snapshot(pk=s.pk)
+        return content
+    monkeypatch.setattr(reader, "build_reader_content", build_with_edit)
+    reader.store_reader_snapshot(story)
+    assert Story.objects.get(pk=story.pk).reader_snapshot is None
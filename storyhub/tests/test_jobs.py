@@ -0,0 +1,121 @@
+from django.core.management import call_command
+from django.contrib.auth.models import Group
+
+
+def test_background_parse_job(client, admin_user, story_draft):
+    admin_user.groups.add(Group.objects.get(name="admin"))
+    client.force_login(admin_user)
+    r = client.post(f"/api/stories/{story_draft.id}/parse/", {"original_text": "X1\n\nX2", "background": True}, content_type="application/json")
+    assert r.status_code == 202
+    job_id = r.json()["job"]["id"]
+    assert client.get(f"/api/jobs/{job_id}/").json()["status"] == "QUEUED"
+
+    call_command("run_jobs", "--once")
+
+    job = client.get(f"/api/jobs/{job_id}/").json()
+    assert job["status"] == "DONE"
+    assert job["result"] == {"paragraphs": 2, "chapters": 1}
+    assert (job["progress"], job["total"]) == (1, 1)
+    story_draft.refresh_from_db()
+    assert story_draft.paragraphs_count == 2
+
+
+def test_illustrations_job_prunes_placeholders(client, admin_user, story_draft):
+    from stories.models import Illustration, placeholder_url
+    admin_user.groups.add(Group.objects.get(name="admin"))
+    client.force_login(admin_user)
+    p = story_draft.paragraphs.first()
+    Illustration.objects.create(paragraph=p, position=1, image_url=placeholder_url(story_draft.id, p.index, 1))
+    Illustration.objects.create(paragraph=p, position=2, image_url=placeholder_url(story_draft.id, p.index, 2), is_selected=True)
+    etag = client.get(f"/api/stories/{story_draft.id}/paragraphs/")["ETag"]
+    r = client.post(f"/api/stories/{story_draft.id}/illustrations/")
+    assert r.status_code == 202
+
+    call_command("run_jobs", "--once")
+    assert client.get(f"/api/stories/{story_draft.id}/paragraphs/", HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    assert client.get(f"/api/jobs/{r.json()['id']}/").json()["result"] == {"deleted": 1}
+    assert list(p.illustrations.values_list("position", flat=True)) == [2]
+
+
+def test_machine_translate_rejects_bad_in_flight(client, admin_user, story_draft):
+    admin_user.groups.add(Group.objects.get(name="admin"))
+    client.force_login(admin_user)
+    url = f"/api/stories/{story_draft.id}/machine-translate/"
+    assert client.post(url, {"in_flight": "many"}, content_type="application/json").status_code == 400
+    assert client.post(url, {"in_flight": 0}, content_type="application/json").status_code == 400
+    r = client.post(url, {"in_flight": "4"}, content_type="application/json")
+    assert r.status_code == 202
+    from stories.models import Job
+    assert Job.objects.get(pk=r.json()["id"]).payload["in_flight"] == 4
+
+
+def test_stale_running_job_is_requeued(admin_user, story_draft):
+    from datetime import timedelta
+    from django.utils import timezone
+    from stories.jobs import JOB_LEASE, claim_next_job, enqueue_job, run_job
+    from stories.models import Job, JobKind, JobStatus
+    job = enqueue_job(JobKind.ILLUSTRATIONS, story_draft, user=admin_user)
+    dead = claim_next_job("dead:1")
+    assert claim_next_job("live:2") is None
+
+    Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - JOB_LEASE - timedelta(seconds=1))
+    live = claim_next_job("live:2")
+    assert (live.pk, live.worker) == (job.pk, "live:2")
+
+    # Очнувшийся старый воркер прерывается на первой отметке прогресса и ничего не пишет
+    assert "больше не принадлежит" in run_job(dead).error
+    assert Job.objects.get(pk=job.pk).status == JobStatus.RUNNING
+    run_job(live)
+    assert Job.objects.get(pk=job.pk).status == JobStatus.DONE
+
+
+def test_machine_translate_bumps_version_per_paragraph(story_draft, monkeypatch):
+    from types import SimpleNamespace
+    from stories import services
+    from stories.models import Story
+    fake = SimpleNamespace(
+        Config=SimpleNamespace(PARAGRAPHS_IN_FLIGHT=1),
+        consensus_translate_batch=lambda texts, **kw: ((i, {"final_translation": t.lower() + "!"}) for i, t in enumerate(texts)),
+    )
+    monkeypatch.setattr(services, "_consensus_module", lambda: fake)
+    versions = [Story.objects.get(pk=story_draft.pk).content_version]
+    for paragraph_id, _ in services.machine_translate_story(story_draft):
+        # Каждый записанный абзац сразу меняет ETag /paragraphs/
+        versions.append(Story.objects.get(pk=story_draft.pk).content_version)
+    assert versions == sorted(set(versions)) and len(versions) == 4
+    assert list(story_draft.paragraphs.values_list("machine_text", flat=True)) == ["a!", "b!", "c!"]
+
+
+def test_translator_sees_only_own_jobs(client, admin_user, translator_user, story_draft):
+    from stories.jobs import enqueue_job
+    from stories.models import JobKind
+    foreign = enqueue_job(JobKind.ILLUSTRATIONS, story_draft, user=admin_user)
+    client.force_login(translator_user)
+    assert client.get("/api/jobs/").json() == []
+    assert client.get(f"/api/jobs/{foreign.id}/").status_code == 404
+
+    story_draft.assigned_to = translator_user
+    story_draft.save(update_fields=["assigned_to"])
+    assert client.get(f"/api/jobs/{foreign.id}/").status_code == 200
+
+
+def test_stale_worker_rolls_back_paragraph_write(admin_user, story_draft, monkeypatch):
+    from types import SimpleNamespace
+    from stories import services
+    from stories.jobs import claim_next_job, enqueue_job, run_job
+    from stories.models import Job, JobKind, JobStatus
+    job = enqueue_job(JobKind.MACHINE_TRANSLATE, story_draft, user=admin_user)
+
+    def batch(texts, **kw):
+        yield 0, {"final_translation": "new"}
+        # Пока воркер переводил, аренда истекла и задачу вернули в очередь
+        Job.objects.filter(pk=job.pk).update(status=JobStatus.QUEUED, worker="")
+        yield 1, {"final_translation": "new"}
+        yield 2, {"final_translation": "new"}
+
+    fake = SimpleNamespace(Config=SimpleNamespace(PARAGRAPHS_IN_FLIGHT=1), consensus_translate_batch=batch)
+    monkeypatch.setattr(services, "_consensus_module", lambda: fake)
+    run_job(claim_next_job("dead:1"))
+    assert list(story_draft.paragraphs.values_list("machine_text", flat=True)) == ["new", "b", "c"]
+    assert Job.objects.get(pk=job.pk).status == JobStatus.QUEUED
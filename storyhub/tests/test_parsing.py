@@ -1,7 +1,176 @@
 def test_parse_counts(client, admin_user, story_draft):
     client.force_login(admin_user)
-    resp = client.post(f"/api/stories/{story_draft.id}/parse", {"original_text": "X1\n\nX2", "machine_text": "Y1\n\nY2"}, content_type="application/json")
+    resp = client.post(f"/api/stories/{story_draft.id}/parse/", {"original_text": "X1\n\nX2", "machine_text": "Y1\n\nY2"}, content_type="application/json")
     assert resp.status_code == 200
     story_draft.refresh_from_db()
     assert story_draft.paragraphs_count == 2
-    assert story_draft.translated_count == 0
\ No newline at end of file
+    assert story_draft.translated_count == 0
+
+def test_parse_chapters_bulk(client, admin_user, story_draft):
+    from django.contrib.auth.models import Group
+    admin_user.groups.add(Group.objects.get(name="admin"))
+    client.force_login(admin_user)
+    chapters = [
+        {"title": "One", "original_text": "A1\n\nA2", "machine_text": "B1"},
+        {"title": "Two", "original_text": "A3"},
+    ]
+    resp = client.post(f"/api/stories/{story_draft.id}/parse/", {"chapters": chapters}, content_type="application/json")
+    assert resp.status_code == 200
+    assert resp.json() == {"ok": True, "paragraphs": 3, "chapters": 2}
+    paragraphs = list(story_draft.paragraphs.select_related("chapter"))
+    assert [(p.index, p.chapter.index, p.original_text, p.machine_text) for p in paragraphs] == [
+        (1, 1, "A1", "B1"), (2, 1, "A2", ""), (3, 2, "A3", ""),
+    ]
+    assert all(len(p.illustration_slots) == 5 for p in paragraphs)
+
+
+def test_incremental_reparse_keeps_translations(translator_user, story_draft):
+    from stories.services import parse_story_paragraphs
+    from translations.models import Translation
+    paragraphs = {p.original_text: p for p in story_draft.paragraphs.all()}
+    Translation.objects.create(paragraph=paragraphs["A"], translator=translator_user, text="TA")
+    Translation.objects.create(paragraph=paragraphs["C"], translator=translator_user, text="TC")
+
+    # B исправлен, перед A вставлен новый абзац, в конец добавлен D
+    assert parse_story_paragraphs(story_draft, "Z\n\nA\n\nB!\n\nC\n\nD", "", incremental=True) == 5
+
+    rows = list(story_draft.paragraphs.values_list("index", "original_text", "machine_text"))
+    assert rows == [(1, "Z", ""), (2, "A", "a"), (3, "B!", ""), (4, "C", "c"), (5, "D", "")]
+    assert story_draft.paragraphs.get(original_text="A").pk == paragraphs["A"].pk
+    assert story_draft.paragraphs.get(original_text="B!").pk == paragraphs["B"].pk
+    assert Translation.objects.filter(paragraph__story=story_draft).count() == 2
+    story_draft.refresh_from_db()
+    assert story_draft.paragraphs_count == 5
+
+
+def test_incremental_reparse_unfinalizes_rewritten(translator_user, story_draft):
+    from stories.services import parse_story_paragraphs
+    from translations.models import Translation
+    story_draft.assigned_to = translator_user
+    story_draft.save(update_fields=["assigned_to"])
+    for p in story_draft.paragraphs.all():
+        Translation.objects.create(paragraph=p, translator=translator_user, text="T" + p.original_text, is_finalized=True)
+
+    parse_story_paragraphs(story_draft, "A\n\nB!\n\nC", "", incremental=True)
+
+    finalized = dict(Translation.objects.values_list("paragraph__original_text", "is_finalized"))
+    assert finalized == {"A": True, "B!": False, "C": True}
+    story_draft.refresh_from_db()
+    assert story_draft.translated_count == 2
+
+
+def test_chunked_import_session(client, admin_user, translator_user, story_draft):
+    from django.contrib.auth.models import Group
+    admin_user.groups.add(Group.objects.get(name="admin"))
+    client.force_login(admin_user)
+    meta = {"title": "Big", "original_language": story_draft.original_language_id, "target_language": story_draft.target_language_id}
+    r = client.post("/api/import-sessions/", meta, content_type="application/json")
+    assert r.status_code == 201
+    sid, story_id = r.json()["id"], r.json()["story"]
+    # до commit недогруженная история скрыта от переводчика и недоступна для claim
+    client.force_login(translator_user)
+    assert client.get(f"/api/stories/{story_id}/").status_code == 404
+    assert client.post(f"/api/stories/{story_id}/claim/").status_code == 404
+    client.force_login(admin_user)
+
+    r = client.post(f"/api/import-sessions/{sid}/chapters/", {"seq": 1, "title": "One", "original_text": "A\n\nB"}, content_type="application/json")
+    assert r.json()["paragraphs_count"] == 2
+    # повтор той же части не дублирует абзацы, пропуск части — конфликт
+    client.post(f"/api/import-sessions/{sid}/chapters/", {"seq": 1, "title": "One", "original_text": "A\n\nB"}, content_type="application/json")
+    r = client.post(f"/api/import-sessions/{sid}/paragraphs/", {"seq": 3, "paragraphs": [{"original_text": "C"}]}, content_type="application/json")
+    assert r.status_code == 409
+    r = client.post(f"/api/import-sessions/{sid}/paragraphs/", {"seq": 2, "paragraphs": [{"original_text": "C"}]}, content_type="application/json")
+    assert r.json()["last_seq"] == 2
+
+    r = client.post(f"/api/import-sessions/{sid}/commit/")
+    assert r.json()["status"] == "COMMITTED"
+    from stories.models import Story
+    story = Story.objects.get(pk=story_id)
+    assert story.paragraphs_count == 3
+    assert list(story.paragraphs.values_list("index", "original_text", "chapter__index")) == [(1, "A", 1), (2, "B", 1), (3, "C", 1)]
+    assert story.status == "DRAFT"
+    client.force_login(translator_user)
+    assert client.get(f"/api/stories/{story_id}/").status_code == 200
+
+
+def test_stale_import_sessions_expire(client, admin_user, story_draft):
+    from datetime import timedelta
+    from django.utils import timezone
+    from stories.models import ImportSession, Story
+    client.force_login(admin_user)
+    meta = {"title": "Lost", "original_language": story_draft.original_language_id, "target_language": story_draft.target_language_id}
+    stale_id = client.post("/api/import-sessions/", meta, content_type="application/json").json()["story"]
+    ImportSession.objects.filter(story_id=stale_id).update(updated_at=timezone.now() - timedelta(days=2))
+
+    # открытие следующей сессии убирает брошенную вместе с её историей
+    fresh_id = client.post("/api/import-sessions/", meta, content_type="application/json").json()["story"]
+    assert not Story.objects.filter(pk=stale_id).exists()
+    assert Story.objects.filter(pk=fresh_id).exists()
+
+
+def test_split_normalized_paragraphs():
+    from stories.text import split_normalized_paragraphs
+    text = (
+        "Title\r\n\r\n"
+        "A long hard-wrapped line of prose that the old typesetting cut in the exam-\r\n"
+        "ple word and\u00a0went on.\u200b\r\n\r\n"
+        "“Hey Tania,\r\n\r\n"
+        "long time,” said he.\r\n\r\n"
+        "Another example of a well-\r\nknown word.\r\n\r\n"
+        "He bought a 12\" pizza.\r\n\r\n"
+        "Chapter 2\r\n\r\n"
+        "it starts in lowercase.\r\n"
+    )
+    assert split_normalized_paragraphs(text) == [
+        "Title",
+        "A long hard-wrapped line of prose that the old typesetting cut in the example word and went on.",
+        "“Hey Tania, long time,” said he.",
+        "Another example of a well-known word.",
+        "He bought a 12\" pizza.",
+        "Chapter 2",
+        "it starts in lowercase.",
+    ]
+
+
+def test_split_rejoins_wrapped_prose_keeps_verse():
+    from stories.text import split_normalized_paragraphs
+    text = (
+        "It was a bright cold day in April, and the clocks were striking thirteen.\n"
+        "Winston Smith, his chin nuzzled into his breast in an effort to escape the\n"
+        "vile wind, slipped quickly through the glass doors of Victory Mansions. He\n"
+        "was not quick enough. The hallway smelt of boiled cabbage and old rag mats.\n"
+        "At one end of it a poster was tacked up.\n"
+        "Part Two\n"
+        "Nothing was your own except the few cubic centimetres inside your skull.\n\n"
+        "Roses are red,\nViolets are blue,\nSugar is sweet\nAnd so are you.\n"
+    )
+    assert split_normalized_paragraphs(text) == [
+        "It was a bright cold day in April, and the clocks were striking thirteen. "
+        "Winston Smith, his chin nuzzled into his breast in an effort to escape the "
+        "vile wind, slipped quickly through the glass doors of Victory Mansions. He "
+        "was not quick enough. The hallway smelt of boiled cabbage and old rag mats. "
+        "At one end of it a poster was tacked up.\n"
+        "Part Two\n"
+        "Nothing was your own except the few cubic centimetres inside your skull.",
+        "Roses are red,\nViolets are blue,\nSugar is sweet\nAnd so are you.",
+    ]
+
+
+def test_placeholder_illustrations_are_lazy(client, translator_user, story_draft):
+    from stories.models import Illustration
+    assert not Illustration.objects.filter(paragraph__story=story_draft).exists()
+    story_draft.assigned_to = translator_user
+    story_draft.save()
+    client.force_login(translator_user)
+
+    data = client.get(f"/api/stories/{story_draft.id}/paragraphs/").json()
+    assert [i["position"] for i in data[0]["illustrations"]] == [1, 2, 3, 4, 5]
+    assert data[0]["illustrations"][2]["id"] is None
+
+    p = story_draft.paragraphs.first()
+    r = client.post(f"/api/paragraphs/{p.id}/illustrations/3/select/", {"is_selected": "true"}, content_type="application/json")
+    assert r.status_code == 200
+    ill = Illustration.objects.get(paragraph=p)
+    assert (ill.position, ill.is_selected) == (3, True)
+    data = client.get(f"/api/stories/{story_draft.id}/paragraphs/").json()
+    assert data[0]["illustrations"][2] == {"id": ill.id, "image_url": ill.image_url, "position": 3, "is_selected": True}
@@ -4,7 +4,7 @@ from stories.models import StoryStatus
 def test_claim_finalize_publish_flow(client, translator_user, admin_user, story_draft):
     # translator claims
     client.force_login(translator_user)
-    r = client.post(f"/api/stories/{story_draft.id}/claim")
+    r = client.post(f"/api/stories/{story_draft.id}/claim/")
     assert r.status_code == 200
     story_draft.refresh_from_db()
     assert story_draft.status == StoryStatus.IN_TRANSLATION
@@ -12,20 +12,124 @@ def test_claim_finalize_publish_flow(client, translator_user, admin_user, story_
 
     # finalize all paragraphs
     for p in story_draft.paragraphs.all():
-        r = client.patch(f"/api/paragraphs/{p.id}/translation", {"text": f"T{p.index}", "is_finalized": True}, content_type="application/json")
+        r = client.patch(f"/api/paragraphs/{p.id}/translation/", {"text": f"T{p.index}", "is_finalized": True}, content_type="application/json")
         assert r.status_code in (200,201)
     story_draft.refresh_from_db()
     assert story_draft.translated_count == story_draft.paragraphs_count
 
     # complete by translator
-    r = client.post(f"/api/stories/{story_draft.id}/complete")
+    r = client.post(f"/api/stories/{story_draft.id}/complete/")
     assert r.status_code == 200
     story_draft.refresh_from_db()
     assert story_draft.status == StoryStatus.REVIEW
 
     # publish by admin
     client.force_login(admin_user)
-    r = client.post(f"/api/stories/{story_draft.id}/publish")
+    r = client.post(f"/api/stories/{story_draft.id}/publish/")
     assert r.status_code == 200
     story_draft.refresh_from_db()
-    assert story_draft.status == StoryStatus.PUBLISHED
\ No newline at end of file
+    assert story_draft.status == StoryStatus.PUBLISHED
+
+def test_chapter_counters_follow_finalization(client, translator_user, story_draft):
+    from stories.services import parse_story_with_chapters
+    story_draft.assigned_to = translator_user
+    story_draft.save(update_fields=["assigned_to"])
+    parse_story_with_chapters(story_draft, [
+        {"title": "One", "original_text": "A\n\nB", "machine_text": "a\n\nb"},
+        {"title": "Two", "original_text": "C"},
+    ])
+    one, two = story_draft.chapters.order_by("index")
+    assert (one.paragraphs_count, two.paragraphs_count) == (2, 1)
+
+    client.force_login(translator_user)
+    p = one.paragraphs.first()
+    url = f"/api/paragraphs/{p.id}/translation/"
+    client.patch(url, {"text": "T", "is_finalized": "true"}, content_type="application/json")
+    client.patch(url, {"text": "T2", "is_finalized": "true"}, content_type="application/json")
+    one.refresh_from_db()
+    assert (one.finalized_count, one.progress_percent) == (1, 50)
+
+    client.patch(url, {"text": "T2", "is_finalized": "false"}, content_type="application/json")
+    one.refresh_from_db()
+    assert one.finalized_count == 0
+
+
+def test_translated_count_delta_and_reconcile(translator_user, story_draft):
+    from django.core.management import call_command
+    from stories.models import Story
+    story_draft.assigned_to = translator_user
+    story_draft.save(update_fields=["assigned_to"])
+    p = story_draft.paragraphs.first()
+
+    t = Translation.objects.create(paragraph=p, translator=translator_user, text="T", is_finalized=True)
+    t.text = "T2"
+    t.save()
+    assert Story.objects.get(pk=story_draft.pk).translated_count == 1
+
+    t = Translation.objects.get(pk=t.pk)
+    t.is_finalized = False
+    t.save()
+    assert Story.objects.get(pk=story_draft.pk).translated_count == 0
+
+    Story.objects.filter(pk=story_draft.pk).update(translated_count=7)
+    call_command("reconcile_counters", story=[story_draft.pk])
+    assert Story.objects.get(pk=story_draft.pk).translated_count == 0
+
+
+def test_unfinalize_never_goes_below_zero(client, translator_user, story_draft):
+    from stories.models import Story
+    story_draft.assigned_to = translator_user
+    story_draft.save(update_fields=["assigned_to"])
+    p = story_draft.paragraphs.first()
+    Translation.objects.create(paragraph=p, translator=translator_user, text="T", is_finalized=True)
+    Story.objects.filter(pk=story_draft.pk).update(translated_count=0)
+
+    client.force_login(translator_user)
+    client.patch(f"/api/paragraphs/{p.id}/translation/", {"text": "T", "is_finalized": "false"}, content_type="application/json")
+    assert Story.objects.get(pk=story_draft.pk).translated_count == 0
+
+
+def test_reparse_skips_per_translation_deltas(translator_user, story_draft, django_assert_max_num_queries):
+    from stories.models import Story
+    from stories.services import parse_story_paragraphs
+    story_draft.assigned_to = translator_user
+    story_draft.save(update_fields=["assigned_to"])
+    parse_story_paragraphs(story_draft, "\n\n".join(f"P{i}" for i in range(100)), "")
+    Translation.objects.bulk_create([
+        Translation(paragraph=p, translator=translator_user, text="T", is_finalized=True)
+        for p in story_draft.paragraphs.all()
+    ])
+    with django_assert_max_num_queries(20):
+        parse_story_paragraphs(story_draft, "A\n\nB", "")
+    assert Story.objects.get(pk=story_draft.pk).translated_count == 0
+
+
+def test_cascade_deletes_outside_parse_recount(translator_user, story_draft):
+    from stories.models import Story
+    story_draft.assigned_to = translator_user
+    story_draft.save(update_fields=["assigned_to"])
+    paragraphs = list(story_draft.paragraphs.all())
+    for p in paragraphs:
+        Translation.objects.create(paragraph=p, translator=translator_user, text="T", is_finalized=True)
+    assert Story.objects.get(pk=story_draft.pk).translated_count == 3
+
+    # Удаление абзаца в админке: перевод уходит каскадом, счётчик следует за ним
+    paragraphs[0].delete()
+    assert Story.objects.get(pk=story_draft.pk).translated_count == 2
+
+    # Удалён сам переводчик: назначение снимается, финализированных переводов не остаётся
+    translator_user.delete()
+    story = Story.objects.get(pk=story_draft.pk)
+    assert (story.assigned_to_id, story.translated_count) == (None, 0)
+
+
+def test_overlapping_saves_count_once(translator_user, story_draft):
+    from stories.models import Story
+    story_draft.assigned_to = translator_user
+    story_draft.save(update_fields=["assigned_to"])
+    t = Translation.objects.create(paragraph=story_draft.paragraphs.first(), translator=translator_user, text="T")
+    first, second = Translation.objects.get(pk=t.pk), Translation.objects.get(pk=t.pk)
+    first.is_finalized = second.is_finalized = True
+    first.save()
+    second.save()
+    assert Story.objects.get(pk=story_draft.pk).translated_count == 1
@@ -0,0 +1,35 @@
+from stories.models import Story
+
+
+def _make(story, title):
+    return Story.objects.create(title=title, original_language=story.original_language, target_language=story.target_language)
+
+
+def test_slug_next_free_suffix(story_draft):
+    assert [_make(story_draft, "Chapter").slug for _ in range(3)] == ["chapter", "chapter-1", "chapter-2"]
+    Story.objects.filter(slug="chapter-1").delete()
+    assert _make(story_draft, "Chapter").slug == "chapter-1"
+    assert _make(story_draft, "Chapter two").slug == "chapter-two"
+
+
+def test_slug_retries_on_integrity_error(story_draft, monkeypatch):
+    _make(story_draft, "Chapter")
+    real = Story._free_slug
+    calls = []
+
+    def stale_then_real(self, base):
+        # Первая попытка видит устаревшие данные, как при гонке двух вставок
+        calls.append(base)
+        return base if len(calls) == 1 else real(self, base)
+
+    monkeypatch.setattr(Story, "_free_slug", stale_then_real)
+    assert _make(story_draft, "Chapter").slug == "chapter-1"
+    assert len(calls) == 2
+
+
+def test_slug_ignores_other_prefixed_slugs(story_draft):
+    # "chapter-two" и "chapter-1x" начинаются с base, но суффиксами base не являются
+    _make(story_draft, "Chapter two")
+    _make(story_draft, "Chapter 1x")
+    assert _make(story_draft, "Chapter").slug == "chapter"
+    assert _make(story_draft, "Chapter").slug == "chapter-1"
@@ -1,6 +1,6 @@
 # translations/api_urls.py
 from django.urls import path
-from .views import ParagraphTranslationView, NoteCreateView, NoteUpdateView, IllustrationSelectView
+from .views import ParagraphTranslationView, NoteCreateView, NoteUpdateView, IllustrationSelectView, IllustrationSlotSelectView
 from .views_me import CompletedStoriesView, AvailableStoriesView
 
 urlpatterns = [
@@ -14,6 +14,7 @@ urlpatterns = [
 
     # Иллюстрации
     path("illustrations/<int:illustration_id>/select/", IllustrationSelectView.as_view(), name="illustration_select"),
+    path("paragraphs/<int:pk>/illustrations/<int:position>/select/", IllustrationSlotSelectView.as_view(), name="illustration_slot_select"),
 
     # Личный раздел переводчика
     path("me/completed-stories/", CompletedStoriesView.as_view(), name="me_completed_stories"),
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 class TranslationsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "translations"
-    verbose_name = "Translations"
\ No newline at end of file
+    verbose_name = "Translations"
+
+    def ready(self):
+        from . import signals  # noqa: F401
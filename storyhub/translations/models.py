@@ -1,5 +1,5 @@
 # translations/models.py
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from stories.models import Paragraph, Story
@@ -24,6 +24,22 @@ class Translation(models.Model):
     def __str__(self):
         return f"Tr p{self.paragraph_id} by {self.translator_id}"
 
+    def save(self, *args, **kwargs):
+        """
+        Статус «финализирован» до записи читается под блокировкой строки в той же транзакции:
+        два параллельных автосохранения не увидят оба False, и сигнал post_save
+        (translations.signals) сдвинет счётчики ровно один раз.
+        """
+        update_fields = kwargs.get("update_fields")
+        with transaction.atomic():
+            self._finalized_before = None  # None — статус этой записью не меняется
+            if self.pk and (update_fields is None or "is_finalized" in update_fields):
+                self._finalized_before = (
+                    Translation.objects.select_for_update().filter(pk=self.pk)
+                    .values_list("is_finalized", flat=True).first()
+                )
+            super().save(*args, **kwargs)
+
 
 class ParagraphNote(models.Model):
     paragraph = models.ForeignKey(Paragraph, related_name="notes", on_delete=models.CASCADE)
@@ -0,0 +1,45 @@
+# translations/services.py
+from django.db.models import F
+
+from stories.models import Chapter, Paragraph, Story
+from stories.services import _finalized_count, refresh_chapter_counters
+
+
+def apply_finalized_change(paragraph_id: int, translator_id: int, was_finalized: bool, is_finalized: bool) -> None:
+    """
+    Сдвигает translated_count истории и finalized_count главы на ±1, когда перевод
+    назначенного переводчика меняет статус «финализирован». Один SELECT абзаца и два UPDATE
+    с F(), без пересчёта по всей истории — стоимость автосохранения не зависит от её длины.
+    """
+    if was_finalized == is_finalized:
+        return
+    row = (
+        Paragraph.objects.filter(pk=paragraph_id)
+        .values("story_id", "chapter_id", "story__assigned_to_id").first()
+    )
+    if not row or row["story__assigned_to_id"] != translator_id:
+        return
+    stories = Story.objects.filter(pk=row["story_id"])
+    # Абзац без главы: пустой queryset, UPDATE главы не выполняется
+    chapters = Chapter.objects.filter(pk=row["chapter_id"]) if row["chapter_id"] else Chapter.objects.none()
+    if is_finalized:
+        stories.update(translated_count=F("translated_count") + 1)
+        chapters.update(finalized_count=F("finalized_count") + 1)
+    else:
+        # Счётчик мог разойтись с фактом (ручные правки в БД): не уходим ниже нуля
+        stories.filter(translated_count__gt=0).update(translated_count=F("translated_count") - 1)
+        chapters.filter(finalized_count__gt=0).update(finalized_count=F("finalized_count") - 1)
+
+
+def reconcile_story_counters(story: Story) -> bool:
+    """
+    Полный пересчёт translated_count и счётчиков глав (смена переводчика, ручные правки в БД,
+    manage.py reconcile_counters). Возвращает True, если translated_count разошёлся с фактом.
+    """
+    finalized = _finalized_count(story)
+    drifted = story.translated_count != finalized
+    if drifted:
+        story.translated_count = finalized
+        story.save(update_fields=["translated_count"])
+    refresh_chapter_counters(story)
+    return drifted
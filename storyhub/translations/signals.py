@@ -1,31 +1,59 @@
 # translations/signals.py
+import threading
+import weakref
+
 from django.db.models.signals import post_save, post_delete
+from django.db import models
 from django.dispatch import receiver
-from django.db.models import Count
 from .models import Translation, TranslatorAssignment, AssignmentStatus
-from stories.models import Story, StoryStatus
+from .services import apply_finalized_change, reconcile_story_counters
+from stories.models import Paragraph, Story, StoryStatus
+from stories.reader import invalidate_reader_snapshot
+from stories.services import counters_deferred, touch_story_content
+
+@receiver(post_save, sender=Translation)
+def on_translation_saved(sender, instance: Translation, created, **kwargs):
+    # Translation.save читает прежний статус под блокировкой строки; None — статус не записывался
+    was_finalized = False if created else getattr(instance, "_finalized_before", None)
+    if was_finalized is not None:
+        apply_finalized_change(instance.paragraph_id, instance.translator_id, was_finalized, instance.is_finalized)
+    invalidate_reader_snapshot(paragraphs=instance.paragraph_id)
+
+# Истории, уже пересчитанные в текущем каскадном удалении: (weakref на origin, {story_id})
+_cascade = threading.local()
 
-def recompute_translated_count(story: Story):
-    if not story.assigned_to_id:
-        story.translated_count = 0
-        story.save(update_fields=["translated_count"])
+
+def _recount_after_cascade(origin, paragraph_id: int) -> None:
+    """
+    Пересчёт счётчиков истории после каскада (удаление переводчика, абзаца или главы в админке).
+    Collector удаляет все переводы каскада одним пакетом до первого post_delete, поэтому
+    пересчёт по первому же переводу истории уже видит итог; остальные её переводы пропускаем.
+    """
+    ref, done = getattr(_cascade, "state", (None, set()))
+    if ref is None or ref() is not origin:
+        done = set()
+        _cascade.state = (weakref.ref(origin), done)
+    story_id = Paragraph.objects.filter(pk=paragraph_id).values_list("story_id", flat=True).first()
+    if story_id is None or story_id in done:
         return
-    finalized = Translation.objects.filter(
-        paragraph__story=story,
-        translator_id=story.assigned_to_id,
-        is_finalized=True
-    ).values("paragraph_id").distinct().count()
-    if story.translated_count != finalized:
-        story.translated_count = finalized
-        story.save(update_fields=["translated_count"])
+    done.add(story_id)
+    story = Story.objects.filter(pk=story_id).first()
+    if story is not None:
+        reconcile_story_counters(story)
+        touch_story_content(story)
 
-@receiver(post_save, sender=Translation)
-def on_translation_saved(sender, instance: Translation, **kwargs):
-    recompute_translated_count(instance.paragraph.story)
 
 @receiver(post_delete, sender=Translation)
-def on_translation_deleted(sender, instance: Translation, **kwargs):
-    recompute_translated_count(instance.paragraph.story)
+def on_translation_deleted(sender, instance: Translation, origin=None, **kwargs):
+    origin_model = origin.model if isinstance(origin, models.QuerySet) else type(origin)
+    if origin_model is Translation:
+        apply_finalized_change(instance.paragraph_id, instance.translator_id, instance.is_finalized, False)
+        invalidate_reader_snapshot(paragraphs=instance.paragraph_id)
+        return
+    # Разбор пересчитывает счётчики сам; удаляемой истории они уже не нужны
+    if counters_deferred() or origin_model is Story:
+        return
+    _recount_after_cascade(origin, instance.paragraph_id)
 
 @receiver(post_save, sender=TranslatorAssignment)
 def on_assignment_saved(sender, instance: TranslatorAssignment, created, **kwargs):
@@ -36,4 +64,7 @@ def on_assignment_saved(sender, instance: TranslatorAssignment, created, **kwarg
             story.assigned_to_id = instance.translator_id
             story.status = StoryStatus.IN_TRANSLATION
             story.save(update_fields=["assigned_to", "status"])
-        recompute_translated_count(story)
\ No newline at end of file
+            # Сменился переводчик — дельты тут не помогут, считаем заново
+            reconcile_story_counters(story)
+            # Читатели должны получить текст нового переводчика
+            touch_story_content(story)
@@ -2,16 +2,19 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.renderers import TemplateHTMLRenderer
 
 from users.permissions import IsTranslatorGroup, IsAdminGroup
 from .models import Translation, ParagraphNote
-from stories.models import Paragraph, Illustration
+from stories.models import Paragraph, Illustration, ILLUSTRATION_POSITIONS, placeholder_url
+from stories.services import touch_story_content
 from .serializers import TranslationSerializer, ParagraphNoteSerializer
 
 from django.template.loader import render_to_string
 from django.shortcuts import get_object_or_404
 from django.db import transaction
+from django.core.exceptions import ValidationError as DjangoValidationError
 
 def _to_bool(v):
     if isinstance(v, bool):
@@ -28,7 +31,8 @@ class ParagraphTranslationView(APIView):
         # Права (пример): только назначенный переводчик или админ
         story = paragraph.story
         if not (request.user.is_superuser or story.assigned_to_id == request.user.id):
-            return Response(status=403)
+            # У TemplateHTMLRenderer пустой Response(status=403) без шаблона падает с 500
+            raise PermissionDenied()
 
         t = Translation.objects.filter(paragraph=paragraph, translator=request.user).first()
         text = t.text if t and t.text else (paragraph.machine_text or "")
@@ -46,10 +50,10 @@ class ParagraphTranslationView(APIView):
         paragraph = get_object_or_404(Paragraph.objects.select_related('story'), pk=pk)
         story = paragraph.story
         if not (request.user.is_superuser or story.assigned_to_id == request.user.id):
-            return Response(status=403)
+            raise PermissionDenied()
 
         text = (request.data.get("text") or "").strip()
-        is_finalized = request.data.get("is_finalized") == "true"
+        is_finalized = _to_bool(request.data.get("is_finalized", False))
 
         t, _ = Translation.objects.get_or_create(paragraph=paragraph, translator=request.user)
         t.text = text
@@ -135,4 +139,38 @@ class IllustrationSelectView(APIView):
             return Response(status=403)
         ill.is_selected = bool(request.data.get("is_selected", True))
         ill.save(update_fields=["is_selected"])
-        return Response({"ok": True, "is_selected": ill.is_selected})
\ No newline at end of file
+        touch_story_content(ill.paragraph.story)
+        return Response({"ok": True, "is_selected": ill.is_selected})
+
+
+class IllustrationSlotSelectView(APIView):
+    """
+    Выбор иллюстрации по позиции абзаца. Заглушки в БД не хранятся —
+    строка создаётся здесь, при первом выборе или при передаче настоящего image_url.
+    """
+    def post(self, request, pk: int, position: int):
+        p = get_object_or_404(Paragraph.objects.select_related("story"), pk=pk)
+        user = request.user
+        if not (IsAdminGroup().has_permission(request, self) or (IsTranslatorGroup().has_permission(request, self) and p.story.assigned_to_id == user.id)):
+            return Response(status=403)
+        if position not in ILLUSTRATION_POSITIONS:
+            return Response({"detail": "Position must be 1..5"}, status=400)
+
+        is_selected = _to_bool(request.data.get("is_selected", True))
+        image_url = (request.data.get("image_url") or "").strip()
+        ill = Illustration.objects.filter(paragraph=p, position=position).first()
+        if ill is None:
+            if not is_selected and not image_url:
+                # Снятие выбора с заглушки: хранить нечего
+                return Response({"ok": True, "is_selected": False})
+            ill = Illustration(paragraph=p, position=position, image_url=placeholder_url(p.story_id, p.index, position))
+        ill.is_selected = is_selected
+        if image_url:
+            ill.image_url = image_url
+            try:
+                ill.full_clean(exclude=["paragraph"], validate_unique=False)
+            except DjangoValidationError as e:
+                return Response(e.message_dict, status=400)
+        ill.save()
+        touch_story_content(p.story)
+        return Response({"ok": True, "is_selected": ill.is_selected, "id": ill.id})
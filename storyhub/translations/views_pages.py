@@ -193,6 +193,7 @@ class EditorView(LoginRequiredMixin, TemplateView):
                 raise PermissionError("Could not assign story. It might be taken by another translator.")
 
         ctx["story"] = story
+        ctx["progress_percent"] = story.progress_percent
         chapters = story.chapters.all().prefetch_related("paragraphs__illustrations").order_by("index")
         if chapters.exists():
             ctx["chapters"] = chapters
@@ -250,6 +251,7 @@ class EditorByIdView(LoginRequiredMixin, TemplateView):
                 raise PermissionError("Could not assign story. It might be taken by another translator.")
 
         ctx["story"] = story
+        ctx["progress_percent"] = story.progress_percent
         chapters = story.chapters.all().prefetch_related("paragraphs__illustrations").order_by("index")
         ctx["chapters"] = chapters if chapters.exists() else None
         if not ctx["chapters"]: